@@ -28,6 +28,8 @@ def get_default_config():
     cfg.data.norm_std = [0.229, 0.224, 0.225] # default is imagenet std
     cfg.data.save_dir = 'log' # path to save log
     cfg.data.load_train_targets = False # load training set from target dataset
+    cfg.data.image_cache_mb = 0 # shared-memory cache of decoded images (MB), 0 to disable
+    cfg.data.image_cache_resize = False # cache images resized to height x width
 
     # specific datasets
     cfg.market1501 = CN()
@@ -71,6 +73,8 @@ def get_default_config():
     cfg.train.gamma = 0.1 # learning rate decay multiplier
     cfg.train.print_freq = 20 # print frequency
     cfg.train.seed = 1 # random seed
+    cfg.train.distributed = False # DistributedDataParallel, launch with torchrun
+    cfg.train.dist_backend = 'gloo' # backend of torch.distributed, e.g. 'gloo' (cpu), 'nccl' (gpu)
 
     # optimizer
     cfg.sgd = CN()
@@ -92,6 +96,7 @@ def get_default_config():
     cfg.loss.triplet.margin = 0.3 # distance margin
     cfg.loss.triplet.weight_t = 1. # weight to balance hard triplet loss
     cfg.loss.triplet.weight_x = 0. # weight to balance cross entropy loss
+    cfg.loss.triplet.mining = 'batch_hard' # ['batch_hard', 'batch_all', 'semi_hard']
 
     # test
     cfg.test = CN()
@@ -103,8 +108,12 @@ def get_default_config():
     cfg.test.eval_freq = -1 # evaluation frequency (-1 means to only test after training)
     cfg.test.start_eval = 0 # start to evaluate after a specific epoch
     cfg.test.rerank = False # use person re-ranking
+    cfg.test.rerank_method = 'k_reciprocal' # re-ranking method, ['k_reciprocal', 'gnn']
     cfg.test.visrank = False # visualize ranked results (only available when cfg.test.evaluate=True)
     cfg.test.visrank_topk = 10 # top-k ranks to visualize
+    cfg.test.eval_block_size = 0 # rank queries in blocks of this size without building the full distance matrix (0 means disabled)
+    cfg.test.feature_cache_dir = '' # directory to cache extracted query/gallery features across evaluations
+    cfg.test.num_eval_workers = 0 # rank target datasets in worker processes while extracting the next ones
 
     return cfg
 
@@ -136,6 +145,8 @@ def imagedata_kwargs(cfg):
         'cuhk03_labeled': cfg.cuhk03.labeled_images,
         'cuhk03_classic_split': cfg.cuhk03.classic_split,
         'market1501_500k': cfg.market1501.use_500k_distractors,
+        'image_cache_mb': cfg.data.image_cache_mb,
+        'image_cache_resize': cfg.data.image_cache_resize
     }
 
 
@@ -208,5 +219,9 @@ def engine_run_kwargs(cfg):
         'visrank_topk': cfg.test.visrank_topk,
         'use_metric_cuhk03': cfg.cuhk03.use_metric_cuhk03,
         'ranks': cfg.test.ranks,
-        'rerank': cfg.test.rerank
+        'rerank': cfg.test.rerank_method if cfg.test.rerank else False,
+        'eval_block_size': cfg.test.eval_block_size,
+        'feature_cache_dir': cfg.test.feature_cache_dir,
+        'num_eval_workers': cfg.test.num_eval_workers,
+        'distributed': cfg.train.distributed
     }
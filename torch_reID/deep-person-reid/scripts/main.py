@@ -1,9 +1,12 @@
+import os
 import sys
 import time
 import os.path as osp
 import argparse
+import multiprocessing as mp
 import torch
 import torch.nn as nn
+import torch.distributed as dist
 
 import torchreid
 from torchreid.utils import (
@@ -44,6 +47,7 @@ def build_engine(cfg, datamanager, model, optimizer, scheduler):
                 margin=cfg.loss.triplet.margin,
                 weight_t=cfg.loss.triplet.weight_t,
                 weight_x=cfg.loss.triplet.weight_x,
+                mining=cfg.loss.triplet.mining,
                 scheduler=scheduler,
                 use_gpu=cfg.use_gpu,
                 label_smooth=cfg.loss.softmax.label_smooth
@@ -69,6 +73,7 @@ def build_engine(cfg, datamanager, model, optimizer, scheduler):
                 margin=cfg.loss.triplet.margin,
                 weight_t=cfg.loss.triplet.weight_t,
                 weight_x=cfg.loss.triplet.weight_x,
+                mining=cfg.loss.triplet.mining,
                 scheduler=scheduler,
                 use_gpu=cfg.use_gpu,
                 label_smooth=cfg.loss.softmax.label_smooth
@@ -77,6 +82,18 @@ def build_engine(cfg, datamanager, model, optimizer, scheduler):
     return engine
 
 
+def init_distributed(cfg):
+    # torchrun sets RANK, WORLD_SIZE, LOCAL_RANK, LOCAL_WORLD_SIZE,
+    # MASTER_ADDR and MASTER_PORT
+    dist.init_process_group(backend=cfg.train.dist_backend)
+    if cfg.use_gpu:
+        torch.cuda.set_device(int(os.environ.get('LOCAL_RANK', 0)))
+    else:
+        # share the cores of a node between its processes
+        local_world_size = int(os.environ.get('LOCAL_WORLD_SIZE', 1))
+        torch.set_num_threads(max(1, mp.cpu_count() // local_world_size))
+
+
 def reset_config(cfg, args):
     if args.root:
         cfg.data.root = args.root
@@ -137,10 +154,16 @@ def main():
     cfg.merge_from_list(args.opts)
     set_random_seed(cfg.train.seed)
     check_cfg(cfg)
+    if cfg.train.distributed:
+        init_distributed(cfg)
 
     log_name = 'test.log' if cfg.test.evaluate else 'train.log'
     log_name += time.strftime('-%Y-%m-%d-%H-%M-%S')
-    sys.stdout = Logger(osp.join(cfg.data.save_dir, log_name))
+    if cfg.train.distributed and dist.get_rank() > 0:
+        # only the first process prints and logs
+        sys.stdout = open(os.devnull, 'w')
+    else:
+        sys.stdout = Logger(osp.join(cfg.data.save_dir, log_name))
 
     print('Show configuration\n{}\n'.format(cfg))
     print('Collecting env info ...')
@@ -168,7 +191,10 @@ def main():
         load_pretrained_weights(model, cfg.model.load_weights)
 
     if cfg.use_gpu:
-        model = nn.DataParallel(model).cuda()
+        if cfg.train.distributed:
+            model = model.cuda()
+        else:
+            model = nn.DataParallel(model).cuda()
 
     optimizer = torchreid.optim.build_optimizer(model, **optimizer_kwargs(cfg))
     scheduler = torchreid.optim.build_lr_scheduler(
@@ -186,6 +212,9 @@ def main():
     engine = build_engine(cfg, datamanager, model, optimizer, scheduler)
     engine.run(**engine_run_kwargs(cfg))
 
+    if cfg.train.distributed:
+        dist.destroy_process_group()
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,117 @@
+"""
+Compares calling torchreid.utils.FeatureExtractor directly from many threads
+with going through torchreid.utils.MicroBatchingExtractor, in a setting
+similar to a tracking service: each thread repeatedly requests features of
+1-3 random person crops.
+
+How to use:
+$ python tools/benchmark_batching.py --model-name osnet_x1_0 \
+    --model-path model.pth.tar --device cuda --threads 16 --max-batch-size 64
+"""
+import time
+import argparse
+import threading
+import numpy as np
+
+from torchreid.utils import FeatureExtractor, MicroBatchingExtractor
+
+
+def run_clients(fn, num_threads, num_requests, image_size, max_crops):
+    latencies = []
+    lock = threading.Lock()
+
+    def _client(seed):
+        rng = np.random.RandomState(seed)
+        crops = [
+            rng.randint(0, 256, (image_size[0], image_size[1], 3), np.uint8)
+            for _ in range(max_crops)
+        ]
+        for _ in range(num_requests):
+            n = rng.randint(1, max_crops + 1)
+            start = time.time()
+            fn(crops[:n])
+            with lock:
+                latencies.append((time.time() - start, n))
+
+    threads = [
+        threading.Thread(target=_client, args=(i, ))
+        for i in range(num_threads)
+    ]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+
+    num_images = sum(n for _, n in latencies)
+    latencies = np.asarray([latency for latency, _ in latencies]) * 1000
+    return num_images / elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model-name', type=str, default='osnet_x1_0')
+    parser.add_argument('--model-path', type=str, default='')
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--height', type=int, default=256)
+    parser.add_argument('--width', type=int, default=128)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--max-crops', type=int, default=3)
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-wait-ms', type=float, default=5)
+    parser.add_argument('--num-workers', type=int, default=1)
+    args = parser.parse_args()
+
+    image_size = (args.height, args.width)
+    extractor = FeatureExtractor(
+        model_name=args.model_name,
+        model_path=args.model_path,
+        image_size=image_size,
+        device=args.device,
+        verbose=False
+    )
+    # warm up
+    extractor(np.zeros((args.height, args.width, 3), np.uint8))
+
+    print('mode\t\timages/s\tp50 (ms)\tp95 (ms)\tp99 (ms)')
+
+    def _report(mode, throughput, latencies):
+        print(
+            '{:<12}\t{:.1f}\t\t{:.1f}\t\t{:.1f}\t\t{:.1f}'.format(
+                mode, throughput, *np.percentile(latencies, [50, 95, 99])
+            )
+        )
+
+    _report(
+        'direct',
+        *run_clients(
+            extractor, args.threads, args.requests, image_size, args.max_crops
+        )
+    )
+
+    with MicroBatchingExtractor(
+        extractor,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        num_workers=args.num_workers
+    ) as batcher:
+        _report(
+            'micro-batch',
+            *run_clients(
+                batcher, args.threads, args.requests, image_size,
+                args.max_crops
+            )
+        )
+        stats = batcher.stats()
+    print(
+        'Average batch size: {:.1f} ({} requests in {} batches)'.format(
+            stats['avg_batch_size'], stats['num_requests'],
+            stats['num_batches']
+        )
+    )
+
+
+if __name__ == '__main__':
+    main()
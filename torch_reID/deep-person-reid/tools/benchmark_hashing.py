@@ -0,0 +1,125 @@
+"""
+Throughput and recall of two-stage search with binary codes
+(torchreid.metrics.hash_search) against exact brute-force search with
+euclidean_squared_distance.
+
+Features are loaded from .npy files of shape (N, D), e.g. produced by
+torchreid.utils.FeatureExtractor, or synthesized when no file is given.
+The hasher is trained on --train features if given, otherwise on the gallery.
+
+How to use:
+$ python tools/benchmark_hashing.py --gallery gallery.npy --query query.npy \
+    --train train.npy --num-bits 128 256 --num-candidates 500 2000
+"""
+import time
+import numpy as np
+import argparse
+import torch
+
+from torchreid.metrics import (
+    BinaryHasher, hash_search, hamming_distance, compute_distance_matrix
+)
+
+
+def synthesize(num, dim, seed, num_ids=5000):
+    # identity centers plus intra-identity variation, like re-id features
+    centers = torch.randn(
+        num_ids, dim, generator=torch.Generator().manual_seed(0)
+    )
+    generator = torch.Generator().manual_seed(seed)
+    pids = torch.randint(num_ids, (num, ), generator=generator)
+    return centers[pids] + 0.5 * torch.randn(num, dim, generator=generator)
+
+
+def exact_search(qf, gf, k, block_size=256):
+    distances, indices = [], []
+    for start in range(0, qf.size(0), block_size):
+        distmat = compute_distance_matrix(
+            qf[start:start + block_size], gf, 'euclidean'
+        )
+        d, i = distmat.topk(k, dim=1, largest=False)
+        distances.append(d)
+        indices.append(i)
+    return torch.cat(distances), torch.cat(indices)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--gallery', type=str, default='')
+    parser.add_argument('--query', type=str, default='')
+    parser.add_argument('--train', type=str, default='')
+    parser.add_argument('--num-gallery', type=int, default=100000)
+    parser.add_argument('--num-query', type=int, default=1000)
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--method', type=str, default='itq', choices=['sign', 'itq'])
+    parser.add_argument('--num-bits', type=int, nargs='+', default=[64, 128, 256])
+    parser.add_argument(
+        '--num-candidates', type=int, nargs='+', default=[200, 1000]
+    )
+    parser.add_argument('--max-train-size', type=int, default=50000)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--threads', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    if args.gallery:
+        gf = torch.from_numpy(np.load(args.gallery)).float()
+        qf = torch.from_numpy(np.load(args.query)).float()
+    else:
+        gf = synthesize(args.num_gallery, args.dim, 1)
+        qf = synthesize(args.num_query, args.dim, 2)
+    train = torch.from_numpy(np.load(args.train)).float() if args.train else gf
+    train = train[torch.randperm(
+        train.size(0), generator=torch.Generator().manual_seed(0)
+    )[:args.max_train_size]]
+    print(
+        '# gallery: {}, # query: {}, dim: {}'.format(
+            gf.size(0), qf.size(0), gf.size(1)
+        )
+    )
+
+    end = time.time()
+    _, gt = exact_search(qf, gf, args.k)
+    exact_time = time.time() - end
+    print(
+        'Exact: {:.3f} ms/query, memory {:.1f} MB'.format(
+            exact_time * 1000 / qf.size(0),
+            gf.numel() * gf.element_size() / 1024**2
+        )
+    )
+
+    print(
+        'bits\tcandidates\tcodes (MB)\thamming (ms/query)\t'
+        'total (ms/query)\tspeedup\trecall@{}'.format(args.k)
+    )
+    for num_bits in args.num_bits:
+        hasher = BinaryHasher(num_bits, args.method).fit(train)
+        g_codes = hasher.encode(gf)
+        q_codes = hasher.encode(qf)
+
+        end = time.time()
+        hamming_distance(q_codes, g_codes)
+        hamming_time = time.time() - end
+
+        for num_candidates in args.num_candidates:
+            end = time.time()
+            _, ids = hash_search(
+                qf, gf, hasher, g_codes, k=args.k, num_candidates=num_candidates
+            )
+            elapsed = time.time() - end
+            recall = (ids.unsqueeze(2) == gt.unsqueeze(1)).any(1).float().mean()
+            print(
+                '{}\t{}\t\t{:.1f}\t\t{:.3f}\t\t\t{:.3f}\t\t\t{:.1f}x\t{:.4f}'.
+                format(
+                    num_bits, num_candidates, g_codes.nbytes / 1024**2,
+                    hamming_time * 1000 / qf.size(0),
+                    elapsed * 1000 / qf.size(0), exact_time / elapsed,
+                    recall.item()
+                )
+            )
+
+
+if __name__ == '__main__':
+    main()
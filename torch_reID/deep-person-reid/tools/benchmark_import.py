@@ -0,0 +1,123 @@
+"""
+Measures the time to import torchreid entry points in fresh interpreters,
+and optionally fails when an import is slower than a budget so that
+regressions (e.g. a heavy module imported at the top of torchreid) can be
+caught in CI.
+
+"time" is the time of the statement alone. Since "import torchreid" does not
+import torch, the overhead of an entry point is measured as the time of
+"import torch; <statement>" minus the time of "import torch", the two being
+timed in the same interpreter.
+
+How to use:
+$ python tools/benchmark_import.py --repeats 5
+$ python tools/benchmark_import.py --max-overhead 1.0  # exit 1 if slower
+$ python tools/benchmark_import.py --profile "import torchreid.engine"
+"""
+import sys
+import time
+import argparse
+import subprocess
+
+STATEMENTS = [
+    'import torch',
+    'import torchreid',
+    'from torchreid.models import build_model',
+    'from torchreid.utils import FeatureExtractor',
+    'from torchreid import metrics',
+    'import torchreid.data',
+    'import torchreid.engine',
+]
+
+
+def measure(statement, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.time()
+        subprocess.run(
+            [sys.executable, '-W', 'ignore', '-c', statement], check=True
+        )
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def profile(statement, topk):
+    # cumulative time per module from python -X importtime
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-W', 'ignore', '-c', statement],
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True
+    ).stderr
+    records = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        records.append((int(cumulative) / 1e6, module.rstrip()))
+    records.sort(reverse=True)
+    print('Slowest imports of "{}" (cumulative seconds):'.format(statement))
+    for seconds, module in records[:topk]:
+        print('{:8.3f}  {}'.format(seconds, module))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument(
+        '--max-overhead',
+        type=float,
+        default=None,
+        help='maximum seconds on top of "import torch" for torchreid, '
+        'torchreid.models and torchreid.utils'
+    )
+    parser.add_argument(
+        '--profile', type=str, default='', help='statement to profile'
+    )
+    parser.add_argument('--topk', type=int, default=25)
+    args = parser.parse_args()
+
+    if args.profile:
+        profile(args.profile, args.topk)
+        return
+
+    baseline = measure(STATEMENTS[0], args.repeats)
+    results = [(STATEMENTS[0], baseline, 0.)]
+    for statement in STATEMENTS[1:]:
+        seconds = measure(statement, args.repeats)
+        overhead = measure(
+            '{}; {}'.format(STATEMENTS[0], statement), args.repeats
+        ) - baseline
+        results.append((statement, seconds, overhead))
+    print(
+        '| {:<45} | {:>8} | {:>16} |'.format(
+            'statement', 'time (s)', 'over torch (s)'
+        )
+    )
+    print('|' + '|'.join(['-' * n for n in [47, 10, 18]]) + '|')
+    for statement, seconds, overhead in results:
+        print(
+            '| {:<45} | {:>8.2f} | {:>+16.2f} |'.format(
+                statement, seconds, overhead
+            )
+        )
+
+    if args.max_overhead is not None:
+        failed = [
+            (statement, overhead)
+            for statement, _, overhead in results[1:4]
+            if overhead > args.max_overhead
+        ]
+        for statement, overhead in failed:
+            print(
+                'FAILED: "{}" takes {:.2f}s more than "import torch" '
+                '(budget {:.2f}s)'.format(
+                    statement, overhead, args.max_overhead
+                )
+            )
+        if failed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
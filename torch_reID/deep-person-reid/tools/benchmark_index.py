@@ -0,0 +1,120 @@
+"""
+Recall-vs-latency benchmark of torchreid.index.IVFPQIndex against exact
+brute-force search with euclidean_squared_distance/cosine_distance.
+
+Features are loaded from .npy files of shape (N, D), e.g. produced by
+torchreid.utils.FeatureExtractor, or synthesized when no file is given.
+
+How to use:
+$ python tools/benchmark_index.py --gallery gallery.npy --query query.npy \
+    --metric cosine --num-lists 1024 --num-subspaces 32 --nprobe 1 4 16 64
+"""
+import time
+import numpy as np
+import argparse
+import torch
+
+from torchreid.index import IVFPQIndex
+from torchreid.metrics import compute_distance_matrix
+
+
+def synthesize(num, dim, seed, num_ids=5000):
+    # identity centers plus intra-identity variation, like re-id features
+    centers = torch.randn(
+        num_ids, dim, generator=torch.Generator().manual_seed(0)
+    )
+    generator = torch.Generator().manual_seed(seed)
+    pids = torch.randint(num_ids, (num, ), generator=generator)
+    return centers[pids] + 0.5 * torch.randn(num, dim, generator=generator)
+
+
+def exact_search(qf, gf, k, metric, block_size=256):
+    distances, indices = [], []
+    for start in range(0, qf.size(0), block_size):
+        distmat = compute_distance_matrix(
+            qf[start:start + block_size], gf, metric
+        )
+        d, i = distmat.topk(k, dim=1, largest=False)
+        distances.append(d)
+        indices.append(i)
+    return torch.cat(distances), torch.cat(indices)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--gallery', type=str, default='')
+    parser.add_argument('--query', type=str, default='')
+    parser.add_argument('--num-gallery', type=int, default=100000)
+    parser.add_argument('--num-query', type=int, default=1000)
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument(
+        '--metric', type=str, default='euclidean', choices=['euclidean', 'cosine']
+    )
+    parser.add_argument('--num-lists', type=int, default=1024)
+    parser.add_argument('--num-subspaces', type=int, default=32)
+    parser.add_argument('--max-train-size', type=int, default=100000)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--threads', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    if args.gallery:
+        gf = torch.from_numpy(np.load(args.gallery)).float()
+        qf = torch.from_numpy(np.load(args.query)).float()
+    else:
+        gf = synthesize(args.num_gallery, args.dim, 1)
+        qf = synthesize(args.num_query, args.dim, 2)
+    print(
+        '# gallery: {}, # query: {}, dim: {}'.format(
+            gf.size(0), qf.size(0), gf.size(1)
+        )
+    )
+
+    end = time.time()
+    _, gt = exact_search(qf, gf, args.k, args.metric)
+    exact_time = time.time() - end
+    print(
+        'Exact: {:.3f} ms/query, memory {:.1f} MB'.format(
+            exact_time * 1000 / qf.size(0),
+            gf.numel() * gf.element_size() / 1024**2
+        )
+    )
+
+    index = IVFPQIndex(
+        gf.size(1),
+        num_lists=args.num_lists,
+        num_subspaces=args.num_subspaces,
+        metric=args.metric
+    )
+    end = time.time()
+    index.train(gf, max_train_size=args.max_train_size)
+    print('Trained in {:.1f} s'.format(time.time() - end))
+    end = time.time()
+    index.add(gf)
+    print(
+        'Added in {:.1f} s, memory {:.1f} MB'.format(
+            time.time() - end,
+            (index.codes.numel() + index.ids.numel() * 8 + index.norms.numel() * 4) / 1024**2
+        )
+    )
+
+    print('nprobe\tms/query\tspeedup\trecall@{}'.format(args.k))
+    for nprobe in args.nprobe:
+        end = time.time()
+        _, ids = index.search(qf, k=args.k, nprobe=nprobe)
+        elapsed = time.time() - end
+        # fraction of the exact top-k retrieved in the approximate top-k
+        recall = (ids.unsqueeze(2) == gt.unsqueeze(1)).any(1).float().mean()
+        print(
+            '{}\t{:.3f}\t\t{:.1f}x\t{:.4f}'.format(
+                nprobe, elapsed * 1000 / qf.size(0), exact_time / elapsed,
+                recall.item()
+            )
+        )
+
+
+if __name__ == '__main__':
+    main()
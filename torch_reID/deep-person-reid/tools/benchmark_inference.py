@@ -0,0 +1,85 @@
+"""
+Reports the inference latency of models before and after
+torchreid.utils.optimize_for_inference (BatchNorm folding, removal of
+no-op layers).
+
+Models are randomly initialized, which does not affect latency.
+
+How to use:
+$ python tools/benchmark_inference.py --models osnet_x1_0 resnet50 \
+    --batch-size 1 32 --device cpu
+"""
+import time
+import argparse
+import torch
+
+from torchreid.models import build_model
+from torchreid.utils import optimize_for_inference
+
+
+def measure(model, x, num_iters):
+    with torch.no_grad():
+        for _ in range(max(num_iters // 5, 1)):
+            model(x)
+        if x.is_cuda:
+            torch.cuda.synchronize()
+        timings = []
+        for _ in range(num_iters):
+            start = time.time()
+            model(x)
+            if x.is_cuda:
+                torch.cuda.synchronize()
+            timings.append(time.time() - start)
+    timings.sort()
+    return timings[len(timings) // 2] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--models',
+        type=str,
+        nargs='+',
+        default=[
+            'osnet_x1_0', 'osnet_x0_25', 'osnet_ain_x1_0', 'resnet50',
+            'mobilenetv2_x1_0', 'shufflenet_v2_x1_0'
+        ]
+    )
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[1, 32])
+    parser.add_argument('--height', type=int, default=256)
+    parser.add_argument('--width', type=int, default=128)
+    parser.add_argument('--num-iters', type=int, default=20)
+    parser.add_argument('--device', type=str, default='cpu')
+    args = parser.parse_args()
+
+    print(
+        '| {:<20} | {:>5} | {:>10} | {:>14} | {:>7} | {:>9} |'.format(
+            'model', 'batch', 'eager (ms)', 'optimized (ms)', 'speedup',
+            'max error'
+        )
+    )
+    print('|' + '|'.join(['-' * n for n in [22, 7, 12, 16, 9, 11]]) + '|')
+    for name in args.models:
+        model = build_model(name, num_classes=1, pretrained=False)
+        model = model.to(args.device).eval()
+        optimized = optimize_for_inference(
+            model, input_size=(1, 3, args.height, args.width)
+        )
+        for batch_size in args.batch_size:
+            x = torch.randn(
+                batch_size, 3, args.height, args.width, device=args.device
+            )
+            with torch.no_grad():
+                error = (model(x) - optimized(x)).abs().max().item()
+            eager = measure(model, x, args.num_iters)
+            fast = measure(optimized, x, args.num_iters)
+            print(
+                '| {:<20} | {:>5} | {:>10.2f} | {:>14.2f} | {:>6.2f}x | '
+                '{:>9.1e} |'.format(
+                    name, batch_size, eager, fast, eager / fast, error
+                )
+            )
+
+
+if __name__ == '__main__':
+    main()
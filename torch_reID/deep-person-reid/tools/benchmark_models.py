@@ -0,0 +1,279 @@
+"""
+Benchmarks torchreid models on CPU: p50/p95 latency and images/sec at
+several batch sizes and thread counts, peak RSS, params/FLOPs from
+compute_model_complexity and, optionally, rank-1/mAP on a test split.
+
+Each (model, threads) configuration runs in a fresh process so that peak
+RSS is not polluted by other models. Results are written to JSON and/or
+CSV. A previous JSON report can be passed with --baseline to flag latency
+regressions (exit code 1).
+
+How to use:
+$ python tools/benchmark_models.py --models osnet_x1_0 osnet_x0_25 resnet50 \
+    --batch-sizes 1 8 32 --threads 1 4 --json report.json --csv report.csv
+$ python tools/benchmark_models.py --models all --optimize
+$ python tools/benchmark_models.py --models osnet_x1_0 \
+    --weights osnet_x1_0=log/osnet_x1_0/model.pth.tar-250 \
+    --root $DATA --dataset market1501
+$ python tools/benchmark_models.py --models osnet_x1_0 --baseline report.json
+"""
+import sys
+import csv
+import json
+import time
+import argparse
+import platform
+import datetime
+import resource
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+FIELDS = [
+    'model', 'threads', 'batch_size', 'p50_ms', 'p95_ms', 'images_per_sec',
+    'peak_rss_mb', 'params', 'flops', 'rank1', 'mAP', 'error', 'eval_error'
+]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024**2 if sys.platform == 'darwin' else rss / 1024
+
+
+def evaluate(model, args):
+    import numpy as np
+    import torch
+    import torchreid
+    from torchreid import metrics
+
+    datamanager = torchreid.data.ImageDataManager(
+        root=args.root,
+        sources=args.dataset,
+        height=args.height,
+        width=args.width,
+        batch_size_test=args.eval_batch_size,
+        workers=0,
+        use_gpu=False
+    )
+    loaders = datamanager.test_loader[args.dataset]
+
+    def _extract(loader):
+        features, pids, camids = [], [], []
+        with torch.no_grad():
+            for data in loader:
+                features.append(model(data['img']))
+                pids.append(data['pid'].numpy())
+                camids.append(data['camid'].numpy())
+        return torch.cat(features), np.concatenate(pids), \
+            np.concatenate(camids)
+
+    qf, q_pids, q_camids = _extract(loaders['query'])
+    gf, g_pids, g_camids = _extract(loaders['gallery'])
+    distmat = metrics.compute_distance_matrix(qf, gf, 'euclidean').numpy()
+    cmc, mAP = metrics.evaluate_rank(
+        distmat, q_pids, g_pids, q_camids, g_camids, use_cython=False
+    )
+    return float(cmc[0]), float(mAP)
+
+
+def run_config(name, threads, args):
+    """Runs in a child process, returns one row per batch size."""
+    import numpy as np
+    import torch
+    from torchreid.models import build_model
+    from torchreid.utils import (
+        compute_model_complexity, load_pretrained_weights,
+        optimize_for_inference
+    )
+
+    torch.set_num_threads(threads)
+    torch.manual_seed(0)
+    base = dict(model=name, threads=threads)
+    try:
+        model = build_model(name, num_classes=1, pretrained=False)
+        model.eval()
+        weights = args.weights.get(name, '')
+        if weights:
+            load_pretrained_weights(model, weights)
+        input_size = (1, 3, args.height, args.width)
+        params, flops = compute_model_complexity(model, input_size)
+        base.update(params=params, flops=flops)
+        if args.optimize:
+            model = optimize_for_inference(model, input_size=input_size)
+    except Exception as e:
+        return [dict(base, error='{}: {}'.format(type(e).__name__, e))]
+
+    rows = []
+    # increasing batch sizes so that the running peak RSS is the peak of
+    # each batch size
+    for batch_size in sorted(args.batch_sizes):
+        row = dict(base, batch_size=batch_size)
+        x = torch.randn(batch_size, 3, args.height, args.width)
+        try:
+            with torch.no_grad():
+                for _ in range(args.warmup):
+                    model(x)
+                timings = []
+                for _ in range(args.num_iters):
+                    start = time.perf_counter()
+                    model(x)
+                    timings.append(time.perf_counter() - start)
+        except Exception as e:
+            row['error'] = '{}: {}'.format(type(e).__name__, e)
+            rows.append(row)
+            continue
+        timings = np.array(timings) * 1000
+        p50 = float(np.percentile(timings, 50))
+        row.update(
+            p50_ms=p50,
+            p95_ms=float(np.percentile(timings, 95)),
+            images_per_sec=batch_size * 1000 / p50,
+            peak_rss_mb=peak_rss_mb()
+        )
+        rows.append(row)
+
+    if args.root and threads == max(args.threads):
+        try:
+            rank1, mAP = evaluate(model, args)
+            for row in rows:
+                row.update(rank1=rank1, mAP=mAP)
+        except Exception as e:
+            # kept apart from 'error' so that the latencies remain valid
+            for row in rows:
+                row['eval_error'] = '{}: {}'.format(type(e).__name__, e)
+    return rows
+
+
+def compare(rows, baseline_path, tolerance):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def key(r):
+        return r['model'], r['threads'], r.get('batch_size')
+
+    reference = dict(
+        (key(r), r) for r in baseline['results'] if r.get('p50_ms')
+    )
+    regressions = []
+    for row in rows:
+        ref = reference.get(key(row))
+        if ref is None or not row.get('p50_ms'):
+            continue
+        ratio = row['p50_ms'] / ref['p50_ms']
+        if ratio > 1 + tolerance:
+            regressions.append((row, ref, ratio))
+    for row, ref, ratio in regressions:
+        print(
+            'REGRESSION {model} threads={threads} batch={batch_size}: '
+            'p50 {:.2f}ms -> {:.2f}ms ({:+.0%})'.format(
+                ref['p50_ms'], row['p50_ms'], ratio - 1, **row
+            )
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--models',
+        type=str,
+        nargs='+',
+        default=['osnet_x1_0', 'osnet_x0_25', 'resnet50', 'mobilenetv2_x1_0'],
+        help='model names, or "all" for every model in the factory'
+    )
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 32])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1])
+    parser.add_argument('--height', type=int, default=256)
+    parser.add_argument('--width', type=int, default=128)
+    parser.add_argument('--num-iters', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument(
+        '--optimize',
+        action='store_true',
+        help='apply optimize_for_inference (BN folding)'
+    )
+    parser.add_argument(
+        '--weights',
+        type=str,
+        nargs='*',
+        default=[],
+        help='model=path pairs of weights to load'
+    )
+    parser.add_argument(
+        '--root', type=str, default='', help='data root, enables accuracy'
+    )
+    parser.add_argument('--dataset', type=str, default='market1501')
+    parser.add_argument('--eval-batch-size', type=int, default=64)
+    parser.add_argument('--json', type=str, default='')
+    parser.add_argument('--csv', type=str, default='')
+    parser.add_argument('--baseline', type=str, default='')
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=0.1,
+        help='allowed relative p50 increase over the baseline'
+    )
+    args = parser.parse_args()
+    args.weights = dict(w.split('=', 1) for w in args.weights)
+
+    if args.models == ['all']:
+        from torchreid.models import __model_factory
+        args.models = list(__model_factory.keys())
+
+    rows = []
+    for name in args.models:
+        for threads in args.threads:
+            with ProcessPoolExecutor(
+                max_workers=1, mp_context=mp.get_context('spawn')
+            ) as executor:
+                result = executor.submit(run_config, name, threads, args)
+                new_rows = result.result()
+            for row in new_rows:
+                if row.get('error'):
+                    print(
+                        '{model} threads={threads}: {error}'.format(**row)
+                    )
+                else:
+                    print(
+                        '{model:<20} threads={threads:<2} '
+                        'batch={batch_size:<3} p50={p50_ms:8.2f}ms '
+                        'p95={p95_ms:8.2f}ms {images_per_sec:8.1f} img/s '
+                        'rss={peak_rss_mb:.0f}MB'.format(**row)
+                    )
+            if new_rows and new_rows[-1].get('eval_error'):
+                print(
+                    '{model} threads={threads}: evaluation failed, '
+                    '{eval_error}'.format(**new_rows[-1])
+                )
+            rows += new_rows
+
+    report = {
+        'date': datetime.datetime.now().isoformat(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'torch': __import__('torch').__version__,
+        'cpu_count': mp.cpu_count(),
+        'args': dict(
+            (k, v) for k, v in vars(args).items()
+            if k not in ['json', 'csv', 'baseline']
+        ),
+        'results': rows
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('Saved JSON report to "{}"'.format(args.json))
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+        print('Saved CSV report to "{}"'.format(args.csv))
+
+    if args.baseline and compare(rows, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
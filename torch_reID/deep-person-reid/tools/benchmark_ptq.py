@@ -0,0 +1,158 @@
+"""
+Compares int8 models obtained with post-training static quantization
+(torchreid.utils.quantize_model) against float32: rank-1/mAP computed with
+torchreid.metrics.evaluate_rank, CPU latency and model size.
+
+Calibration uses images from ImageDataManager.test_loader.
+
+How to use:
+$ python tools/benchmark_ptq.py --root $DATA --dataset market1501 \
+    --models osnet_x1_0 osnet_ain_x1_0 mobilenetv2_x1_0 \
+    --weights osnet_x1_0.pth osnet_ain_x1_0.pth mobilenetv2_x1_0.pth \
+    --save-dir log/int8
+
+The saved int8 weights can be loaded with
+FeatureExtractor(model_name, model_path, device='cpu', quantized=True).
+"""
+import io
+import os
+import time
+import argparse
+import numpy as np
+import torch
+
+import torchreid
+from torchreid import metrics
+from torchreid.utils import (
+    check_isfile, quantize_model, mkdir_if_missing, load_pretrained_weights
+)
+
+
+def extract(model, data_loader):
+    features, pids, camids = [], [], []
+    num_images, elapsed = 0, 0.
+    with torch.no_grad():
+        for data in data_loader:
+            start = time.time()
+            features.append(model(data['img']))
+            elapsed += time.time() - start
+            num_images += data['img'].size(0)
+            pids.append(data['pid'].numpy())
+            camids.append(data['camid'].numpy())
+    return (
+        torch.cat(features), np.concatenate(pids), np.concatenate(camids),
+        elapsed / num_images * 1000
+    )
+
+
+def evaluate(model, query_loader, gallery_loader, metric):
+    qf, q_pids, q_camids, q_time = extract(model, query_loader)
+    gf, g_pids, g_camids, g_time = extract(model, gallery_loader)
+    distmat = metrics.compute_distance_matrix(qf, gf, metric).numpy()
+    cmc, mAP = metrics.evaluate_rank(
+        distmat, q_pids, g_pids, q_camids, g_camids, use_cython=False
+    )
+    num_q, num_g = len(q_pids), len(g_pids)
+    latency = (q_time*num_q + g_time*num_g) / (num_q+num_g)
+    return cmc[0], mAP, latency
+
+
+def model_size(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 1024**2
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', type=str, required=True)
+    parser.add_argument('--dataset', type=str, default='market1501')
+    parser.add_argument(
+        '--models',
+        type=str,
+        nargs='+',
+        default=['osnet_x1_0', 'osnet_ain_x1_0', 'mobilenetv2_x1_0']
+    )
+    parser.add_argument(
+        '--weights',
+        type=str,
+        nargs='+',
+        default=[],
+        help='float weights, one per model'
+    )
+    parser.add_argument('--height', type=int, default=256)
+    parser.add_argument('--width', type=int, default=128)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument(
+        '--calib-split',
+        type=str,
+        default='query',
+        choices=['query', 'gallery']
+    )
+    parser.add_argument('--num-calib', type=int, default=512)
+    parser.add_argument('--backend', type=str, default='x86')
+    parser.add_argument('--metric', type=str, default='euclidean')
+    parser.add_argument('--num-threads', type=int, default=1)
+    parser.add_argument(
+        '--save-dir', type=str, default='', help='where to save int8 weights'
+    )
+    args = parser.parse_args()
+    torch.set_num_threads(args.num_threads)
+
+    datamanager = torchreid.data.ImageDataManager(
+        root=args.root,
+        sources=args.dataset,
+        height=args.height,
+        width=args.width,
+        batch_size_test=args.batch_size,
+        workers=args.workers,
+        use_gpu=False
+    )
+    loaders = datamanager.test_loader[args.dataset]
+
+    results = []
+    for i, name in enumerate(args.models):
+        model = torchreid.models.build_model(
+            name, num_classes=1, pretrained=False
+        )
+        if i < len(args.weights) and check_isfile(args.weights[i]):
+            load_pretrained_weights(model, args.weights[i])
+        model.eval()
+
+        start = time.time()
+        qmodel = quantize_model(
+            model,
+            loaders[args.calib_split],
+            num_images=args.num_calib,
+            backend=args.backend,
+            input_size=(1, 3, args.height, args.width)
+        )
+        print('Quantization took {:.1f}s'.format(time.time() - start))
+        if args.save_dir:
+            mkdir_if_missing(args.save_dir)
+            fpath = os.path.join(args.save_dir, '{}_int8.pth'.format(name))
+            torch.save({'state_dict': qmodel.state_dict()}, fpath)
+            print('Saved int8 weights to "{}"'.format(fpath))
+
+        for dtype, m in [('float32', model), ('int8', qmodel)]:
+            rank1, mAP, latency = evaluate(
+                m, loaders['query'], loaders['gallery'], args.metric
+            )
+            results.append((name, dtype, rank1, mAP, latency, model_size(m)))
+
+    print(
+        '| {:<18} | {:<7} | {:>6} | {:>6} | {:>14} | {:>9} |'.format(
+            'model', 'dtype', 'rank1', 'mAP', 'latency/img ms', 'size (MB)'
+        )
+    )
+    print('|' + '|'.join(['-' * n for n in [20, 9, 8, 8, 16, 11]]) + '|')
+    for name, dtype, rank1, mAP, latency, size in results:
+        print(
+            '| {:<18} | {:<7} | {:>5.1%} | {:>5.1%} | {:>14.2f} | {:>9.1f} |'.
+            format(name, dtype, rank1, mAP, latency, size)
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Reports memory, distance computation time and accuracy of compressed
+gallery features (torchreid.metrics.quantize_features) against float32.
+
+Features are loaded from a .npz file containing arrays qf, gf, q_pids,
+g_pids, q_camids and g_camids, or synthesized when no file is given.
+
+How to use:
+$ python tools/benchmark_quantization.py --data market1501_features.npz \
+    --metric cosine --normalize
+"""
+import time
+import numpy as np
+import argparse
+import torch
+from torch.nn import functional as F
+
+from torchreid import metrics
+
+
+def synthesize(num_query, num_gallery, dim, num_ids=750, num_cams=6):
+    generator = torch.Generator().manual_seed(0)
+    centers = torch.randn(num_ids, dim, generator=generator)
+    cam_bias = 0.8 * torch.randn(num_cams, dim, generator=generator)
+
+    def _sample(num):
+        pids = torch.randint(num_ids, (num, ), generator=generator)
+        camids = torch.randint(num_cams, (num, ), generator=generator)
+        x = centers[pids] + cam_bias[camids] \
+            + 1.3 * torch.randn(num, dim, generator=generator)
+        # non-negative like features after ReLU and global pooling
+        return F.relu(x), pids.numpy(), camids.numpy()
+
+    qf, q_pids, q_camids = _sample(num_query)
+    gf, g_pids, g_camids = _sample(num_gallery)
+    return qf, gf, q_pids, g_pids, q_camids, g_camids
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', type=str, default='')
+    parser.add_argument('--num-query', type=int, default=3368)
+    parser.add_argument('--num-gallery', type=int, default=15913)
+    parser.add_argument('--dim', type=int, default=2048)
+    parser.add_argument(
+        '--metric', type=str, default='euclidean', choices=['euclidean', 'cosine']
+    )
+    parser.add_argument(
+        '--normalize',
+        action='store_true',
+        help='L2-normalize features before quantization'
+    )
+    parser.add_argument('--use-metric-cuhk03', action='store_true')
+    args = parser.parse_args()
+
+    if args.data:
+        data = np.load(args.data)
+        qf = torch.from_numpy(data['qf']).float()
+        gf = torch.from_numpy(data['gf']).float()
+        q_pids, g_pids = data['q_pids'], data['g_pids']
+        q_camids, g_camids = data['q_camids'], data['g_camids']
+    else:
+        qf, gf, q_pids, g_pids, q_camids, g_camids = synthesize(
+            args.num_query, args.num_gallery, args.dim
+        )
+    if args.normalize:
+        qf = F.normalize(qf, p=2, dim=1)
+        gf = F.normalize(gf, p=2, dim=1)
+    print(
+        '# query: {}, # gallery: {}, dim: {}, metric: {}'.format(
+            qf.size(0), gf.size(0), gf.size(1), args.metric
+        )
+    )
+
+    print('dtype\t\tmemory (MB)\tdistance (s)\tmAP\tdelta\trank-1\tdelta')
+    baseline = None
+    for dtype in ['float32', 'float16', 'int8']:
+        gallery = gf if dtype == 'float32' else \
+            metrics.quantize_features(gf, dtype)
+        nbytes = gf.numel() * 4 if dtype == 'float32' else gallery.nbytes
+
+        end = time.time()
+        distmat = metrics.compute_distance_matrix(qf, gallery, args.metric)
+        elapsed = time.time() - end
+
+        cmc, mAP = metrics.evaluate_rank(
+            distmat.numpy(),
+            q_pids,
+            g_pids,
+            q_camids,
+            g_camids,
+            use_metric_cuhk03=args.use_metric_cuhk03,
+            seed=0
+        )
+        if baseline is None:
+            baseline = (mAP, cmc[0])
+        print(
+            '{:<8}\t{:.1f}\t\t{:.2f}\t\t{:.2%}\t{:+.2%}\t{:.2%}\t{:+.2%}'.format(
+                dtype, nbytes / 1024**2, elapsed, mAP, mAP - baseline[0],
+                cmc[0], cmc[0] - baseline[1]
+            )
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Compares k-reciprocal re-ranking (torchreid.utils.re_ranking) and GNN
+re-ranking (torchreid.utils.gnn_re_ranking) on CPU in terms of speed and
+accuracy.
+
+Features are loaded from a .npz file containing arrays qf, gf, q_pids,
+g_pids, q_camids and g_camids, or synthesized when no file is given.
+
+How to use:
+$ python tools/benchmark_rerank.py --data market1501_features.npz --threads 8
+"""
+import time
+import numpy as np
+import argparse
+import torch
+from torch.nn import functional as F
+
+from torchreid import metrics
+from torchreid.utils import re_ranking, gnn_re_ranking
+
+
+def synthesize(num_query, num_gallery, dim, num_ids=750, num_cams=6):
+    generator = torch.Generator().manual_seed(0)
+    centers = torch.randn(num_ids, dim, generator=generator)
+    cam_bias = 0.8 * torch.randn(num_cams, dim, generator=generator)
+
+    def _sample(num):
+        pids = torch.randint(num_ids, (num, ), generator=generator)
+        camids = torch.randint(num_cams, (num, ), generator=generator)
+        x = centers[pids] + cam_bias[camids] \
+            + 1.3 * torch.randn(num, dim, generator=generator)
+        return x, pids.numpy(), camids.numpy()
+
+    qf, q_pids, q_camids = _sample(num_query)
+    gf, g_pids, g_camids = _sample(num_gallery)
+    return qf, gf, q_pids, g_pids, q_camids, g_camids
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', type=str, default='')
+    parser.add_argument('--num-query', type=int, default=3368)
+    parser.add_argument('--num-gallery', type=int, default=15913)
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--k1', type=int, default=20)
+    parser.add_argument('--k2', type=int, default=6)
+    parser.add_argument('--gnn-k1', type=int, default=26)
+    parser.add_argument('--gnn-k2', type=int, default=7)
+    parser.add_argument('--threads', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    if args.data:
+        data = np.load(args.data)
+        qf = torch.from_numpy(data['qf']).float()
+        gf = torch.from_numpy(data['gf']).float()
+        q_pids, g_pids = data['q_pids'], data['g_pids']
+        q_camids, g_camids = data['q_camids'], data['g_camids']
+    else:
+        qf, gf, q_pids, g_pids, q_camids, g_camids = synthesize(
+            args.num_query, args.num_gallery, args.dim
+        )
+    qf = F.normalize(qf, p=2, dim=1)
+    gf = F.normalize(gf, p=2, dim=1)
+    print(
+        '# query: {}, # gallery: {}, threads: {}'.format(
+            qf.size(0), gf.size(0), torch.get_num_threads()
+        )
+    )
+
+    def _k_reciprocal():
+        distmat = metrics.compute_distance_matrix(qf, gf).numpy()
+        distmat_qq = metrics.compute_distance_matrix(qf, qf).numpy()
+        distmat_gg = metrics.compute_distance_matrix(gf, gf).numpy()
+        return re_ranking(
+            distmat, distmat_qq, distmat_gg, k1=args.k1, k2=args.k2
+        )
+
+    methods = [
+        ('none', lambda: metrics.compute_distance_matrix(qf, gf).numpy()),
+        ('k_reciprocal', _k_reciprocal),
+        ('gnn', lambda: gnn_re_ranking(qf, gf, k1=args.gnn_k1, k2=args.gnn_k2))
+    ]
+
+    print('method\t\ttime (s)\tmAP\trank-1')
+    for name, fn in methods:
+        end = time.time()
+        distmat = fn()
+        elapsed = time.time() - end
+        cmc, mAP = metrics.evaluate_rank(
+            distmat, q_pids, g_pids, q_camids, g_camids
+        )
+        print(
+            '{:<12}\t{:.2f}\t\t{:.1%}\t{:.1%}'.format(
+                name, elapsed, mAP, cmc[0]
+            )
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Measures the forward + backward time of TripletLoss for each mining
+strategy at several batch sizes, next to the former per-anchor Python
+loop. Batches follow RandomIdentitySampler, i.e. batch_size // num_instances
+identities with num_instances images each.
+
+How to use:
+$ python tools/benchmark_triplet.py
+$ python tools/benchmark_triplet.py --batch-sizes 64 128 256 512 \
+    --feat-dim 2048 --device cuda
+"""
+import time
+import argparse
+import torch
+import torch.nn as nn
+
+from torchreid.losses import TripletLoss
+
+
+class LoopTripletLoss(nn.Module):
+    """Batch-hard triplet loss with one Python iteration per anchor, as
+    implemented before the masked reductions."""
+
+    def __init__(self, margin=0.3):
+        super(LoopTripletLoss, self).__init__()
+        self.ranking_loss = nn.MarginRankingLoss(margin=margin)
+
+    def forward(self, inputs, targets):
+        n = inputs.size(0)
+        dist = torch.pow(inputs, 2).sum(dim=1, keepdim=True).expand(n, n)
+        dist = dist + dist.t()
+        dist.addmm_(inputs, inputs.t(), beta=1, alpha=-2)
+        dist = dist.clamp(min=1e-12).sqrt()
+        mask = targets.expand(n, n).eq(targets.expand(n, n).t())
+        dist_ap, dist_an = [], []
+        for i in range(n):
+            dist_ap.append(dist[i][mask[i]].max().unsqueeze(0))
+            dist_an.append(dist[i][mask[i] == 0].min().unsqueeze(0))
+        dist_ap = torch.cat(dist_ap)
+        dist_an = torch.cat(dist_an)
+        y = torch.ones_like(dist_an)
+        return self.ranking_loss(dist_an, dist_ap, y)
+
+
+def step_time(criterion, features, targets, num_iters, warmup):
+    def sync():
+        if features.is_cuda:
+            torch.cuda.synchronize()
+
+    timings = []
+    for i in range(warmup + num_iters):
+        inputs = features.clone().requires_grad_()
+        sync()
+        start = time.perf_counter()
+        criterion(inputs, targets).backward()
+        sync()
+        if i >= warmup:
+            timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--batch-sizes', type=int, nargs='+', default=[64, 128, 256, 512]
+    )
+    parser.add_argument('--num-instances', type=int, default=4)
+    parser.add_argument('--feat-dim', type=int, default=512)
+    parser.add_argument('--margin', type=float, default=0.3)
+    parser.add_argument('--num-iters', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--device', type=str, default='cpu')
+    args = parser.parse_args()
+
+    criteria = [('loop', LoopTripletLoss(args.margin))]
+    for mining in ['batch_hard', 'batch_all', 'semi_hard']:
+        criteria.append((mining, TripletLoss(args.margin, mining=mining)))
+
+    print('Median forward + backward time (ms)')
+    header = '| {:>10} |'.format('batch size') + ''.join(
+        ' {:>10} |'.format(name) for name, _ in criteria
+    ) + ' {:>10} |'.format('speedup')
+    print(header)
+    print('|' + '|'.join(['-' * 12] * (len(criteria) + 2)) + '|')
+    torch.manual_seed(0)
+    for batch_size in args.batch_sizes:
+        num_pids = batch_size // args.num_instances
+        targets = torch.arange(num_pids).repeat_interleave(args.num_instances)
+        targets = targets.to(args.device)
+        features = torch.randn(
+            targets.numel(), args.feat_dim, device=args.device
+        )
+        timings = [
+            step_time(
+                criterion, features, targets, args.num_iters, args.warmup
+            ) for _, criterion in criteria
+        ]
+        print(
+            '| {:>10} |'.format(batch_size) +
+            ''.join(' {:>10.2f} |'.format(t) for t in timings) +
+            ' {:>9.1f}x |'.format(timings[0] / timings[1])
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Exports a re-id model to a self-contained TorchScript archive
+(torchreid.utils.export_model): BatchNorm folded, traced, frozen, with the
+preprocessing parameters embedded. FeatureExtractor(model_path=archive)
+then starts without building the Python model.
+
+How to use:
+$ python tools/export_model.py --model-name osnet_x1_0 \
+    --weights log/osnet_x1_0/model.pth.tar-250 --output osnet_x1_0.pt \
+    --benchmark
+
+Int8 weights saved by tools/benchmark_ptq.py can be exported with
+--quantized.
+"""
+import sys
+import argparse
+import subprocess
+
+from torchreid.models import build_model
+from torchreid.utils import (
+    export_model, load_quantized_model, load_pretrained_weights
+)
+
+
+def cold_start(kwargs, image_size, repeats):
+    # time to a first feature in a fresh interpreter, imports included
+    code = (
+        'import time; start = time.time()\n'
+        'import torch\n'
+        'from torchreid.utils import FeatureExtractor\n'
+        'extractor = FeatureExtractor(verbose=False, device="cpu", **{})\n'
+        'extractor(torch.rand(1, 3, {}, {}))\n'
+        'print(time.time() - start)\n'
+    ).format(repr(kwargs), image_size[0], image_size[1])
+    timings = []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, '-W', 'ignore', '-c', code],
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            check=True
+        ).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model-name', type=str, required=True)
+    parser.add_argument('--weights', type=str, required=True)
+    parser.add_argument('--output', type=str, required=True)
+    parser.add_argument('--height', type=int, default=256)
+    parser.add_argument('--width', type=int, default=128)
+    parser.add_argument(
+        '--pixel-mean', type=float, nargs=3, default=[0.485, 0.456, 0.406]
+    )
+    parser.add_argument(
+        '--pixel-std', type=float, nargs=3, default=[0.229, 0.224, 0.225]
+    )
+    parser.add_argument('--no-pixel-norm', action='store_true')
+    parser.add_argument(
+        '--method', type=str, default='trace', choices=['trace', 'script']
+    )
+    parser.add_argument(
+        '--quantized',
+        action='store_true',
+        help='weights are int8 weights from quantize_model'
+    )
+    parser.add_argument(
+        '--benchmark',
+        action='store_true',
+        help='compare cold-start time with building the model'
+    )
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    image_size = (args.height, args.width)
+
+    model = build_model(args.model_name, num_classes=1, pretrained=False)
+    model.eval()
+    if args.quantized:
+        model = load_quantized_model(
+            model, args.weights, input_size=(1, 3) + image_size
+        )
+    else:
+        load_pretrained_weights(model, args.weights)
+
+    meta = export_model(
+        model,
+        args.output,
+        image_size=image_size,
+        pixel_mean=args.pixel_mean,
+        pixel_std=args.pixel_std,
+        pixel_norm=not args.no_pixel_norm,
+        model_name=args.model_name,
+        optimize=not args.quantized,
+        method=args.method
+    )
+    print('Exported to "{}": {}'.format(args.output, meta))
+
+    if args.benchmark:
+        baseline = dict(
+            model_name=args.model_name,
+            model_path=args.weights,
+            image_size=image_size,
+            quantized=args.quantized
+        )
+        before = cold_start(baseline, image_size, args.repeats)
+        after = cold_start(
+            dict(model_path=args.output), image_size, args.repeats
+        )
+        print('Cold start (imports, loading, first forward):')
+        print('- model_name + weights: {:.2f}s'.format(before))
+        print('- exported archive: {:.2f}s'.format(after))
+
+
+if __name__ == '__main__':
+    main()
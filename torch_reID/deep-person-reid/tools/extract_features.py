@@ -0,0 +1,140 @@
+"""
+Extracts features of a directory (or a manifest) of images into fixed-size
+sharded .npy files, see torchreid.utils.ShardedFeatureWriter.
+
+The i-th feature row corresponds to the i-th line of OUTPUT/manifest.txt.
+Running the same command again resumes an interrupted extraction, a
+different model, decoder or preprocessing requires --overwrite.
+
+How to use:
+$ python tools/extract_features.py --root crops/ --output features/ \
+    --model-name osnet_x1_0 --model-path model.pth.tar --device cuda
+
+$ python tools/extract_features.py --manifest crops.txt --output features/ \
+    --model-name osnet_x1_0 --model-path model.pth.tar --shard-size 500000
+
+Features can then be read with
+>>> from torchreid.utils import iter_feature_shards
+>>> for paths, features in iter_feature_shards('features/'):
+>>>     ...
+"""
+import sys
+import time
+import datetime
+import argparse
+import os.path as osp
+
+from torchreid.utils import (
+    FeatureExtractor, ShardedFeatureWriter, list_images, read_manifest
+)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', type=str, default='', help='image directory')
+    parser.add_argument(
+        '--manifest',
+        type=str,
+        default='',
+        help='text file with one image path per line'
+    )
+    parser.add_argument('--output', type=str, required=True)
+    parser.add_argument('--model-name', type=str, default='osnet_x1_0')
+    parser.add_argument('--model-path', type=str, default='')
+    parser.add_argument('--device', type=str, default='cuda')
+    parser.add_argument('--height', type=int, default=256)
+    parser.add_argument('--width', type=int, default=128)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--num-workers', type=int, default=4)
+    parser.add_argument('--use-cv2', action='store_true')
+    parser.add_argument('--shard-size', type=int, default=100000)
+    parser.add_argument(
+        '--dtype', type=str, default='float32', choices=['float32', 'float16']
+    )
+    parser.add_argument(
+        '--overwrite',
+        action='store_true',
+        help='discard existing results instead of resuming'
+    )
+    parser.add_argument('--print-freq', type=int, default=50)
+    args = parser.parse_args()
+
+    if bool(args.root) == bool(args.manifest):
+        sys.exit('Please specify exactly one of --root and --manifest')
+
+    if args.root:
+        print('Listing images in "{}" ...'.format(args.root))
+        paths = list_images(args.root)
+    else:
+        paths = read_manifest(args.manifest)
+    print('Found {} images'.format(len(paths)))
+
+    extractor = FeatureExtractor(
+        model_name=args.model_name,
+        model_path=args.model_path,
+        image_size=(args.height, args.width),
+        device=args.device,
+        verbose=False
+    )
+
+    model_path = osp.abspath(args.model_path) if args.model_path else ''
+    try:
+        writer = ShardedFeatureWriter(
+            args.output,
+            paths,
+            shard_size=args.shard_size,
+            dtype=args.dtype,
+            meta={
+                'model_name': args.model_name,
+                'model_path': model_path,
+                # the preprocessing actually used, exported models
+                # override the command line
+                'image_size': list(extractor.image_size),
+                'pixel_mean': list(extractor.pixel_mean),
+                'pixel_std': list(extractor.pixel_std),
+                'pixel_norm': extractor.pixel_norm,
+                'use_cv2': args.use_cv2
+            },
+            resume=not args.overwrite
+        )
+    except ValueError as e:
+        sys.exit('{}\nPlease use --overwrite to discard them'.format(e))
+    if writer.num_done == len(paths):
+        print('All features have already been extracted')
+        return
+    if writer.num_done > 0:
+        print('Resuming from image {}'.format(writer.num_done))
+
+    todo = paths[writer.num_done:]
+    num_done = 0
+    start_time = time.time()
+    with writer:
+        stream = extractor.extract_paths(
+            todo,
+            batch_size=args.batch_size,
+            num_workers=args.num_workers,
+            use_cv2=args.use_cv2
+        )
+        for batch_idx, features in enumerate(stream):
+            writer.write(features)
+            num_done += features.size(0)
+            if (batch_idx+1) % args.print_freq == 0 or num_done == len(todo):
+                elapsed = time.time() - start_time
+                speed = num_done / elapsed
+                eta = (len(todo) - num_done) / speed
+                print(
+                    '[{}/{}]\t{:.1f} images/sec\teta {}'.format(
+                        writer.num_done, len(paths), speed,
+                        str(datetime.timedelta(seconds=int(eta)))
+                    )
+                )
+
+    print(
+        'Done, features saved to "{}" ({:.1f} images/sec)'.format(
+            args.output, num_done / (time.time() - start_time)
+        )
+    )
+
+
+if __name__ == '__main__':
+    main()
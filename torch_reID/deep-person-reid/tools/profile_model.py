@@ -0,0 +1,61 @@
+"""
+Prints the per-module and per-type runtime profile of a model
+(torchreid.utils.profile_model) and optionally saves it as JSON.
+
+How to use:
+$ python tools/profile_model.py --model-name osnet_x1_0 --topk 30
+$ python tools/profile_model.py --model-name osnet_x1_0 --max-depth 2 \
+    --sort-by total_ms --json osnet_profile.json
+"""
+import json
+import argparse
+import torch
+
+from torchreid.models import build_model
+from torchreid.utils import (
+    profile_model, print_profile, load_pretrained_weights,
+    optimize_for_inference
+)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model-name', type=str, required=True)
+    parser.add_argument('--weights', type=str, default='')
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--height', type=int, default=256)
+    parser.add_argument('--width', type=int, default=128)
+    parser.add_argument('--num-iters', type=int, default=10)
+    parser.add_argument('--num-threads', type=int, default=0)
+    parser.add_argument(
+        '--optimize',
+        action='store_true',
+        help='profile the model after optimize_for_inference'
+    )
+    parser.add_argument('--sort-by', type=str, default='self_ms')
+    parser.add_argument('--topk', type=int, default=20)
+    parser.add_argument('--max-depth', type=int, default=None)
+    parser.add_argument('--json', type=str, default='')
+    args = parser.parse_args()
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+
+    model = build_model(args.model_name, num_classes=1, pretrained=False)
+    if args.weights:
+        load_pretrained_weights(model, args.weights)
+    input_size = (args.batch_size, 3, args.height, args.width)
+    if args.optimize:
+        model = optimize_for_inference(model, input_size=input_size)
+
+    profile = profile_model(model, input_size, num_iters=args.num_iters)
+    print_profile(
+        profile, sort_by=args.sort_by, topk=args.topk, max_depth=args.max_depth
+    )
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(profile, f, indent=2)
+        print('Saved profile to "{}"'.format(args.json))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,27 @@
 from __future__ import print_function, absolute_import
+import importlib
 
-from torchreid import data, optim, utils, engine, losses, models, metrics
+# subpackages are imported on first access, e.g. torchreid.data, so that
+# "from torchreid.utils import FeatureExtractor" does not pull in the data
+# and training stack
+_submodules = [
+    'data', 'optim', 'utils', 'index', 'engine', 'losses', 'models', 'metrics'
+]
 
 __version__ = '1.4.0'
 __author__ = 'Kaiyang Zhou'
 __homepage__ = 'https://kaiyangzhou.github.io/'
 __description__ = 'Deep learning person re-identification in PyTorch'
 __url__ = 'https://github.com/KaiyangZhou/deep-person-reid'
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError(
+        'module {!r} has no attribute {!r}'.format(__name__, name)
+    )
+
+
+def __dir__():
+    return sorted(list(globals()) + _submodules)
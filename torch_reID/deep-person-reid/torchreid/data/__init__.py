@@ -4,4 +4,5 @@ from .datasets import (
     Dataset, ImageDataset, VideoDataset, register_image_dataset,
     register_video_dataset
 )
+from .image_cache import SharedImageCache
 from .datamanager import ImageDataManager, VideoDataManager
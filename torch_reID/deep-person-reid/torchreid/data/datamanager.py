@@ -2,6 +2,7 @@ from __future__ import division, print_function, absolute_import
 import torch
 
 from torchreid.data.sampler import build_train_sampler
+from torchreid.data.image_cache import SharedImageCache
 from torchreid.data.datasets import init_image_dataset, init_video_dataset
 from torchreid.data.transforms import build_transforms
 
@@ -127,6 +128,11 @@ class ImageDataManager(DataManager):
             Default is False.
         market1501_500k (bool, optional): add 500K distractors to the gallery
             set in market1501. Default is False.
+        image_cache_mb (int, optional): if positive, decoded images of all
+            splits are cached in shared memory (``SharedImageCache``) with this
+            budget in MB, shared by the data loader workers. Default is 0.
+        image_cache_resize (bool, optional): cache images resized to
+            height x width instead of their original size. Default is False.
 
     Examples::
 
@@ -175,7 +181,9 @@ class ImageDataManager(DataManager):
         train_sampler_t='RandomSampler',
         cuhk03_labeled=False,
         cuhk03_classic_split=False,
-        market1501_500k=False
+        market1501_500k=False,
+        image_cache_mb=0,
+        image_cache_resize=False
     ):
 
         super(ImageDataManager, self).__init__(
@@ -331,6 +339,23 @@ class ImageDataManager(DataManager):
             self.test_dataset[name]['query'] = queryset.query
             self.test_dataset[name]['gallery'] = galleryset.gallery
 
+        self.image_cache = None
+        if image_cache_mb > 0:
+            datasets = [self.train_loader.dataset]
+            if self.train_loader_t is not None:
+                datasets.append(self.train_loader_t.dataset)
+            for loaders in self.test_loader.values():
+                datasets += [loaders['query'].dataset, loaders['gallery'].dataset]
+            self.image_cache = SharedImageCache(
+                sum(len(dataset) for dataset in datasets),
+                image_cache_mb * 1024**2,
+                image_size=(height, width) if image_cache_resize else None
+            )
+            offset = 0
+            for dataset in datasets:
+                dataset.set_image_cache(self.image_cache, offset)
+                offset += len(dataset)
+
         print('\n')
         print('  **************** Summary ****************')
         print('  source            : {}'.format(self.sources))
@@ -319,11 +319,29 @@ class ImageDataset(Dataset):
     """
 
     def __init__(self, train, query, gallery, **kwargs):
+        self.image_cache = None
+        self.image_cache_offset = 0
         super(ImageDataset, self).__init__(train, query, gallery, **kwargs)
 
+    def set_image_cache(self, cache, offset=0):
+        """Reads images through a ``torchreid.data.SharedImageCache``.
+
+        Args:
+            cache (SharedImageCache): cache, or None to disable caching.
+            offset (int, optional): key of the first image of this dataset
+                in the cache, so that several datasets can share a cache.
+        """
+        self.image_cache = cache
+        self.image_cache_offset = offset
+
     def __getitem__(self, index):
         img_path, pid, camid, dsetid = self.data[index]
-        img = read_image(img_path)
+        if self.image_cache is not None:
+            img = self.image_cache.read_image(
+                self.image_cache_offset + index, img_path
+            )
+        else:
+            img = read_image(img_path)
         if self.transform is not None:
             img = self._transform_image(self.transform, self.k_tfm, img)
         item = {
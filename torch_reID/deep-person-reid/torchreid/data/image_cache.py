@@ -0,0 +1,222 @@
+from __future__ import division, print_function, absolute_import
+import numpy as np
+import multiprocessing as mp
+import torch
+from PIL import Image
+
+from torchreid.utils import read_image
+
+__all__ = ['SharedImageCache']
+
+# columns of the item table
+_FIRST_PAGE, _NBYTES, _HEIGHT, _WIDTH, _LAST_USED = range(5)
+# entries of the counter array
+_NUM_FREE, _CLOCK, _HITS, _MISSES, _EVICTIONS, _USED_BYTES = range(6)
+
+
+def _shared_tensor(shape, dtype):
+    # allocates the shared memory directly, share_memory_() would allocate
+    # private memory first and copy it
+    numel = int(np.prod(shape))
+    element_size = torch.empty(0, dtype=dtype).element_size()
+    storage = torch.UntypedStorage._new_shared(numel * element_size)
+    tensor = torch.empty(0, dtype=dtype)
+    tensor.set_(storage, 0, (numel, ))
+    return tensor.view(*shape)
+
+
+class SharedImageCache(object):
+    """Cache of decoded images in shared memory.
+
+    Decoded uint8 images are stored in an arena of fixed-size pages which
+    lives in shared memory, so that the DataLoader workers (forked or
+    spawned) and the main process share a single cache. When the byte budget
+    is exceeded, the least recently used images are evicted. Images can be
+    resized to the input size of the model before being cached, which saves
+    memory and the resizing, and gives identical results as long as the
+    transforms start with a resize to the same size (as in
+    ``torchreid.data.transforms.build_transforms``).
+
+    Hits, misses and evictions are counted across processes, see
+    ``stats()``.
+
+    Args:
+        num_items (int): number of images, keys are in [0, num_items).
+        max_bytes (int): memory budget of the cached images.
+        image_size (tuple, optional): (height, width) to resize images to
+            before caching. Default is None (original size).
+        page_size (int, optional): size of a page in bytes. Default is 8192.
+
+    Examples::
+        >>> cache = SharedImageCache(len(dataset), 2 * 1024**3, (256, 128))
+        >>> dataset.set_image_cache(cache)
+        >>> loader = torch.utils.data.DataLoader(dataset, num_workers=4)
+        >>> cache.stats()['hit_rate']
+    """
+
+    def __init__(self, num_items, max_bytes, image_size=None, page_size=8192):
+        num_pages = int(max_bytes) // page_size
+        if num_pages <= 0:
+            raise ValueError(
+                'max_bytes={} is smaller than page_size={}'.format(
+                    max_bytes, page_size
+                )
+            )
+        self.num_items = num_items
+        self.image_size = tuple(image_size) if image_size else None
+        self.page_size = page_size
+        self.num_pages = num_pages
+
+        self._pages = _shared_tensor((num_pages, page_size), torch.uint8)
+        self._next_page = _shared_tensor((num_pages, ), torch.int64)
+        self._free_pages = _shared_tensor((num_pages, ), torch.int64)
+        self._items = _shared_tensor((num_items, 5), torch.int64)
+        self._counters = _shared_tensor((6, ), torch.int64)
+        self._free_pages.copy_(torch.arange(num_pages))
+        self._items.fill_(0)
+        self._items[:, _FIRST_PAGE] = -1
+        self._counters.fill_(0)
+        self._counters[_NUM_FREE] = num_pages
+        # a lock of the spawn context can be shared with both forked and
+        # spawned workers, the one of the fork context cannot be pickled
+        self._lock = mp.get_context('spawn').Lock()
+        self._init_views()
+
+    def _init_views(self):
+        # numpy views of the shared tensors, much faster to index
+        self._pages_np = self._pages.numpy()
+        self._next_page_np = self._next_page.numpy()
+        self._free_pages_np = self._free_pages.numpy()
+        self._items_np = self._items.numpy()
+        self._counters_np = self._counters.numpy()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in list(state.keys()):
+            if name.endswith('_np'):
+                del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_views()
+
+    def __len__(self):
+        return int((self._items_np[:, _FIRST_PAGE] >= 0).sum())
+
+    def __contains__(self, key):
+        return self._items_np[key, _FIRST_PAGE] >= 0
+
+    def _num_pages_of(self, nbytes):
+        return -(-nbytes // self.page_size)
+
+    def _chain(self, first_page, num_pages):
+        pages = np.empty(num_pages, dtype=np.int64)
+        page = first_page
+        for i in range(num_pages):
+            pages[i] = page
+            page = self._next_page_np[page]
+        return pages
+
+    def get(self, key):
+        """Returns the cached image as a (height, width, 3) uint8 array, or
+        None."""
+        items, counters = self._items_np, self._counters_np
+        with self._lock:
+            first_page = items[key, _FIRST_PAGE]
+            if first_page < 0:
+                counters[_MISSES] += 1
+                return None
+            counters[_HITS] += 1
+            counters[_CLOCK] += 1
+            items[key, _LAST_USED] = counters[_CLOCK]
+            nbytes = items[key, _NBYTES]
+            shape = (items[key, _HEIGHT], items[key, _WIDTH], 3)
+            pages = self._chain(first_page, self._num_pages_of(nbytes))
+            data = self._pages_np[pages]
+        return data.reshape(-1)[:nbytes].reshape(shape)
+
+    def put(self, key, img):
+        """Caches a (height, width, 3) uint8 array. Returns False if the
+        image does not fit in the cache."""
+        img = np.ascontiguousarray(img, dtype=np.uint8)
+        nbytes = img.nbytes
+        num_pages = self._num_pages_of(nbytes)
+        if num_pages > self.num_pages:
+            return False
+        data = np.zeros((num_pages, self.page_size), dtype=np.uint8)
+        data.reshape(-1)[:nbytes] = img.reshape(-1)
+
+        items, counters = self._items_np, self._counters_np
+        with self._lock:
+            if items[key, _FIRST_PAGE] >= 0:
+                # cached by another worker in the meantime
+                return True
+            if counters[_NUM_FREE] < num_pages:
+                self._evict(num_pages)
+            num_free = counters[_NUM_FREE] - num_pages
+            pages = self._free_pages_np[num_free:num_free + num_pages].copy()
+            counters[_NUM_FREE] = num_free
+            self._pages_np[pages] = data
+            self._next_page_np[pages[:-1]] = pages[1:]
+            self._next_page_np[pages[-1]] = -1
+            counters[_CLOCK] += 1
+            items[key] = (
+                pages[0], nbytes, img.shape[0], img.shape[1], counters[_CLOCK]
+            )
+            counters[_USED_BYTES] += nbytes
+        return True
+
+    def _evict(self, num_pages):
+        # evicts images in LRU order, freeing a few more pages than needed
+        # to amortize the sort over several insertions
+        items, counters = self._items_np, self._counters_np
+        target = max(num_pages, self.num_pages // 64)
+        cached = np.flatnonzero(items[:, _FIRST_PAGE] >= 0)
+        order = cached[np.argsort(items[cached, _LAST_USED], kind='stable')]
+        for key in order:
+            if counters[_NUM_FREE] >= target:
+                break
+            nbytes = items[key, _NBYTES]
+            pages = self._chain(
+                items[key, _FIRST_PAGE], self._num_pages_of(nbytes)
+            )
+            num_free = counters[_NUM_FREE]
+            self._free_pages_np[num_free:num_free + len(pages)] = pages
+            counters[_NUM_FREE] = num_free + len(pages)
+            items[key, _FIRST_PAGE] = -1
+            counters[_EVICTIONS] += 1
+            counters[_USED_BYTES] -= nbytes
+
+    def read_image(self, key, path):
+        """Returns the image of ``path`` as a PIL image, from the cache if
+        possible, otherwise reads (and resizes) it and caches it."""
+        img = self.get(key)
+        if img is not None:
+            return Image.fromarray(img)
+        img = read_image(path)
+        if self.image_size is not None:
+            height, width = self.image_size
+            img = img.resize((width, height), Image.BILINEAR)
+        self.put(key, np.asarray(img))
+        return img
+
+    def stats(self):
+        """Returns a dictionary with the number of hits, misses and
+        evictions, the hit rate, the number of cached images and the memory
+        they use."""
+        counters = self._counters_np.copy()
+        hits, misses = int(counters[_HITS]), int(counters[_MISSES])
+        return {
+            'hits': hits,
+            'misses': misses,
+            'evictions': int(counters[_EVICTIONS]),
+            'hit_rate': hits / max(hits + misses, 1),
+            'num_images': len(self),
+            'used_bytes': int(counters[_USED_BYTES]),
+            'max_bytes': self.num_pages * self.page_size
+        }
+
+    def reset_stats(self):
+        with self._lock:
+            self._counters_np[[_HITS, _MISSES, _EVICTIONS]] = 0
@@ -1,9 +1,10 @@
 from __future__ import division, absolute_import
-import copy
 import numpy as np
 import random
 from collections import defaultdict
+import torch.distributed as dist
 from torch.utils.data.sampler import Sampler, RandomSampler, SequentialSampler
+from torch.utils.data.distributed import DistributedSampler
 
 AVAI_SAMPLERS = [
     'RandomIdentitySampler', 'SequentialSampler', 'RandomSampler',
@@ -11,16 +12,114 @@ AVAI_SAMPLERS = [
 ]
 
 
-class RandomIdentitySampler(Sampler):
+class EpochBatchSampler(Sampler):
+    """Base class of the samplers which sample the indices of a whole epoch
+    at once, in batches of ``batch_len`` indices.
+
+    The indices of an epoch are sampled when the length is requested (e.g.
+    by ``len(DataLoader)``) and consumed by the next ``__iter__``, so that
+    ``__len__`` is exact even if the number of batches is random.
+
+    With ``num_replicas > 1`` (multi-process training), every process
+    samples the same epoch from a generator seeded with ``seed + epoch`` and
+    takes every ``num_replicas``-th batch starting from its ``rank``, so the
+    processes see disjoint batches and the same number of batches. As with
+    ``torch.utils.data.DistributedSampler``, ``set_epoch()`` must be called
+    at the beginning of each epoch. With a single replica, the global
+    ``random`` and ``numpy.random`` states are used.
+
+    Args:
+        num_replicas (int, optional): number of processes. Default is the
+            world size of the default process group if initialized, else 1.
+        rank (int, optional): rank of the current process. Default is the
+            rank in the default process group if initialized, else 0.
+        seed (int, optional): seed shared by all processes. Default is 0.
+    """
+
+    batch_len = 1
+
+    def __init__(self, num_replicas=None, rank=None, seed=0):
+        distributed = dist.is_available() and dist.is_initialized()
+        if num_replicas is None:
+            num_replicas = dist.get_world_size() if distributed else 1
+        if rank is None:
+            rank = dist.get_rank() if distributed else 0
+        if not 0 <= rank < num_replicas:
+            raise ValueError(
+                'Invalid rank {}, rank should be in the interval '
+                '[0, {}]'.format(rank, num_replicas - 1)
+            )
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+        self._epoch_idxs = None
+
+    def set_epoch(self, epoch):
+        if epoch != self.epoch:
+            self._epoch_idxs = None
+        self.epoch = epoch
+
+    def _sample_epoch(self, np_rng, py_rng):
+        """Returns the list of indices of an epoch, sampled with the given
+        ``numpy.random`` and ``random`` compatible generators."""
+        raise NotImplementedError
+
+    def _sample_replica(self):
+        if self.num_replicas == 1:
+            return self._sample_epoch(np.random, random)
+
+        seed = self.seed + self.epoch
+        idxs = self._sample_epoch(
+            np.random.RandomState(seed), random.Random(seed)
+        )
+        num_batches = len(idxs) // self.batch_len // self.num_replicas
+        batches = np.asarray(idxs, dtype=np.int64)
+        batches = batches[:num_batches * self.num_replicas * self.batch_len]
+        batches = batches.reshape(-1, self.batch_len)
+        return batches[self.rank::self.num_replicas].reshape(-1).tolist()
+
+    def __iter__(self):
+        if self._epoch_idxs is None:
+            self._epoch_idxs = self._sample_replica()
+        final_idxs, self._epoch_idxs = self._epoch_idxs, None
+        return iter(final_idxs)
+
+    def __len__(self):
+        if self._epoch_idxs is None:
+            self._epoch_idxs = self._sample_replica()
+        return len(self._epoch_idxs)
+
+
+class RandomIdentitySampler(EpochBatchSampler):
     """Randomly samples N identities each with K instances.
 
+    The images of each identity are shuffled and split into groups of K
+    instances (identities with fewer than K images are sampled with
+    replacement). Batches are then filled with groups of N distinct
+    identities drawn at random from the identities that have groups left,
+    until fewer than N such identities remain.
+
     Args:
         data_source (list): contains tuples of (img_path(s), pid, camid, dsetid).
         batch_size (int): batch size.
         num_instances (int): number of instances per identity in a batch.
+        num_replicas (int, optional): number of processes, see
+            ``EpochBatchSampler``.
+        rank (int, optional): rank of the current process.
+        seed (int, optional): seed shared by all processes. Default is 0.
     """
 
-    def __init__(self, data_source, batch_size, num_instances):
+    def __init__(
+        self,
+        data_source,
+        batch_size,
+        num_instances,
+        num_replicas=None,
+        rank=None,
+        seed=0
+    ):
+        super(RandomIdentitySampler, self).__init__(num_replicas, rank, seed)
         if batch_size < num_instances:
             raise ValueError(
                 'batch_size={} must be no less '
@@ -31,58 +130,132 @@ class RandomIdentitySampler(Sampler):
         self.batch_size = batch_size
         self.num_instances = num_instances
         self.num_pids_per_batch = self.batch_size // self.num_instances
-        self.index_dic = defaultdict(list)
-        for index, items in enumerate(data_source):
-            pid = items[1]
-            self.index_dic[pid].append(index)
-        self.pids = list(self.index_dic.keys())
+        self.batch_len = self.num_pids_per_batch * self.num_instances
+
+        # label of each image in [0, num_pids), in order of appearance
+        pids = [items[1] for items in data_source]
+        self.pids, first, labels = np.unique(
+            pids, return_index=True, return_inverse=True
+        )
+        order = np.argsort(first)
+        self.pids = self.pids[order].tolist()
+        self._labels = np.argsort(order)[labels.reshape(-1)]
         assert len(self.pids) >= self.num_pids_per_batch
 
-        # estimate number of examples in an epoch
-        # TODO: improve precision
-        self.length = 0
-        for pid in self.pids:
-            idxs = self.index_dic[pid]
-            num = len(idxs)
-            if num < self.num_instances:
-                num = self.num_instances
-            self.length += num - num % self.num_instances
-
-    def __iter__(self):
-        batch_idxs_dict = defaultdict(list)
-
-        for pid in self.pids:
-            idxs = copy.deepcopy(self.index_dic[pid])
-            if len(idxs) < self.num_instances:
-                idxs = np.random.choice(
-                    idxs, size=self.num_instances, replace=True
+        # image indices grouped by label
+        self._sorted_idxs = np.argsort(self._labels, kind='stable')
+        self._counts = np.bincount(self._labels, minlength=len(self.pids))
+        self._starts = np.cumsum(self._counts) - self._counts
+        self._num_groups = (
+            np.maximum(self._counts, self.num_instances) // self.num_instances
+        )
+
+    @property
+    def index_dic(self):
+        """Dictionary mapping each pid to its image indices."""
+        return dict(
+            (pid, self._sorted_idxs[start:start + count].tolist())
+            for pid, start, count in zip(self.pids, self._starts, self._counts)
+        )
+
+    def _sample_groups(self, np_rng):
+        """Returns the groups of each identity as a (num_groups, K) array
+        and the first group of each identity."""
+        k = self.num_instances
+        n = len(self._labels)
+        # shuffle the images, then group them by label (stable)
+        perm = np_rng.permutation(n)
+        idxs = perm[np.argsort(self._labels[perm], kind='stable')]
+        labels = self._labels[idxs]
+        rank = np.arange(n) - self._starts[labels]
+        # drop the remainder of each identity that does not fill a group
+        large = self._counts >= k
+        keep = large[labels] & (rank < self._num_groups[labels] * k)
+        groups = [idxs[keep].reshape(-1, k)]
+
+        small = np.flatnonzero(~large)
+        if small.size > 0:
+            offsets = np_rng.random_sample((small.size, k))
+            offsets = (offsets * self._counts[small, None]).astype(np.int64)
+            offsets = np.minimum(offsets, self._counts[small, None] - 1)
+            groups.append(self._sorted_idxs[self._starts[small, None] + offsets])
+
+        num_groups = self._num_groups * large
+        group_starts = np.cumsum(num_groups) - num_groups
+        group_starts[small] = num_groups.sum() + np.arange(small.size)
+        return np.concatenate(groups), group_starts
+
+    def _sample_epoch(self, np_rng, py_rng):
+        groups, group_starts = self._sample_groups(np_rng)
+        cursors = group_starts.tolist()
+        ends = (group_starts + self._num_groups).tolist()
+
+        # pool of available labels with O(1) swap-remove
+        avai_pids = list(range(len(self.pids)))
+        num_avai = len(avai_pids)
+        selected_groups = []
+        while num_avai >= self.num_pids_per_batch:
+            positions = py_rng.sample(
+                range(num_avai), self.num_pids_per_batch
+            )
+            exhausted = []
+            for pos in positions:
+                label = avai_pids[pos]
+                selected_groups.append(cursors[label])
+                cursors[label] += 1
+                if cursors[label] == ends[label]:
+                    exhausted.append(pos)
+            # remove from the back so that swapped-in labels stay valid
+            for pos in sorted(exhausted, reverse=True):
+                num_avai -= 1
+                avai_pids[pos] = avai_pids[num_avai]
+
+        return groups[selected_groups].reshape(-1).tolist()
+
+
+def _sample_groups_of_images(
+    group_dict, n_group, n_img_per_group, np_rng=np.random, py_rng=random
+):
+    """Samples batches of ``n_group`` random groups (e.g. cameras or
+    datasets) each with ``n_img_per_group`` random images, without
+    replacement, until a sampled group has fewer than ``n_img_per_group``
+    images left.
+
+    Drawing images without replacement from what is left of a group is the
+    same as reading a random permutation of the group in order, so each
+    group is shuffled once and consumed with a cursor.
+    """
+    groups = list(group_dict.keys())
+    perms = dict(
+        (group, np_rng.permutation(idxs).tolist())
+        for group, idxs in group_dict.items()
+    )
+    cursors = dict((group, 0) for group in groups)
+    final_idxs = []
+    stop_sampling = False
+
+    while not stop_sampling:
+        selected_groups = py_rng.sample(groups, n_group)
+
+        for group in selected_groups:
+            start = cursors[group]
+            end = start + n_img_per_group
+            if end > len(perms[group]):
+                raise ValueError(
+                    '{} has {} images, fewer than the {} images to sample '
+                    'per batch'.format(group, len(perms[group]), n_img_per_group)
                 )
-            random.shuffle(idxs)
-            batch_idxs = []
-            for idx in idxs:
-                batch_idxs.append(idx)
-                if len(batch_idxs) == self.num_instances:
-                    batch_idxs_dict[pid].append(batch_idxs)
-                    batch_idxs = []
-
-        avai_pids = copy.deepcopy(self.pids)
-        final_idxs = []
-
-        while len(avai_pids) >= self.num_pids_per_batch:
-            selected_pids = random.sample(avai_pids, self.num_pids_per_batch)
-            for pid in selected_pids:
-                batch_idxs = batch_idxs_dict[pid].pop(0)
-                final_idxs.extend(batch_idxs)
-                if len(batch_idxs_dict[pid]) == 0:
-                    avai_pids.remove(pid)
+            final_idxs.extend(perms[group][start:end])
+            cursors[group] = end
 
-        return iter(final_idxs)
+            remaining = len(perms[group]) - end
+            if remaining < n_img_per_group:
+                stop_sampling = True
 
-    def __len__(self):
-        return self.length
+    return final_idxs
 
 
-class RandomDomainSampler(Sampler):
+class RandomDomainSampler(EpochBatchSampler):
     """Random domain sampler.
 
     We consider each camera as a visual domain.
@@ -95,9 +268,22 @@ class RandomDomainSampler(Sampler):
         data_source (list): contains tuples of (img_path(s), pid, camid, dsetid).
         batch_size (int): batch size.
         n_domain (int): number of cameras to sample in a batch.
+        num_replicas (int, optional): number of processes, see
+            ``EpochBatchSampler``.
+        rank (int, optional): rank of the current process.
+        seed (int, optional): seed shared by all processes. Default is 0.
     """
 
-    def __init__(self, data_source, batch_size, n_domain):
+    def __init__(
+        self,
+        data_source,
+        batch_size,
+        n_domain,
+        num_replicas=None,
+        rank=None,
+        seed=0
+    ):
+        super(RandomDomainSampler, self).__init__(num_replicas, rank, seed)
         self.data_source = data_source
 
         # Keep track of image indices for each domain
@@ -115,35 +301,15 @@ class RandomDomainSampler(Sampler):
 
         self.batch_size = batch_size
         self.n_domain = n_domain
-        self.length = len(list(self.__iter__()))
-
-    def __iter__(self):
-        domain_dict = copy.deepcopy(self.domain_dict)
-        final_idxs = []
-        stop_sampling = False
-
-        while not stop_sampling:
-            selected_domains = random.sample(self.domains, self.n_domain)
-
-            for domain in selected_domains:
-                idxs = domain_dict[domain]
-                selected_idxs = random.sample(idxs, self.n_img_per_domain)
-                final_idxs.extend(selected_idxs)
-
-                for idx in selected_idxs:
-                    domain_dict[domain].remove(idx)
-
-                remaining = len(domain_dict[domain])
-                if remaining < self.n_img_per_domain:
-                    stop_sampling = True
-
-        return iter(final_idxs)
+        self.batch_len = batch_size
 
-    def __len__(self):
-        return self.length
+    def _sample_epoch(self, np_rng, py_rng):
+        return _sample_groups_of_images(
+            self.domain_dict, self.n_domain, self.n_img_per_domain, np_rng, py_rng
+        )
 
 
-class RandomDatasetSampler(Sampler):
+class RandomDatasetSampler(EpochBatchSampler):
     """Random dataset sampler.
 
     How does the sampling work:
@@ -154,9 +320,22 @@ class RandomDatasetSampler(Sampler):
         data_source (list): contains tuples of (img_path(s), pid, camid, dsetid).
         batch_size (int): batch size.
         n_dataset (int): number of datasets to sample in a batch.
+        num_replicas (int, optional): number of processes, see
+            ``EpochBatchSampler``.
+        rank (int, optional): rank of the current process.
+        seed (int, optional): seed shared by all processes. Default is 0.
     """
 
-    def __init__(self, data_source, batch_size, n_dataset):
+    def __init__(
+        self,
+        data_source,
+        batch_size,
+        n_dataset,
+        num_replicas=None,
+        rank=None,
+        seed=0
+    ):
+        super(RandomDatasetSampler, self).__init__(num_replicas, rank, seed)
         self.data_source = data_source
 
         # Keep track of image indices for each dataset
@@ -174,32 +353,12 @@ class RandomDatasetSampler(Sampler):
 
         self.batch_size = batch_size
         self.n_dataset = n_dataset
-        self.length = len(list(self.__iter__()))
-
-    def __iter__(self):
-        dataset_dict = copy.deepcopy(self.dataset_dict)
-        final_idxs = []
-        stop_sampling = False
+        self.batch_len = batch_size
 
-        while not stop_sampling:
-            selected_datasets = random.sample(self.datasets, self.n_dataset)
-
-            for dset in selected_datasets:
-                idxs = dataset_dict[dset]
-                selected_idxs = random.sample(idxs, self.n_img_per_dset)
-                final_idxs.extend(selected_idxs)
-
-                for idx in selected_idxs:
-                    dataset_dict[dset].remove(idx)
-
-                remaining = len(dataset_dict[dset])
-                if remaining < self.n_img_per_dset:
-                    stop_sampling = True
-
-        return iter(final_idxs)
-
-    def __len__(self):
-        return self.length
+    def _sample_epoch(self, np_rng, py_rng):
+        return _sample_groups_of_images(
+            self.dataset_dict, self.n_dataset, self.n_img_per_dset, np_rng, py_rng
+        )
 
 
 def build_train_sampler(
@@ -209,6 +368,9 @@ def build_train_sampler(
     num_instances=4,
     num_cams=1,
     num_datasets=1,
+    num_replicas=None,
+    rank=None,
+    seed=0,
     **kwargs
 ):
     """Builds a training sampler.
@@ -223,18 +385,43 @@ def build_train_sampler(
             ``RandomDomainSampler``). Default is 1.
         num_datasets (int, optional): number of datasets to sample in a batch (when
             using ``RandomDatasetSampler``). Default is 1.
+        num_replicas (int, optional): number of processes in multi-process
+            training. Default is the world size of the default process group
+            if initialized, else 1. With several processes, ``RandomSampler``
+            and ``SequentialSampler`` are replaced by ``DistributedSampler``.
+        rank (int, optional): rank of the current process. Default is the
+            rank in the default process group if initialized, else 0.
+        seed (int, optional): seed shared by all processes. Default is 0.
     """
     assert train_sampler in AVAI_SAMPLERS, \
         'train_sampler must be one of {}, but got {}'.format(AVAI_SAMPLERS, train_sampler)
 
+    if num_replicas is None:
+        distributed = dist.is_available() and dist.is_initialized()
+        num_replicas = dist.get_world_size() if distributed else 1
+    dist_kwargs = dict(num_replicas=num_replicas, rank=rank, seed=seed)
+
     if train_sampler == 'RandomIdentitySampler':
-        sampler = RandomIdentitySampler(data_source, batch_size, num_instances)
+        sampler = RandomIdentitySampler(
+            data_source, batch_size, num_instances, **dist_kwargs
+        )
 
     elif train_sampler == 'RandomDomainSampler':
-        sampler = RandomDomainSampler(data_source, batch_size, num_cams)
+        sampler = RandomDomainSampler(
+            data_source, batch_size, num_cams, **dist_kwargs
+        )
 
     elif train_sampler == 'RandomDatasetSampler':
-        sampler = RandomDatasetSampler(data_source, batch_size, num_datasets)
+        sampler = RandomDatasetSampler(
+            data_source, batch_size, num_datasets, **dist_kwargs
+        )
+
+    elif num_replicas > 1:
+        sampler = DistributedSampler(
+            data_source,
+            shuffle=train_sampler == 'RandomSampler',
+            **dist_kwargs
+        )
 
     elif train_sampler == 'SequentialSampler':
         sampler = SequentialSampler(data_source)
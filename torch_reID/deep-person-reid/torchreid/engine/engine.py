@@ -3,15 +3,19 @@ import time
 import numpy as np
 import os.path as osp
 import datetime
+import multiprocessing as mp
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import torch
+import torch.distributed as dist
 from torch.nn import functional as F
-from torch.utils.tensorboard import SummaryWriter
+from torch.nn.parallel import DistributedDataParallel
 
 from torchreid import metrics
 from torchreid.utils import (
-    MetricMeter, AverageMeter, re_ranking, open_all_layers, save_checkpoint,
-    open_specified_layers, visualize_ranked_results
+    FeatureStore, MetricMeter, AverageMeter, re_ranking, open_all_layers,
+    save_checkpoint, gnn_re_ranking, open_specified_layers,
+    visualize_ranked_results, compute_model_fingerprint
 )
 from torchreid.losses import DeepSupervision
 
@@ -32,6 +36,7 @@ class Engine(object):
         self.use_gpu = (torch.cuda.is_available() and use_gpu)
         self.writer = None
         self.epoch = 0
+        self.distributed = False
 
         self.model = None
         self.optimizer = None
@@ -110,6 +115,37 @@ class Engine(object):
             if self._scheds[name] is not None:
                 self._scheds[name].step()
 
+    def is_main_process(self):
+        """Returns False in the processes of multi-process training other
+        than the first one."""
+        return not self.distributed or dist.get_rank() == 0
+
+    def _wrap_distributed(self):
+        self._ddp_models = OrderedDict()
+        for name, model in self._models.items():
+            if model is None or not any(
+                p.requires_grad for p in model.parameters()
+            ):
+                continue
+            param = next(model.parameters())
+            device_ids = [param.device.index] if param.is_cuda else None
+            # layers frozen by fixbase_epoch or outputs left out of the loss
+            # (e.g. weight_x=0) have no gradient
+            self._ddp_models[name] = DistributedDataParallel(
+                model, device_ids=device_ids, find_unused_parameters=True
+            )
+
+    def _use_distributed_models(self, enabled):
+        # swaps registered models (and attributes referring to them, e.g.
+        # self.model) with their DistributedDataParallel wrappers
+        for name, ddp_model in self._ddp_models.items():
+            old, new = (ddp_model.module, ddp_model) if enabled else \
+                (ddp_model, ddp_model.module)
+            self._models[name] = new
+            for key, value in list(self.__dict__.items()):
+                if value is old:
+                    setattr(self, key, new)
+
     def run(
         self,
         save_dir='log',
@@ -127,7 +163,11 @@ class Engine(object):
         visrank_topk=10,
         use_metric_cuhk03=False,
         ranks=[1, 5, 10, 20],
-        rerank=False
+        rerank=False,
+        eval_block_size=None,
+        feature_cache_dir='',
+        num_eval_workers=0,
+        distributed=False
     ):
         r"""A unified pipeline for training and evaluating a model.
 
@@ -156,8 +196,31 @@ class Engine(object):
             use_metric_cuhk03 (bool, optional): use single-gallery-shot setting for cuhk03.
                 Default is False. This should be enabled when using cuhk03 classic split.
             ranks (list, optional): cmc ranks to be computed. Default is [1, 5, 10, 20].
-            rerank (bool, optional): uses person re-ranking (by Zhong et al. CVPR'17).
-                Default is False. This is only enabled when test_only=True.
+            rerank (bool or str, optional): uses person re-ranking. True or "k_reciprocal"
+                uses k-reciprocal re-ranking (by Zhong et al. CVPR'17), "gnn" uses GNN-based
+                re-ranking (by Zhang et al. arXiv'20) which also runs on CPU. Default is False.
+                This is only enabled when test_only=True.
+            eval_block_size (int, optional): if set, distances are computed and ranked for
+                blocks of ``eval_block_size`` queries so the full query-gallery distance
+                matrix is never materialized. Not compatible with ``rerank`` and ``visrank``.
+                Default is None.
+            feature_cache_dir (str, optional): directory of a persistent feature store. If set,
+                query and gallery features are saved there on first extraction and reused
+                as long as model weights, dataset split and test transforms are unchanged.
+                Only the latest features of each dataset split are kept. Default is ""
+                (no caching).
+            num_eval_workers (int, optional): if positive, distance computation, re-ranking
+                and ranking of each target dataset run in a pool of this many worker
+                processes, overlapping with feature extraction of the next dataset.
+                Default is 0 (serial evaluation).
+            distributed (bool, optional): multi-process training with
+                ``DistributedDataParallel``, one process per CPU socket/node or GPU,
+                e.g. launched with ``torchrun``. The default process group must be
+                initialized (e.g. with the "gloo" backend on CPU) before building
+                the data manager, so that the training samplers give each process
+                different batches. ``batch_size`` is per process. Evaluation,
+                checkpoints and tensorboard logs are done by the first process.
+                Default is False.
         """
 
         if visrank and not test_only:
@@ -165,20 +228,37 @@ class Engine(object):
                 'visrank can be set to True only if test_only=True'
             )
 
+        self.distributed = distributed
+        if distributed:
+            if not dist.is_initialized():
+                raise RuntimeError(
+                    'distributed=True requires the default process group, '
+                    'see torch.distributed.init_process_group()'
+                )
+            self._wrap_distributed()
+
+        test_kwargs = dict(
+            dist_metric=dist_metric,
+            normalize_feature=normalize_feature,
+            visrank=visrank,
+            visrank_topk=visrank_topk,
+            save_dir=save_dir,
+            use_metric_cuhk03=use_metric_cuhk03,
+            ranks=ranks,
+            eval_block_size=eval_block_size,
+            feature_cache_dir=feature_cache_dir,
+            num_eval_workers=num_eval_workers
+        )
+
         if test_only:
-            self.test(
-                dist_metric=dist_metric,
-                normalize_feature=normalize_feature,
-                visrank=visrank,
-                visrank_topk=visrank_topk,
-                save_dir=save_dir,
-                use_metric_cuhk03=use_metric_cuhk03,
-                ranks=ranks,
-                rerank=rerank
-            )
+            if self.is_main_process():
+                self.test(rerank=rerank, **test_kwargs)
+            self._synchronize()
             return
 
-        if self.writer is None:
+        if self.writer is None and self.is_main_process():
+            # tensorboard is slow to import and only needed for training
+            from torch.utils.tensorboard import SummaryWriter
             self.writer = SummaryWriter(log_dir=save_dir)
 
         time_start = time.time()
@@ -196,30 +276,17 @@ class Engine(object):
             if (self.epoch + 1) >= start_eval \
                and eval_freq > 0 \
                and (self.epoch+1) % eval_freq == 0 \
-               and (self.epoch + 1) != self.max_epoch:
-                rank1 = self.test(
-                    dist_metric=dist_metric,
-                    normalize_feature=normalize_feature,
-                    visrank=visrank,
-                    visrank_topk=visrank_topk,
-                    save_dir=save_dir,
-                    use_metric_cuhk03=use_metric_cuhk03,
-                    ranks=ranks
-                )
+               and (self.epoch + 1) != self.max_epoch \
+               and self.is_main_process():
+                rank1 = self.test(**test_kwargs)
                 self.save_model(self.epoch, rank1, save_dir)
+            self._synchronize()
 
-        if self.max_epoch > 0:
+        if self.max_epoch > 0 and self.is_main_process():
             print('=> Final test')
-            rank1 = self.test(
-                dist_metric=dist_metric,
-                normalize_feature=normalize_feature,
-                visrank=visrank,
-                visrank_topk=visrank_topk,
-                save_dir=save_dir,
-                use_metric_cuhk03=use_metric_cuhk03,
-                ranks=ranks
-            )
+            rank1 = self.test(**test_kwargs)
             self.save_model(self.epoch, rank1, save_dir)
+        self._synchronize()
 
         elapsed = round(time.time() - time_start)
         elapsed = str(datetime.timedelta(seconds=elapsed))
@@ -227,6 +294,11 @@ class Engine(object):
         if self.writer is not None:
             self.writer.close()
 
+    def _synchronize(self):
+        # the other processes wait for evaluation on the main process
+        if self.distributed:
+            dist.barrier()
+
     def train(self, print_freq=10, fixbase_epoch=0, open_layers=None):
         losses = MetricMeter()
         batch_time = AverageMeter()
@@ -238,6 +310,19 @@ class Engine(object):
             self.epoch, fixbase_epoch, open_layers
         )
 
+        for loader in [self.train_loader,
+                       getattr(self.datamanager, 'train_loader_t', None)]:
+            sampler = getattr(loader, 'sampler', None)
+            if hasattr(sampler, 'set_epoch'):
+                sampler.set_epoch(self.epoch)
+        if self.distributed:
+            self._use_distributed_models(True)
+
+        # hit rate of the decoded image cache in this epoch
+        image_cache = getattr(self.datamanager, 'image_cache', None)
+        if image_cache is not None:
+            image_cache.reset_stats()
+
         self.num_batches = len(self.train_loader)
         end = time.time()
         for self.batch_idx, data in enumerate(self.train_loader):
@@ -253,12 +338,20 @@ class Engine(object):
                 ) * self.num_batches
                 eta_seconds = batch_time.avg * (nb_this_epoch+nb_future_epochs)
                 eta_str = str(datetime.timedelta(seconds=int(eta_seconds)))
+                cache_str = ''
+                if image_cache is not None:
+                    cache_stats = image_cache.stats()
+                    cache_str = 'cache {:.1%} ({:.0f}MB)\t'.format(
+                        cache_stats['hit_rate'],
+                        cache_stats['used_bytes'] / 1024**2
+                    )
                 print(
                     'epoch: [{0}/{1}][{2}/{3}]\t'
                     'time {batch_time.val:.3f} ({batch_time.avg:.3f})\t'
                     'data {data_time.val:.3f} ({data_time.avg:.3f})\t'
                     'eta {eta}\t'
                     '{losses}\t'
+                    '{cache}'
                     'lr {lr:.6f}'.format(
                         self.epoch + 1,
                         self.max_epoch,
@@ -268,6 +361,7 @@ class Engine(object):
                         data_time=data_time,
                         eta=eta_str,
                         losses=losses,
+                        cache=cache_str,
                         lr=self.get_current_lr()
                     )
                 )
@@ -281,9 +375,16 @@ class Engine(object):
                 self.writer.add_scalar(
                     'Train/lr', self.get_current_lr(), n_iter
                 )
+                if image_cache is not None:
+                    self.writer.add_scalar(
+                        'Train/cache_hit_rate',
+                        image_cache.stats()['hit_rate'], n_iter
+                    )
 
             end = time.time()
 
+        if self.distributed:
+            self._use_distributed_models(False)
         self.update_lr()
 
     def forward_backward(self, data):
@@ -298,7 +399,10 @@ class Engine(object):
         save_dir='',
         use_metric_cuhk03=False,
         ranks=[1, 5, 10, 20],
-        rerank=False
+        rerank=False,
+        eval_block_size=None,
+        feature_cache_dir='',
+        num_eval_workers=0
     ):
         r"""Tests model on target datasets.
 
@@ -312,10 +416,33 @@ class Engine(object):
             video-reid. In general, a subclass of Engine only needs to re-implement
             ``extract_features()`` and ``parse_data_for_eval()`` (most of the time),
             but not a must. Please refer to the source code for more details.
+
+        .. note::
+
+            With ``num_eval_workers > 0``, features of the target datasets are
+            extracted in turn while distances and ranks of the previous ones are
+            computed in worker processes. Results are printed and logged in the
+            same order as in serial evaluation.
         """
         self.set_model_mode('eval')
         targets = list(self.test_loader.keys())
 
+        if num_eval_workers > 0:
+            return self._test_pipelined(
+                targets,
+                num_eval_workers,
+                dist_metric=dist_metric,
+                normalize_feature=normalize_feature,
+                visrank=visrank,
+                visrank_topk=visrank_topk,
+                save_dir=save_dir,
+                use_metric_cuhk03=use_metric_cuhk03,
+                ranks=ranks,
+                rerank=rerank,
+                eval_block_size=eval_block_size,
+                feature_cache_dir=feature_cache_dir
+            )
+
         for name in targets:
             domain = 'source' if name in self.datamanager.sources else 'target'
             print('##### Evaluating {} ({}) #####'.format(name, domain))
@@ -332,7 +459,9 @@ class Engine(object):
                 save_dir=save_dir,
                 use_metric_cuhk03=use_metric_cuhk03,
                 ranks=ranks,
-                rerank=rerank
+                rerank=rerank,
+                eval_block_size=eval_block_size,
+                feature_cache_dir=feature_cache_dir
             )
 
             if self.writer is not None:
@@ -341,6 +470,74 @@ class Engine(object):
 
         return rank1
 
+    def _test_pipelined(
+        self,
+        targets,
+        num_eval_workers,
+        dist_metric='euclidean',
+        normalize_feature=False,
+        visrank=False,
+        visrank_topk=10,
+        save_dir='',
+        use_metric_cuhk03=False,
+        ranks=[1, 5, 10, 20],
+        rerank=False,
+        eval_block_size=None,
+        feature_cache_dir=''
+    ):
+        _check_eval_options(rerank, visrank, eval_block_size)
+
+        # workers are spawned rather than forked since forking a process
+        # which has already run multi-threaded (OpenMP) code may deadlock
+        pool = ProcessPoolExecutor(
+            max_workers=num_eval_workers, mp_context=mp.get_context('spawn')
+        )
+        with pool:
+            futures = []
+            for name in targets:
+                domain = 'source' if name in self.datamanager.sources else 'target'
+                print('##### Extracting {} ({}) #####'.format(name, domain))
+                qf, q_pids, q_camids, gf, g_pids, g_camids = self._extract_eval_features(
+                    name,
+                    self.test_loader[name]['query'],
+                    self.test_loader[name]['gallery'],
+                    normalize_feature=normalize_feature,
+                    feature_cache_dir=feature_cache_dir
+                )
+                futures.append(
+                    pool.submit(
+                        _compute_rank_metrics,
+                        qf,
+                        gf,
+                        q_pids,
+                        g_pids,
+                        q_camids,
+                        g_camids,
+                        dist_metric=dist_metric,
+                        use_metric_cuhk03=use_metric_cuhk03,
+                        rerank=rerank,
+                        eval_block_size=eval_block_size,
+                        seed=_draw_eval_seed(use_metric_cuhk03),
+                        return_distmat=visrank,
+                        verbose=False
+                    )
+                )
+
+            for name, future in zip(targets, futures):
+                domain = 'source' if name in self.datamanager.sources else 'target'
+                print('##### Evaluating {} ({}) #####'.format(name, domain))
+                cmc, mAP, distmat = future.result()
+                rank1, mAP = self._report_results(
+                    name, cmc, mAP, distmat, ranks, visrank, visrank_topk,
+                    save_dir
+                )
+
+                if self.writer is not None:
+                    self.writer.add_scalar(f'Test/{name}/rank1', rank1, self.epoch)
+                    self.writer.add_scalar(f'Test/{name}/mAP', mAP, self.epoch)
+
+        return rank1
+
     @torch.no_grad()
     def _evaluate(
         self,
@@ -354,11 +551,68 @@ class Engine(object):
         save_dir='',
         use_metric_cuhk03=False,
         ranks=[1, 5, 10, 20],
-        rerank=False
+        rerank=False,
+        eval_block_size=None,
+        feature_cache_dir=''
+    ):
+        _check_eval_options(rerank, visrank, eval_block_size)
+
+        qf, q_pids, q_camids, gf, g_pids, g_camids = self._extract_eval_features(
+            dataset_name, query_loader, gallery_loader, normalize_feature,
+            feature_cache_dir
+        )
+
+        cmc, mAP, distmat = _compute_rank_metrics(
+            qf,
+            gf,
+            q_pids,
+            g_pids,
+            q_camids,
+            g_camids,
+            dist_metric=dist_metric,
+            use_metric_cuhk03=use_metric_cuhk03,
+            rerank=rerank,
+            eval_block_size=eval_block_size,
+            seed=_draw_eval_seed(use_metric_cuhk03)
+        )
+
+        return self._report_results(
+            dataset_name, cmc, mAP, distmat, ranks, visrank, visrank_topk,
+            save_dir
+        )
+
+    @torch.no_grad()
+    def _extract_eval_features(
+        self,
+        dataset_name,
+        query_loader,
+        gallery_loader,
+        normalize_feature=False,
+        feature_cache_dir=''
     ):
         batch_time = AverageMeter()
 
-        def _feature_extraction(data_loader):
+        if feature_cache_dir:
+            store = FeatureStore(feature_cache_dir)
+            names = self.get_model_names()
+            fingerprint = compute_model_fingerprint(
+                [self._models[name] for name in names] if names else self.model
+            )
+
+        def _feature_extraction(data_loader, split):
+            if feature_cache_dir:
+                key = store.make_key(
+                    fingerprint,
+                    dataset_name,
+                    split,
+                    repr(getattr(data_loader.dataset, 'transform', None)),
+                    data=getattr(data_loader.dataset, 'data', None)
+                )
+                cached = store.load(key)
+                if cached is not None:
+                    print('Loaded cached features from "{}"'.format(store.root))
+                    return cached
+
             f_, pids_, camids_ = [], [], []
             for batch_idx, data in enumerate(data_loader):
                 imgs, pids, camids = self.parse_data_for_eval(data)
@@ -374,14 +628,29 @@ class Engine(object):
             f_ = torch.cat(f_, 0)
             pids_ = np.asarray(pids_)
             camids_ = np.asarray(camids_)
+            if feature_cache_dir:
+                # the weights change at every evaluation during training,
+                # only the latest features of a split are kept
+                for old_key in store.find(dataset=dataset_name, split=split):
+                    store.remove(old_key)
+                store.save(
+                    key,
+                    f_,
+                    pids_,
+                    camids_,
+                    meta={
+                        'dataset': dataset_name,
+                        'split': split
+                    }
+                )
             return f_, pids_, camids_
 
         print('Extracting features from query set ...')
-        qf, q_pids, q_camids = _feature_extraction(query_loader)
+        qf, q_pids, q_camids = _feature_extraction(query_loader, 'query')
         print('Done, obtained {}-by-{} matrix'.format(qf.size(0), qf.size(1)))
 
         print('Extracting features from gallery set ...')
-        gf, g_pids, g_camids = _feature_extraction(gallery_loader)
+        gf, g_pids, g_camids = _feature_extraction(gallery_loader, 'gallery')
         print('Done, obtained {}-by-{} matrix'.format(gf.size(0), gf.size(1)))
 
         print('Speed: {:.4f} sec/batch'.format(batch_time.avg))
@@ -391,28 +660,19 @@ class Engine(object):
             qf = F.normalize(qf, p=2, dim=1)
             gf = F.normalize(gf, p=2, dim=1)
 
-        print(
-            'Computing distance matrix with metric={} ...'.format(dist_metric)
-        )
-        distmat = metrics.compute_distance_matrix(qf, gf, dist_metric)
-        distmat = distmat.numpy()
-
-        if rerank:
-            print('Applying person re-ranking ...')
-            distmat_qq = metrics.compute_distance_matrix(qf, qf, dist_metric)
-            distmat_gg = metrics.compute_distance_matrix(gf, gf, dist_metric)
-            distmat = re_ranking(distmat, distmat_qq, distmat_gg)
-
-        print('Computing CMC and mAP ...')
-        cmc, mAP = metrics.evaluate_rank(
-            distmat,
-            q_pids,
-            g_pids,
-            q_camids,
-            g_camids,
-            use_metric_cuhk03=use_metric_cuhk03
-        )
+        return qf, q_pids, q_camids, gf, g_pids, g_camids
 
+    def _report_results(
+        self,
+        dataset_name,
+        cmc,
+        mAP,
+        distmat=None,
+        ranks=[1, 5, 10, 20],
+        visrank=False,
+        visrank_topk=10,
+        save_dir=''
+    ):
         print('** Results **')
         print('mAP: {:.1%}'.format(mAP))
         print('CMC curve')
@@ -476,3 +736,112 @@ class Engine(object):
             open_specified_layers(model, open_layers)
         else:
             open_all_layers(model)
+
+
+def _check_eval_options(rerank, visrank, eval_block_size):
+    if rerank not in [False, True, 'k_reciprocal', 'gnn']:
+        raise ValueError(
+            'Unknown re-ranking method: {}. Please choose either '
+            '"k_reciprocal" or "gnn"'.format(rerank)
+        )
+
+    if eval_block_size and (rerank or visrank):
+        raise ValueError(
+            'rerank and visrank require the full distance matrix, '
+            'so they cannot be used with eval_block_size'
+        )
+
+
+def _draw_eval_seed(use_metric_cuhk03):
+    # the cuhk03 metric samples gallery images at random. Its seed is drawn
+    # from numpy's global state of the main process so that results do not
+    # depend on whether ranking runs in a worker process
+    if use_metric_cuhk03:
+        return np.random.randint(2**31)
+    return None
+
+
+def _compute_rank_metrics(
+    qf,
+    gf,
+    q_pids,
+    g_pids,
+    q_camids,
+    g_camids,
+    dist_metric='euclidean',
+    use_metric_cuhk03=False,
+    rerank=False,
+    eval_block_size=None,
+    seed=None,
+    return_distmat=True,
+    verbose=True
+):
+    """Computes CMC and mAP from extracted features.
+
+    This is a module-level function so that it can be run in a worker
+    process by ``Engine.test(num_eval_workers=...)``.
+
+    Returns:
+        tuple: (cmc, mAP, distmat). ``distmat`` is None if ``eval_block_size``
+        is set or ``return_distmat`` is False.
+    """
+    log = print if verbose else (lambda *args: None)
+
+    distmat = None
+    if eval_block_size:
+        log(
+            'Computing CMC and mAP in blocks of {} queries with '
+            'metric={} ...'.format(eval_block_size, dist_metric)
+        )
+        cmc, mAP = metrics.evaluate_rank_chunked(
+            qf,
+            gf,
+            q_pids,
+            g_pids,
+            q_camids,
+            g_camids,
+            dist_metric=dist_metric,
+            use_metric_cuhk03=use_metric_cuhk03,
+            block_size=eval_block_size,
+            seed=seed
+        )
+
+    else:
+        if rerank == 'gnn':
+            # replaces the distance matrix, which is thus not computed
+            log('Applying GNN re-ranking ...')
+            distmat = gnn_re_ranking(qf, gf)
+
+        else:
+            log(
+                'Computing distance matrix with metric={} ...'.
+                format(dist_metric)
+            )
+            distmat = metrics.compute_distance_matrix(qf, gf, dist_metric)
+            distmat = distmat.numpy()
+
+            if rerank:
+                log('Applying person re-ranking ...')
+                distmat_qq = metrics.compute_distance_matrix(
+                    qf, qf, dist_metric
+                )
+                distmat_gg = metrics.compute_distance_matrix(
+                    gf, gf, dist_metric
+                )
+                distmat = re_ranking(distmat, distmat_qq, distmat_gg)
+
+        log('Computing CMC and mAP ...')
+        cmc, mAP = metrics.evaluate_rank(
+            distmat,
+            q_pids,
+            g_pids,
+            q_camids,
+            g_camids,
+            use_metric_cuhk03=use_metric_cuhk03,
+            seed=seed
+        )
+
+        if not return_distmat:
+            distmat = None
+
+    return cmc, mAP, distmat
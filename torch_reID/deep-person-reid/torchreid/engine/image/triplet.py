@@ -20,6 +20,8 @@ class ImageTripletEngine(Engine):
         scheduler (LRScheduler, optional): if None, no learning rate decay will be performed.
         use_gpu (bool, optional): use gpu. Default is True.
         label_smooth (bool, optional): use label smoothing regularizer. Default is True.
+        mining (str, optional): triplet mining strategy, one of "batch_hard",
+            "batch_all" and "semi_hard". Default is "batch_hard".
 
     Examples::
         
@@ -69,7 +71,8 @@ class ImageTripletEngine(Engine):
         weight_x=1,
         scheduler=None,
         use_gpu=True,
-        label_smooth=True
+        label_smooth=True,
+        mining='batch_hard'
     ):
         super(ImageTripletEngine, self).__init__(datamanager, use_gpu)
 
@@ -83,7 +86,7 @@ class ImageTripletEngine(Engine):
         self.weight_t = weight_t
         self.weight_x = weight_x
 
-        self.criterion_t = TripletLoss(margin=margin)
+        self.criterion_t = TripletLoss(margin=margin, mining=mining)
         self.criterion_x = CrossEntropyLoss(
             num_classes=self.datamanager.num_train_pids,
             use_gpu=self.use_gpu,
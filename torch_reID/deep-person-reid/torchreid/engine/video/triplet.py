@@ -20,6 +20,8 @@ class VideoTripletEngine(ImageTripletEngine):
         label_smooth (bool, optional): use label smoothing regularizer. Default is True.
         pooling_method (str, optional): how to pool features for a tracklet.
             Default is "avg" (average). Choices are ["avg", "max"].
+        mining (str, optional): triplet mining strategy, one of "batch_hard",
+            "batch_all" and "semi_hard". Default is "batch_hard".
 
     Examples::
 
@@ -75,7 +77,8 @@ class VideoTripletEngine(ImageTripletEngine):
         scheduler=None,
         use_gpu=True,
         label_smooth=True,
-        pooling_method='avg'
+        pooling_method='avg',
+        mining='batch_hard'
     ):
         super(VideoTripletEngine, self).__init__(
             datamanager,
@@ -86,7 +89,8 @@ class VideoTripletEngine(ImageTripletEngine):
             weight_x=weight_x,
             scheduler=scheduler,
             use_gpu=use_gpu,
-            label_smooth=label_smooth
+            label_smooth=label_smooth,
+            mining=mining
         )
         self.pooling_method = pooling_method
 
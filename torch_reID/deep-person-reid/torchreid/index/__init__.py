@@ -0,0 +1,5 @@
+from __future__ import absolute_import
+
+from .kmeans import kmeans, assign
+from .ivfpq import IVFPQIndex
+from .gallery import IncrementalGallery
@@ -0,0 +1,340 @@
+from __future__ import division, print_function, absolute_import
+import numpy as np
+import torch
+
+from torchreid.metrics import evaluate_rank, compute_distance_matrix
+
+__all__ = ['IncrementalGallery']
+
+
+class IncrementalGallery(object):
+    """Gallery supporting insertion and deletion of samples.
+
+    Features, pids, camids and ids are stored in preallocated arrays which
+    grow geometrically, and slots of deleted samples are reused. Two pieces
+    of evaluation state are cached and updated incrementally:
+
+    - the query-gallery distance matrix (see ``set_queries``), of which only
+      the columns of inserted samples are computed;
+    - the ``num_neighbors`` nearest gallery neighbours of each gallery sample
+      (itself excluded). Inserted samples are merged into the lists they
+      enter, and only lists containing a deleted sample are recomputed.
+
+    Args:
+        dim (int): feature dimension.
+        metric (str, optional): "euclidean" or "cosine". Default is "euclidean".
+        num_neighbors (int, optional): length of the neighbour lists, 0 to
+            disable them. Default is 20.
+        capacity (int, optional): initial number of slots. Default is 1024.
+        block_size (int, optional): number of rows whose distances to the
+            whole gallery are computed at once. Default is 1024.
+
+    Examples::
+        >>> from torchreid.index import IncrementalGallery
+        >>> gallery = IncrementalGallery(512)
+        >>> gallery.set_queries(qf, q_pids, q_camids)
+        >>> ids = gallery.add(gf, g_pids, g_camids)
+        >>> gallery.remove(ids[:100])
+        >>> cmc, mAP = gallery.evaluate()
+        >>> neighbor_ids, neighbor_dists = gallery.neighbors()
+    """
+
+    def __init__(
+        self,
+        dim,
+        metric='euclidean',
+        num_neighbors=20,
+        capacity=1024,
+        block_size=1024
+    ):
+        if metric not in ['euclidean', 'cosine']:
+            raise ValueError(
+                'Unknown distance metric: {}. '
+                'Please choose either "euclidean" or "cosine"'.format(metric)
+            )
+        self.dim = dim
+        self.metric = metric
+        self.num_neighbors = num_neighbors
+        self.block_size = block_size
+
+        capacity = max(int(capacity), 1)
+        self._features = torch.zeros(capacity, dim)
+        self._pids = np.zeros(capacity, dtype=np.int64)
+        self._camids = np.zeros(capacity, dtype=np.int64)
+        self._ids = np.full(capacity, -1, dtype=np.int64)
+        self._valid = np.zeros(capacity, dtype=bool)
+        self._nn_slots = np.full((capacity, num_neighbors), -1, dtype=np.int64)
+        self._nn_dists = np.full(
+            (capacity, num_neighbors), np.inf, dtype=np.float32
+        )
+        self._size = 0 # number of slots ever used
+        self._free = [] # released slots
+        self._slot_of = {} # id -> slot
+        self._next_id = 0
+
+        self._qf = None
+        self._q_pids = None
+        self._q_camids = None
+        self._qg_dist = None # (num_query, capacity)
+
+    @property
+    def capacity(self):
+        return self._features.size(0)
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def __contains__(self, id_):
+        return int(id_) in self._slot_of
+
+    def _live_slots(self):
+        return np.flatnonzero(self._valid[:self._size])
+
+    def _distance(self, x, slots):
+        return compute_distance_matrix(
+            x, self._features[torch.from_numpy(slots)], self.metric
+        ).float().numpy()
+
+    def _grow(self, min_capacity):
+        capacity = self.capacity
+        while capacity < min_capacity:
+            capacity *= 2
+        extra = capacity - self.capacity
+        if extra == 0:
+            return
+        self._features = torch.cat(
+            [self._features, torch.zeros(extra, self.dim)]
+        )
+        self._pids = np.concatenate([self._pids, np.zeros(extra, np.int64)])
+        self._camids = np.concatenate(
+            [self._camids, np.zeros(extra, np.int64)]
+        )
+        self._ids = np.concatenate([self._ids, np.full(extra, -1, np.int64)])
+        self._valid = np.concatenate([self._valid, np.zeros(extra, bool)])
+        self._nn_slots = np.concatenate(
+            [
+                self._nn_slots,
+                np.full((extra, self.num_neighbors), -1, np.int64)
+            ]
+        )
+        self._nn_dists = np.concatenate(
+            [
+                self._nn_dists,
+                np.full((extra, self.num_neighbors), np.inf, np.float32)
+            ]
+        )
+        if self._qg_dist is not None:
+            self._qg_dist = np.concatenate(
+                [
+                    self._qg_dist,
+                    np.full(
+                        (self._qg_dist.shape[0], extra), np.inf, np.float32
+                    )
+                ],
+                axis=1
+            )
+
+    def set_queries(self, qf, q_pids, q_camids):
+        """Sets the queries whose distances to the gallery are cached.
+
+        Args:
+            qf (torch.Tensor): query features of shape (num_query, dim).
+            q_pids (numpy.ndarray): 1-D array of query identities.
+            q_camids (numpy.ndarray): 1-D array of query camera views.
+        """
+        self._qf = torch.as_tensor(qf).float().cpu()
+        self._q_pids = np.asarray(q_pids)
+        self._q_camids = np.asarray(q_camids)
+        self._qg_dist = np.full(
+            (self._qf.size(0), self.capacity), np.inf, dtype=np.float32
+        )
+        slots = self._live_slots()
+        if len(slots) > 0:
+            self._qg_dist[:, slots] = self._distance(self._qf, slots)
+
+    def add(self, features, pids, camids, ids=None):
+        """Inserts samples.
+
+        Args:
+            features (torch.Tensor): features of shape (N, dim).
+            pids (numpy.ndarray): 1-D array of identities.
+            camids (numpy.ndarray): 1-D array of camera views.
+            ids (numpy.ndarray, optional): unique int ids used by ``remove``.
+                Default is None, meaning new consecutive ids are assigned.
+
+        Returns:
+            numpy.ndarray: ids of the inserted samples.
+        """
+        features = torch.as_tensor(features).float().cpu()
+        num = features.size(0)
+        if ids is None:
+            ids = np.arange(self._next_id, self._next_id + num)
+        ids = np.asarray(ids, dtype=np.int64)
+        assert features.dim() == 2 and features.size(1) == self.dim
+        assert len(pids) == num and len(camids) == num and len(ids) == num
+        if len(np.unique(ids)) != num or \
+                any(int(i) in self._slot_of for i in ids):
+            raise ValueError('ids must be unique and not in the gallery')
+        if num == 0:
+            return ids
+        self._next_id = max(self._next_id, int(ids.max()) + 1)
+
+        old_slots = self._live_slots()
+        num_reused = min(len(self._free), num)
+        slots = np.array(
+            [self._free.pop() for _ in range(num_reused)] +
+            list(range(self._size, self._size + num - num_reused)),
+            dtype=np.int64
+        )
+        self._grow(self._size + num - num_reused)
+        self._size += num - num_reused
+
+        self._features[torch.from_numpy(slots)] = features
+        self._pids[slots] = pids
+        self._camids[slots] = camids
+        self._ids[slots] = ids
+        self._valid[slots] = True
+        for slot, id_ in zip(slots.tolist(), ids.tolist()):
+            self._slot_of[id_] = slot
+
+        if self._qg_dist is not None:
+            self._qg_dist[:, slots] = self._distance(self._qf, slots)
+
+        if self.num_neighbors > 0:
+            self._update_neighbors_after_add(slots, old_slots)
+        return ids
+
+    def _update_neighbors_after_add(self, new_slots, old_slots):
+        k = self.num_neighbors
+        all_slots = np.concatenate([old_slots, new_slots])
+        for start in range(0, len(new_slots), self.block_size):
+            block = new_slots[start:start + self.block_size]
+            dist = self._distance(
+                self._features[torch.from_numpy(block)], all_slots
+            )
+
+            # lists of the new samples, computed from scratch
+            self._set_neighbors(block, dist, all_slots)
+
+            # merge the new samples into the lists of existing samples which
+            # they enter
+            if len(old_slots) == 0:
+                continue
+            dist_old = dist[:, :len(old_slots)].T # (num_old, len(block))
+            affected = dist_old.min(1) < self._nn_dists[old_slots, k - 1]
+            if not affected.any():
+                continue
+            rows = old_slots[affected]
+            cand_slots = np.concatenate(
+                [
+                    self._nn_slots[rows],
+                    np.broadcast_to(block, (len(rows), len(block)))
+                ],
+                axis=1
+            )
+            cand_dists = np.concatenate(
+                [self._nn_dists[rows], dist_old[affected]], axis=1
+            )
+            order = np.argsort(cand_dists, axis=1, kind='stable')[:, :k]
+            self._nn_slots[rows] = np.take_along_axis(cand_slots, order, 1)
+            self._nn_dists[rows] = np.take_along_axis(cand_dists, order, 1)
+
+    def _set_neighbors(self, rows, dist, cols):
+        # dist: (len(rows), len(cols)) distances of rows to cols
+        k = self.num_neighbors
+        dist = torch.from_numpy(dist)
+        dist[torch.from_numpy(cols[np.newaxis, :] == rows[:, np.newaxis])] = \
+            float('inf') # self
+        num = min(k, dist.size(1))
+        nn_dists, index = dist.topk(num, dim=1, largest=False)
+        self._nn_slots[rows] = -1
+        self._nn_dists[rows] = np.inf
+        nn_dists = nn_dists.numpy()
+        nn_slots = cols[index.numpy()]
+        nn_slots[np.isinf(nn_dists)] = -1
+        self._nn_slots[rows, :num] = nn_slots
+        self._nn_dists[rows, :num] = nn_dists
+
+    def remove(self, ids):
+        """Deletes samples by id.
+
+        Args:
+            ids (numpy.ndarray): ids returned by ``add``.
+        """
+        ids = np.atleast_1d(np.asarray(ids, dtype=np.int64))
+        missing = [int(i) for i in ids if int(i) not in self._slot_of]
+        if missing:
+            raise KeyError('ids not in the gallery: {}'.format(missing[:10]))
+        slots = np.array(
+            [self._slot_of.pop(int(i)) for i in ids], dtype=np.int64
+        )
+        self._valid[slots] = False
+        self._ids[slots] = -1
+        self._nn_slots[slots] = -1
+        self._nn_dists[slots] = np.inf
+        if self._qg_dist is not None:
+            self._qg_dist[:, slots] = np.inf
+        self._free.extend(slots.tolist())
+
+        if self.num_neighbors > 0 and len(self) > 0:
+            live = self._live_slots()
+            affected = live[np.isin(self._nn_slots[live], slots).any(1)]
+            for start in range(0, len(affected), self.block_size):
+                rows = affected[start:start + self.block_size]
+                dist = self._distance(
+                    self._features[torch.from_numpy(rows)], live
+                )
+                self._set_neighbors(rows, dist, live)
+
+    @property
+    def ids(self):
+        """Ids of the samples, in the order used by the other accessors."""
+        return self._ids[self._live_slots()]
+
+    @property
+    def features(self):
+        return self._features[torch.from_numpy(self._live_slots())]
+
+    @property
+    def pids(self):
+        return self._pids[self._live_slots()]
+
+    @property
+    def camids(self):
+        return self._camids[self._live_slots()]
+
+    def query_distances(self):
+        """Returns the cached query-gallery distance matrix.
+
+        Returns:
+            numpy.ndarray: distance matrix of shape (num_query, len(self)),
+            with columns in the order of ``ids``.
+        """
+        if self._qg_dist is None:
+            raise RuntimeError('Queries have not been set, see set_queries()')
+        return self._qg_dist[:, self._live_slots()]
+
+    def neighbors(self):
+        """Returns the cached nearest-neighbour lists.
+
+        Returns:
+            tuple: (neighbor_ids, distances), both of shape
+            (len(self), num_neighbors) with rows in the order of ``ids`` and
+            sorted by ascending distance. Missing neighbours (when the
+            gallery is smaller than num_neighbors + 1) have id -1 and
+            distance inf.
+        """
+        live = self._live_slots()
+        nn_slots = self._nn_slots[live]
+        neighbor_ids = np.where(nn_slots >= 0, self._ids[nn_slots], -1)
+        return neighbor_ids, self._nn_dists[live].copy()
+
+    def evaluate(self, **kwargs):
+        """Evaluates CMC and mAP with the cached distances.
+
+        Keyword arguments are passed to ``torchreid.metrics.evaluate_rank``.
+        """
+        return evaluate_rank(
+            self.query_distances(), self._q_pids, self.pids, self._q_camids,
+            self.camids, **kwargs
+        )
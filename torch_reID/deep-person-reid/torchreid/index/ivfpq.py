@@ -0,0 +1,308 @@
+from __future__ import division, print_function, absolute_import
+import os.path as osp
+import torch
+from torch.nn import functional as F
+
+from torchreid.utils import mkdir_if_missing
+from torchreid.metrics.distance import euclidean_squared_distance
+
+from .kmeans import assign, kmeans
+
+__all__ = ['IVFPQIndex']
+
+
+class IVFPQIndex(object):
+    """Inverted-file index with product-quantized residuals (IVF-PQ).
+
+    Vectors are assigned to the nearest of ``num_lists`` coarse centroids and
+    the residual w.r.t. that centroid is split into ``num_subspaces`` chunks,
+    each encoded by the index of its nearest sub-centroid (one byte per chunk).
+    At search time, only the ``nprobe`` lists closest to the query are scanned
+    and distances are estimated from per-query lookup tables (asymmetric
+    distance computation), so search cost is sub-linear in the gallery size.
+
+    Reference:
+        Jegou et al. Product Quantization for Nearest Neighbor Search. TPAMI 2011.
+
+    Args:
+        dim (int): feature dimension.
+        num_lists (int, optional): number of inverted lists. Default is 256.
+        num_subspaces (int, optional): number of sub-quantizers, must divide
+            ``dim``. Default is 16.
+        num_bits (int, optional): bits per sub-quantizer code, at most 8.
+            Default is 8.
+        metric (str, optional): "euclidean" or "cosine". Returned distances
+            approximate ``euclidean_squared_distance`` and ``cosine_distance``
+            respectively. Default is "euclidean".
+
+    Examples::
+        >>> from torchreid.index import IVFPQIndex
+        >>> index = IVFPQIndex(512, num_lists=1024, num_subspaces=32)
+        >>> index.train(gallery_features)
+        >>> index.add(gallery_features)
+        >>> distances, ids = index.search(query_features, k=50, nprobe=16)
+        >>> index.save('log/gallery.index')
+        >>> index = IVFPQIndex.load('log/gallery.index')
+    """
+
+    def __init__(
+        self,
+        dim,
+        num_lists=256,
+        num_subspaces=16,
+        num_bits=8,
+        metric='euclidean'
+    ):
+        if dim % num_subspaces != 0:
+            raise ValueError(
+                'dim ({}) must be divisible by num_subspaces ({})'.format(
+                    dim, num_subspaces
+                )
+            )
+        if not 1 <= num_bits <= 8:
+            raise ValueError(
+                'num_bits must be in [1, 8], but got {}'.format(num_bits)
+            )
+        if metric not in ['euclidean', 'cosine']:
+            raise ValueError(
+                'Unknown distance metric: {}. '
+                'Please choose either "euclidean" or "cosine"'.format(metric)
+            )
+
+        self.dim = dim
+        self.num_lists = num_lists
+        self.num_subspaces = num_subspaces
+        self.num_bits = num_bits
+        self.metric = metric
+
+        self.centroids = None # (num_lists, dim)
+        self.codebooks = None # (num_subspaces, 2**num_bits, dim/num_subspaces)
+
+        # inverted lists stored contiguously, sorted by list
+        self.codes = torch.zeros(0, num_subspaces, dtype=torch.uint8)
+        self.ids = torch.zeros(0, dtype=torch.int64)
+        # ||r||^2 + 2 <c, r> of each entry, where r is the decoded residual
+        # and c the centroid of its list
+        self.norms = torch.zeros(0)
+        self.list_offsets = torch.zeros(num_lists + 1, dtype=torch.int64)
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    @property
+    def sub_dim(self):
+        return self.dim // self.num_subspaces
+
+    def __len__(self):
+        return self.ids.size(0)
+
+    def _preprocess(self, x):
+        x = torch.as_tensor(x).float().cpu()
+        assert x.dim() == 2 and x.size(1) == self.dim, \
+            'Expected features of shape (N, {}), but got {}'.format(
+                self.dim, tuple(x.shape))
+        if self.metric == 'cosine':
+            x = F.normalize(x, p=2, dim=1)
+        return x
+
+    def _split(self, x):
+        return x.view(x.size(0), self.num_subspaces, self.sub_dim)
+
+    def train(self, x, num_iters=20, max_train_size=None, seed=0, verbose=False):
+        """Learns the coarse centroids and the product quantizer.
+
+        Args:
+            x (torch.Tensor): training features of shape (N, dim), typically
+                gallery features obtained with ``FeatureExtractor``.
+            num_iters (int, optional): k-means iterations. Default is 20.
+            max_train_size (int, optional): randomly subsample at most this
+                many vectors for training. Default is None (use all).
+            seed (int, optional): random seed. Default is 0.
+            verbose (bool, optional): prints k-means progress.
+        """
+        x = self._preprocess(x)
+        if max_train_size is not None and x.size(0) > max_train_size:
+            generator = torch.Generator().manual_seed(seed)
+            perm = torch.randperm(x.size(0), generator=generator)
+            x = x[perm[:max_train_size]]
+
+        self.centroids = kmeans(
+            x, self.num_lists, num_iters=num_iters, seed=seed, verbose=verbose
+        )
+        labels, _ = assign(x, self.centroids)
+        residuals = self._split(x - self.centroids[labels])
+
+        num_codes = 2**self.num_bits
+        self.codebooks = torch.stack(
+            [
+                kmeans(
+                    residuals[:, j].contiguous(),
+                    num_codes,
+                    num_iters=num_iters,
+                    seed=seed + j + 1
+                ) for j in range(self.num_subspaces)
+            ]
+        )
+
+    def _encode(self, residuals):
+        codes = [
+            assign(residuals[:, j].contiguous(), self.codebooks[j])[0]
+            for j in range(self.num_subspaces)
+        ]
+        return torch.stack(codes, dim=1).to(torch.uint8)
+
+    def add(self, x, ids=None):
+        """Adds vectors to the index.
+
+        Args:
+            x (torch.Tensor): features of shape (N, dim).
+            ids (torch.Tensor, optional): int64 ids of length N returned by
+                ``search``. Default is None, meaning consecutive ids starting
+                from the current size of the index.
+        """
+        if not self.is_trained:
+            raise RuntimeError('The index must be trained before adding vectors')
+        x = self._preprocess(x)
+        if ids is None:
+            ids = torch.arange(len(self), len(self) + x.size(0))
+        ids = torch.as_tensor(ids, dtype=torch.int64).cpu()
+        assert ids.size(0) == x.size(0)
+
+        labels, _ = assign(x, self.centroids)
+        codes = self._encode(self._split(x - self.centroids[labels]))
+        decoded = self.codebooks[torch.arange(self.num_subspaces), codes.long()]
+        decoded = decoded.view(x.size(0), self.dim)
+        norms = (decoded**2).sum(1) + 2 * (self.centroids[labels] * decoded).sum(1)
+
+        # merge the new entries into the list-sorted storage
+        old_labels = torch.repeat_interleave(
+            torch.arange(self.num_lists), self.list_offsets.diff()
+        )
+        all_labels = torch.cat([old_labels, labels])
+        order = torch.argsort(all_labels, stable=True)
+        self.codes = torch.cat([self.codes, codes])[order]
+        self.ids = torch.cat([self.ids, ids])[order]
+        self.norms = torch.cat([self.norms, norms])[order]
+        counts = torch.bincount(all_labels, minlength=self.num_lists)
+        self.list_offsets = F.pad(counts.cumsum(0), (1, 0))
+
+    def search(self, x, k=50, nprobe=8, block_size=64):
+        """Searches the k nearest neighbours of each query.
+
+        Args:
+            x (torch.Tensor): query features of shape (Q, dim).
+            k (int, optional): number of neighbours. Default is 50.
+            nprobe (int, optional): number of inverted lists scanned per query.
+                Larger values trade speed for recall. Default is 8.
+            block_size (int, optional): number of queries searched at once.
+                Default is 64.
+
+        Returns:
+            tuple: (distances, ids), both of shape (Q, k) and sorted by
+            ascending distance. Missing results have distance inf and id -1.
+        """
+        x = self._preprocess(x)
+        num_q = x.size(0)
+        distances = torch.full((num_q, k), float('inf'))
+        ids = torch.full((num_q, k), -1, dtype=torch.int64)
+        if len(self) == 0:
+            return distances, ids
+
+        nprobe = min(nprobe, self.num_lists)
+        for start in range(0, num_q, block_size):
+            end = min(start + block_size, num_q)
+            distances[start:end], ids[start:end] = self._search_block(
+                x[start:end], k, nprobe
+            )
+
+        if self.metric == 'cosine':
+            # ||a - b||^2 = 2 - 2 cos(a, b) for unit vectors
+            distances = distances / 2
+        return distances, ids
+
+    def _search_block(self, x, k, nprobe):
+        num_q = x.size(0)
+        num_m = self.num_subspaces
+        num_codes = self.codebooks.size(1)
+
+        coarse = euclidean_squared_distance(x, self.centroids)
+        coarse, probes = coarse.topk(nprobe, dim=1, largest=False)
+
+        # flatten the candidates of all probed lists of all queries
+        starts = self.list_offsets[probes].view(-1)
+        lengths = (self.list_offsets[probes + 1] - self.list_offsets[probes]).view(-1)
+        num_cand = int(lengths.sum())
+        # (query, probe) pair of each candidate
+        pair = torch.repeat_interleave(
+            torch.arange(num_q * nprobe), lengths
+        )
+        pair_start = lengths.cumsum(0) - lengths
+        cand = starts[pair] + torch.arange(num_cand) - pair_start[pair]
+        q_row = pair // nprobe
+
+        # ||x - c - r||^2 = ||x - c||^2 + (||r||^2 + 2 <c, r>) - 2 <x, r>
+        # the first term comes from the coarse search, the second is stored
+        # per entry and the last is looked up in per-query tables of shape
+        # (M, Q * ksub) which are shared by all probed lists
+        luts = torch.einsum(
+            'qmd,mkd->mqk', x.view(num_q, num_m, self.sub_dim), self.codebooks
+        ).reshape(num_m, -1)
+        codes = self.codes[cand].t().contiguous().long()
+        base = q_row * num_codes
+        ip = torch.zeros(num_cand)
+        for j in range(num_m):
+            ip += luts[j].index_select(0, base + codes[j])
+        d = coarse.view(-1)[pair] + self.norms[cand] - 2*ip
+
+        # scatter into a padded (Q, max_cand) matrix for top-k selection
+        q_lengths = lengths.view(num_q, nprobe).sum(1)
+        q_start = q_lengths.cumsum(0) - q_lengths
+        col = torch.arange(num_cand) - q_start[q_row]
+        max_cand = max(int(q_lengths.max()), k)
+        padded = torch.full((num_q, max_cand), float('inf'))
+        padded[q_row, col] = d
+        padded_cand = torch.zeros(num_q, max_cand, dtype=torch.int64)
+        padded_cand[q_row, col] = cand
+
+        distances, idx = padded.topk(k, dim=1, largest=False)
+        ids = self.ids[padded_cand.gather(1, idx)]
+        ids[torch.isinf(distances)] = -1
+        return distances, ids
+
+    def state_dict(self):
+        return {
+            'dim': self.dim,
+            'num_lists': self.num_lists,
+            'num_subspaces': self.num_subspaces,
+            'num_bits': self.num_bits,
+            'metric': self.metric,
+            'centroids': self.centroids,
+            'codebooks': self.codebooks,
+            'codes': self.codes,
+            'ids': self.ids,
+            'norms': self.norms,
+            'list_offsets': self.list_offsets
+        }
+
+    def save(self, fpath):
+        """Saves the index to a file."""
+        mkdir_if_missing(osp.dirname(osp.abspath(fpath)))
+        torch.save(self.state_dict(), fpath)
+
+    @classmethod
+    def load(cls, fpath):
+        """Loads an index saved with ``save``."""
+        state = torch.load(fpath, map_location='cpu')
+        index = cls(
+            state['dim'],
+            num_lists=state['num_lists'],
+            num_subspaces=state['num_subspaces'],
+            num_bits=state['num_bits'],
+            metric=state['metric']
+        )
+        for name in [
+            'centroids', 'codebooks', 'codes', 'ids', 'norms', 'list_offsets'
+        ]:
+            setattr(index, name, state[name])
+        return index
@@ -0,0 +1,80 @@
+from __future__ import division, print_function, absolute_import
+import torch
+
+from torchreid.metrics.distance import euclidean_squared_distance
+
+__all__ = ['kmeans', 'assign']
+
+
+def assign(x, centroids, chunk_size=65536):
+    """Assigns each vector to its nearest centroid.
+
+    Args:
+        x (torch.Tensor): 2-D matrix of shape (N, D).
+        centroids (torch.Tensor): 2-D matrix of shape (K, D).
+        chunk_size (int, optional): number of vectors processed at once.
+
+    Returns:
+        tuple: (labels, distances), both of length N.
+    """
+    labels, distances = [], []
+    for start in range(0, x.size(0), chunk_size):
+        distmat = euclidean_squared_distance(
+            x[start:start + chunk_size], centroids
+        )
+        dist, label = distmat.min(dim=1)
+        labels.append(label)
+        distances.append(dist)
+    return torch.cat(labels), torch.cat(distances)
+
+
+def kmeans(x, num_clusters, num_iters=20, seed=0, verbose=False):
+    """Lloyd's k-means clustering.
+
+    Centroids are initialized with randomly sampled vectors. Clusters that
+    become empty are re-seeded with the vectors farthest from their centroids.
+
+    Args:
+        x (torch.Tensor): 2-D matrix of shape (N, D).
+        num_clusters (int): number of clusters, must not exceed N.
+        num_iters (int, optional): number of iterations. Default is 20.
+        seed (int, optional): random seed. Default is 0.
+        verbose (bool, optional): prints the objective at each iteration.
+
+    Returns:
+        torch.Tensor: centroids of shape (num_clusters, D).
+    """
+    x = x.float()
+    num = x.size(0)
+    if num < num_clusters:
+        raise ValueError(
+            'Expected at least {} training vectors, but got {}'.format(
+                num_clusters, num
+            )
+        )
+
+    generator = torch.Generator().manual_seed(seed)
+    perm = torch.randperm(num, generator=generator)[:num_clusters]
+    centroids = x[perm.to(x.device)].clone()
+
+    for it in range(num_iters):
+        labels, distances = assign(x, centroids)
+        if verbose:
+            print(
+                'k-means iter {}/{}: objective {:.4f}'.format(
+                    it + 1, num_iters,
+                    distances.sum().item() / num
+                )
+            )
+
+        counts = torch.bincount(labels, minlength=num_clusters)
+        sums = torch.zeros_like(centroids).index_add_(0, labels, x)
+        nonempty = counts > 0
+        centroids[nonempty] = sums[nonempty] / counts[nonempty].unsqueeze(1).to(x.dtype)
+
+        num_empty = int((~nonempty).sum())
+        if num_empty > 0:
+            farthest = distances.topk(num_empty).indices
+            centroids[~nonempty] = x[farthest]
+
+    return centroids
@@ -1,6 +1,7 @@
 from __future__ import division, absolute_import
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 
 class TripletLoss(nn.Module):
@@ -8,16 +9,38 @@ class TripletLoss(nn.Module):
     
     Reference:
         Hermans et al. In Defense of the Triplet Loss for Person Re-Identification. arXiv:1703.07737.
+
+        Schroff et al. FaceNet: A Unified Embedding for Face Recognition and Clustering. CVPR 2015.
     
     Imported from `<https://github.com/Cysu/open-reid/blob/master/reid/loss/triplet.py>`_.
+
+    Mining strategies:
+
+    - ``batch_hard``: for each anchor, the hardest positive and the hardest
+      negative in the batch (Hermans et al.).
+    - ``batch_all``: all valid triplets in the batch, the loss is averaged
+      over the triplets that violate the margin (Hermans et al.).
+    - ``semi_hard``: for each anchor-positive pair, the closest negative
+      that is farther than the positive, or the farthest negative if there
+      is none (Schroff et al.).
+
+    All strategies are computed with masked reductions over the whole batch.
     
     Args:
         margin (float, optional): margin for triplet. Default is 0.3.
+        mining (str, optional): mining strategy, one of "batch_hard",
+            "batch_all" and "semi_hard". Default is "batch_hard".
     """
 
-    def __init__(self, margin=0.3):
+    def __init__(self, margin=0.3, mining='batch_hard'):
         super(TripletLoss, self).__init__()
+        if mining not in ['batch_hard', 'batch_all', 'semi_hard']:
+            raise ValueError(
+                'Unknown mining strategy: {}. Please choose from '
+                '"batch_hard", "batch_all" and "semi_hard"'.format(mining)
+            )
         self.margin = margin
+        self.mining = mining
         self.ranking_loss = nn.MarginRankingLoss(margin=margin)
 
     def forward(self, inputs, targets):
@@ -34,15 +57,55 @@ class TripletLoss(nn.Module):
         dist.addmm_(inputs, inputs.t(), beta=1, alpha=-2)
         dist = dist.clamp(min=1e-12).sqrt() # for numerical stability
 
-        # For each anchor, find the hardest positive and negative
         mask = targets.expand(n, n).eq(targets.expand(n, n).t())
-        dist_ap, dist_an = [], []
-        for i in range(n):
-            dist_ap.append(dist[i][mask[i]].max().unsqueeze(0))
-            dist_an.append(dist[i][mask[i] == 0].min().unsqueeze(0))
-        dist_ap = torch.cat(dist_ap)
-        dist_an = torch.cat(dist_an)
+        if self.mining == 'batch_hard':
+            return self._batch_hard(dist, mask)
+
+        # anchor-positive pairs without the anchor itself
+        pos_mask = mask.clone()
+        pos_mask.fill_diagonal_(False)
+        anchors, positives = pos_mask.nonzero(as_tuple=True)
+        if anchors.numel() == 0:
+            return inputs.sum() * 0
+        dist_ap = dist[anchors, positives]
+        # (num_pairs, n): distances from the anchor of each pair to every
+        # sample, and whether the sample is a negative of the anchor
+        dist_a = dist[anchors]
+        neg_mask = ~mask[anchors]
+        if self.mining == 'batch_all':
+            return self._batch_all(dist_ap, dist_a, neg_mask)
+        return self._semi_hard(dist_ap, dist_a, neg_mask)
+
+    def _batch_hard(self, dist, mask):
+        # For each anchor, find the hardest positive and negative
+        inf = float('inf')
+        dist_ap = dist.masked_fill(~mask, -inf).max(dim=1)[0]
+        dist_an = dist.masked_fill(mask, inf).min(dim=1)[0]
 
         # Compute ranking hinge loss
         y = torch.ones_like(dist_an)
         return self.ranking_loss(dist_an, dist_ap, y)
+
+    def _batch_all(self, dist_ap, dist_a, neg_mask):
+        losses = F.relu(dist_ap.unsqueeze(1) - dist_a + self.margin)
+        losses = losses * neg_mask
+        num_active = (losses > 0).sum()
+        if num_active == 0:
+            return losses.sum()
+        return losses.sum() / num_active
+
+    def _semi_hard(self, dist_ap, dist_a, neg_mask):
+        inf = float('inf')
+        outside = neg_mask & (dist_a > dist_ap.unsqueeze(1))
+        # closest negative farther than the positive
+        dist_an = dist_a.masked_fill(~outside, inf).min(dim=1)[0]
+        # otherwise the farthest negative
+        hardest = dist_a.masked_fill(~neg_mask, -inf).max(dim=1)[0]
+        dist_an = torch.where(outside.any(dim=1), dist_an, hardest)
+        valid = neg_mask.any(dim=1)
+        if not valid.all():
+            dist_ap, dist_an = dist_ap[valid], dist_an[valid]
+            if dist_ap.numel() == 0:
+                return dist_a.sum() * 0
+        y = torch.ones_like(dist_an)
+        return self.ranking_loss(dist_an, dist_ap, y)
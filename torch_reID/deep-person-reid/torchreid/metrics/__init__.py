@@ -1,5 +1,7 @@
 from __future__ import absolute_import
 
-from .rank import evaluate_rank
+from .rank import evaluate_rank, evaluate_rank_chunked
 from .accuracy import accuracy
 from .distance import compute_distance_matrix
+from .quantization import QuantizedFeatures, quantize_features
+from .hashing import BinaryHasher, hamming_distance, hash_search
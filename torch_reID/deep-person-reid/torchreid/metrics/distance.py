@@ -2,13 +2,15 @@ from __future__ import division, print_function, absolute_import
 import torch
 from torch.nn import functional as F
 
+from .quantization import QuantizedFeatures
+
 
 def compute_distance_matrix(input1, input2, metric='euclidean'):
     """A wrapper function for computing distance matrix.
 
     Args:
-        input1 (torch.Tensor): 2-D feature matrix.
-        input2 (torch.Tensor): 2-D feature matrix.
+        input1 (torch.Tensor or QuantizedFeatures): 2-D feature matrix.
+        input2 (torch.Tensor or QuantizedFeatures): 2-D feature matrix.
         metric (str, optional): "euclidean" or "cosine".
             Default is "euclidean".
 
@@ -21,10 +23,12 @@ def compute_distance_matrix(input1, input2, metric='euclidean'):
        >>> input2 = torch.rand(100, 2048)
        >>> distmat = metrics.compute_distance_matrix(input1, input2)
        >>> distmat.size() # (10, 100)
+       >>> input2 = metrics.quantize_features(input2, 'int8')
+       >>> distmat = metrics.compute_distance_matrix(input1, input2)
     """
     # check input
-    assert isinstance(input1, torch.Tensor)
-    assert isinstance(input2, torch.Tensor)
+    assert isinstance(input1, (torch.Tensor, QuantizedFeatures))
+    assert isinstance(input2, (torch.Tensor, QuantizedFeatures))
     assert input1.dim() == 2, 'Expected 2-D tensor, but got {}-D'.format(
         input1.dim()
     )
@@ -33,7 +37,10 @@ def compute_distance_matrix(input1, input2, metric='euclidean'):
     )
     assert input1.size(1) == input2.size(1)
 
-    if metric == 'euclidean':
+    if isinstance(input1, QuantizedFeatures) or \
+            isinstance(input2, QuantizedFeatures):
+        distmat = quantized_distance(input1, input2, metric)
+    elif metric == 'euclidean':
         distmat = euclidean_squared_distance(input1, input2)
     elif metric == 'cosine':
         distmat = cosine_distance(input1, input2)
@@ -78,3 +85,48 @@ def cosine_distance(input1, input2):
     input2_normed = F.normalize(input2, p=2, dim=1)
     distmat = 1 - torch.mm(input1_normed, input2_normed.t())
     return distmat
+
+
+def quantized_distance(input1, input2, metric='euclidean'):
+    """Computes distances with compressed features.
+
+    The compressed matrix is decoded block by block, so memory usage stays
+    close to that of the compressed form plus the output. If both inputs
+    are compressed, ``input1`` is decoded block by block as well.
+
+    Args:
+        input1 (torch.Tensor or QuantizedFeatures): 2-D feature matrix.
+        input2 (torch.Tensor or QuantizedFeatures): 2-D feature matrix.
+        metric (str, optional): "euclidean" (squared) or "cosine".
+            Default is "euclidean".
+
+    Returns:
+        torch.Tensor: distance matrix.
+    """
+    if metric not in ['euclidean', 'cosine']:
+        raise ValueError(
+            'Unknown distance metric: {}. '
+            'Please choose either "euclidean" or "cosine"'.format(metric)
+        )
+
+    if not isinstance(input2, QuantizedFeatures):
+        return quantized_distance(input2, input1, metric).t()
+
+    if isinstance(input1, QuantizedFeatures):
+        distmat = torch.empty(len(input1), len(input2), device=input2.device)
+        for start, end in input1.iter_blocks():
+            distmat[start:end] = quantized_distance(
+                input1[start:end].dequantize(), input2, metric
+            )
+        return distmat
+
+    input1 = input1.float()
+    if metric == 'euclidean':
+        distmat = input2.inner_product(input1).mul_(-2)
+        distmat += input2.sq_norms.unsqueeze(0)
+        distmat += input1.pow(2).sum(1, keepdim=True)
+    else:
+        distmat = input2.inner_product(F.normalize(input1, p=2, dim=1))
+        distmat /= input2.sq_norms.sqrt().clamp_(min=1e-12).unsqueeze(0)
+        distmat = 1 - distmat
+    return distmat
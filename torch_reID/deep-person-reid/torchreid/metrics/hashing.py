@@ -0,0 +1,276 @@
+from __future__ import division, print_function, absolute_import
+import numpy as np
+import torch
+
+__all__ = ['BinaryHasher', 'hamming_distance', 'hash_search']
+
+if hasattr(np, 'bitwise_count'):
+    _popcount = np.bitwise_count
+else:
+    # numpy < 2.0
+    _POPCOUNT_TABLE = np.array(
+        [bin(i).count('1') for i in range(256)], dtype=np.uint8
+    )
+
+    def _popcount(x, out):
+        nbytes = x.dtype.itemsize
+        x = x.view(np.uint8).reshape(x.shape + (nbytes, ))
+        return _POPCOUNT_TABLE[x].sum(-1, dtype=np.uint8, out=out)
+
+
+class BinaryHasher(object):
+    """Converts features to compact binary codes.
+
+    Features are centered, optionally projected on their top ``num_bits``
+    principal components, rotated and binarized by sign. Codes are bit-packed
+    into uint8 arrays of ``num_bits / 8`` bytes per feature, so that Hamming
+    distances can be computed with XOR and popcount, see ``hamming_distance``.
+
+    Two methods are supported:
+
+    - "sign": no rotation.
+    - "itq": the rotation minimizing the quantization error is learned with
+      iterative quantization, which balances the variance across bits and
+      usually gives better Hamming ranking.
+
+    Reference:
+        Gong et al. Iterative Quantization: A Procrustean Approach to
+        Learning Binary Codes for Large-scale Image Retrieval. TPAMI 2013.
+
+    Args:
+        num_bits (int, optional): code length, a multiple of 8 not larger
+            than the feature dimension. Default is None (feature dimension).
+        method (str, optional): "sign" or "itq". Default is "itq".
+
+    Examples::
+        >>> from torchreid.metrics import BinaryHasher, hash_search
+        >>> hasher = BinaryHasher(num_bits=256).fit(train_features)
+        >>> g_codes = hasher.encode(gallery_features)
+        >>> distances, indices = hash_search(
+        >>>     query_features, gallery_features, hasher, g_codes, k=50
+        >>> )
+    """
+
+    def __init__(self, num_bits=None, method='itq'):
+        if method not in ['sign', 'itq']:
+            raise ValueError(
+                'Unknown hashing method: {}. '
+                'Please choose either "sign" or "itq"'.format(method)
+            )
+        if num_bits is not None and num_bits % 8 != 0:
+            raise ValueError(
+                'num_bits must be a multiple of 8, but got {}'.format(num_bits)
+            )
+        self.num_bits = num_bits
+        self.method = method
+        self.mean = None
+        self.projection = None # (dim, num_bits)
+
+    @property
+    def is_fitted(self):
+        return self.projection is not None
+
+    def fit(self, x, num_iters=50, seed=0):
+        """Learns the centering, projection and rotation.
+
+        Args:
+            x (torch.Tensor): training features of shape (N, dim), e.g.
+                features of the training set obtained with ``FeatureExtractor``.
+            num_iters (int, optional): ITQ iterations. Default is 50.
+            seed (int, optional): random seed of the initial rotation.
+
+        Returns:
+            BinaryHasher: self.
+        """
+        x = torch.as_tensor(x).float().cpu()
+        dim = x.size(1)
+        num_bits = dim if self.num_bits is None else self.num_bits
+        if num_bits > dim or num_bits % 8 != 0:
+            raise ValueError(
+                'num_bits must be a multiple of 8 not larger than the '
+                'feature dimension ({}), but got {}'.format(dim, num_bits)
+            )
+        self.num_bits = num_bits
+
+        self.mean = x.mean(0)
+        x = x - self.mean
+        if num_bits < dim:
+            # principal components with the largest variance
+            _, _, v = torch.linalg.svd(x, full_matrices=False)
+            projection = v[:num_bits].t()
+        else:
+            projection = torch.eye(dim)
+
+        if self.method == 'itq':
+            v = x @ projection
+            generator = torch.Generator().manual_seed(seed)
+            rotation, _ = torch.linalg.qr(
+                torch.randn(num_bits, num_bits, generator=generator)
+            )
+            for _ in range(num_iters):
+                # fix the codes and solve the orthogonal Procrustes problem
+                b = torch.sign(v @ rotation)
+                u, _, wt = torch.linalg.svd(v.t() @ b)
+                rotation = u @ wt
+            projection = projection @ rotation
+
+        self.projection = projection
+        return self
+
+    def encode(self, x, block_size=65536):
+        """Encodes features into bit-packed codes.
+
+        Args:
+            x (torch.Tensor): features of shape (N, dim).
+            block_size (int, optional): number of features encoded at once.
+
+        Returns:
+            numpy.ndarray: uint8 array of shape (N, num_bits / 8).
+        """
+        if not self.is_fitted:
+            raise RuntimeError('The hasher must be fitted before encoding')
+        x = torch.as_tensor(x)
+        codes = np.empty((x.size(0), self.num_bits // 8), dtype=np.uint8)
+        for start in range(0, x.size(0), block_size):
+            end = min(start + block_size, x.size(0))
+            xb = x[start:end].float().cpu() - self.mean
+            bits = (xb @ self.projection > 0).numpy()
+            codes[start:end] = np.packbits(bits, axis=1)
+        return codes
+
+    def state_dict(self):
+        return {
+            'num_bits': self.num_bits,
+            'method': self.method,
+            'mean': self.mean,
+            'projection': self.projection
+        }
+
+    @classmethod
+    def from_state_dict(cls, state):
+        hasher = cls(num_bits=state['num_bits'], method=state['method'])
+        hasher.mean = state['mean']
+        hasher.projection = state['projection']
+        return hasher
+
+
+def _as_words(codes):
+    # 64-bit words need 8x fewer XOR/popcount operations than bytes
+    codes = np.ascontiguousarray(codes, dtype=np.uint8)
+    if codes.shape[1] % 8 == 0:
+        return codes.view(np.uint64)
+    return codes
+
+
+def hamming_distance(codes1, codes2, block_size=None):
+    """Computes Hamming distances between bit-packed codes.
+
+    Codes are processed as 64-bit words (if the code length allows it) with
+    one XOR and one popcount per word and pair.
+
+    Args:
+        codes1 (numpy.ndarray): uint8 codes of shape (M, B).
+        codes2 (numpy.ndarray): uint8 codes of shape (N, B).
+        block_size (int, optional): number of rows of ``codes1`` processed at
+            once. Default is None, meaning it is derived from N to bound the
+            temporary buffers.
+
+    Returns:
+        numpy.ndarray: int32 distance matrix of shape (M, N).
+    """
+    words1 = _as_words(codes1)
+    # word-major so that each word of the gallery is contiguous
+    words2 = np.ascontiguousarray(_as_words(codes2).T)
+    assert words1.shape[1] == words2.shape[0]
+    num_q, num_g = words1.shape[0], words2.shape[1]
+    if block_size is None:
+        block_size = max(2**22 // max(num_g, 1), 1)
+    block_size = min(block_size, max(num_q, 1))
+
+    distmat = np.zeros((num_q, num_g), dtype=np.int32)
+    xor = np.empty((block_size, num_g), dtype=words2.dtype)
+    count = np.empty((block_size, num_g), dtype=np.uint8)
+    for start in range(0, num_q, block_size):
+        end = min(start + block_size, num_q)
+        n = end - start
+        for j in range(words2.shape[0]):
+            np.bitwise_xor(
+                words1[start:end, j, np.newaxis],
+                words2[np.newaxis, j],
+                out=xor[:n]
+            )
+            _popcount(xor[:n], out=count[:n])
+            distmat[start:end] += count[:n]
+    return distmat
+
+
+def hash_search(
+    qf,
+    gf,
+    hasher,
+    g_codes=None,
+    k=50,
+    num_candidates=1000,
+    block_size=256
+):
+    """Two-stage nearest neighbour search with binary codes.
+
+    The gallery is first ranked by the Hamming distance between binary codes,
+    then the top ``num_candidates`` of each query are re-scored with the exact
+    euclidean squared distance (as in ``euclidean_squared_distance``) on the
+    original features.
+
+    Args:
+        qf (torch.Tensor): query features of shape (Q, dim).
+        gf (torch.Tensor): gallery features of shape (N, dim).
+        hasher (BinaryHasher): fitted hasher.
+        g_codes (numpy.ndarray, optional): gallery codes from
+            ``hasher.encode(gf)``. Computed if not given.
+        k (int, optional): number of neighbours returned. Default is 50.
+        num_candidates (int, optional): number of candidates re-scored per
+            query. Larger values trade speed for recall. Default is 1000.
+        block_size (int, optional): number of queries processed at once.
+
+    Returns:
+        tuple: (distances, indices), both of shape (Q, k) and sorted by
+        ascending euclidean squared distance.
+    """
+    if g_codes is None:
+        g_codes = hasher.encode(gf)
+    q_codes = hasher.encode(qf)
+    qf = torch.as_tensor(qf).float()
+    gf = torch.as_tensor(gf)
+    num_g = gf.size(0)
+    num_candidates = min(max(num_candidates, k), num_g)
+    k = min(k, num_g)
+
+    distances, indices = [], []
+    for start in range(0, qf.size(0), block_size):
+        end = min(start + block_size, qf.size(0))
+        hamming = hamming_distance(q_codes[start:end], g_codes)
+        if num_candidates < num_g:
+            cand = np.argpartition(hamming, num_candidates - 1, axis=1)
+            cand = cand[:, :num_candidates]
+        else:
+            cand = np.broadcast_to(np.arange(num_g), hamming.shape)
+        cand = torch.from_numpy(np.ascontiguousarray(cand))
+
+        # ||q||^2 + ||g||^2 - 2 <q, g> for the candidates of each query, in
+        # sub-blocks bounding the gathered candidate features to 64 MB
+        step = max(2**24 // (num_candidates * gf.size(1)), 1)
+        for sub in range(0, end - start, step):
+            q = qf[start + sub:min(start + sub + step, end)]
+            c = cand[sub:sub + step]
+            g = gf.index_select(0, c.reshape(-1)).view(c.size(0), c.size(1), -1)
+            g = g.float()
+            distmat = torch.baddbmm(
+                q.pow(2).sum(1).view(-1, 1, 1) + g.pow(2).sum(2, keepdim=True),
+                g,
+                q.unsqueeze(2),
+                alpha=-2
+            ).squeeze(2)
+            d, idx = distmat.topk(k, dim=1, largest=False)
+            distances.append(d)
+            indices.append(c.gather(1, idx))
+
+    return torch.cat(distances), torch.cat(indices)
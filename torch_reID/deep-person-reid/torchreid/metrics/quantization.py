@@ -0,0 +1,181 @@
+from __future__ import division, print_function, absolute_import
+import torch
+
+__all__ = ['QuantizedFeatures', 'quantize_features']
+
+# number of rows dequantized at once by the distance kernels
+DEFAULT_BLOCK_SIZE = 4096
+
+
+class QuantizedFeatures(object):
+    """Compressed 2-D feature matrix.
+
+    Two formats are supported:
+
+    - "float16": features are stored in half precision (2 bytes/value).
+    - "int8": features are stored as ``round(x / scale)`` in int8 with a
+      per-dimension float32 ``scale = max(|x|) / 127`` (1 byte/value).
+
+    The squared norm of each decoded row is kept in float32 so that
+    distances only need one inner product with the compressed rows. Use
+    ``quantize_features`` to build instances, and pass them to
+    ``compute_distance_matrix`` like regular tensors, see
+    ``quantized_distance``.
+
+    Args:
+        codes (torch.Tensor): float16 or int8 tensor of shape (N, D).
+        scale (torch.Tensor, optional): float32 tensor of shape (D, ),
+            required for int8 codes.
+    """
+
+    def __init__(self, codes, scale=None):
+        if codes.dtype not in [torch.float16, torch.int8]:
+            raise TypeError(
+                'codes must be float16 or int8, but got {}'.format(codes.dtype)
+            )
+        if codes.dtype == torch.int8 and scale is None:
+            raise ValueError('int8 codes require a scale')
+        self.codes = codes
+        self.scale = scale
+        self.sq_norms = torch.cat(
+            [
+                self._decode(start, end).pow(2).sum(1)
+                for start, end in self.iter_blocks()
+            ]
+        ) if len(codes) > 0 else torch.zeros(0, device=codes.device)
+
+    @property
+    def dtype(self):
+        return 'int8' if self.codes.dtype == torch.int8 else 'float16'
+
+    @property
+    def device(self):
+        return self.codes.device
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    def size(self, dim=None):
+        return self.codes.size() if dim is None else self.codes.size(dim)
+
+    def dim(self):
+        return 2
+
+    def __len__(self):
+        return self.codes.size(0)
+
+    @property
+    def nbytes(self):
+        """Memory footprint in bytes."""
+        nbytes = self.codes.numel() * self.codes.element_size()
+        nbytes += self.sq_norms.numel() * 4
+        if self.scale is not None:
+            nbytes += self.scale.numel() * 4
+        return nbytes
+
+    def __getitem__(self, index):
+        """Selects rows, e.g. ``gf[1000:2000]``."""
+        out = QuantizedFeatures.__new__(QuantizedFeatures)
+        out.codes = self.codes[index]
+        out.scale = self.scale
+        out.sq_norms = self.sq_norms[index]
+        if out.codes.dim() != 2:
+            raise IndexError('Only row selections are supported')
+        return out
+
+    def to(self, device):
+        out = QuantizedFeatures.__new__(QuantizedFeatures)
+        out.codes = self.codes.to(device)
+        out.scale = self.scale.to(device) if self.scale is not None else None
+        out.sq_norms = self.sq_norms.to(device)
+        return out
+
+    def cpu(self):
+        return self.to('cpu')
+
+    def iter_blocks(self, block_size=DEFAULT_BLOCK_SIZE):
+        for start in range(0, len(self), block_size):
+            yield start, min(start + block_size, len(self))
+
+    def _decode(self, start, end, premultiplied=False):
+        x = self.codes[start:end].float()
+        if self.scale is not None and not premultiplied:
+            x = x * self.scale
+        return x
+
+    def dequantize(self):
+        """Returns the decoded float32 feature matrix."""
+        return torch.cat(
+            [self._decode(start, end) for start, end in self.iter_blocks()]
+        ) if len(self) > 0 else self.codes.float()
+
+    def inner_product(self, x, block_size=DEFAULT_BLOCK_SIZE):
+        """Computes ``x @ decoded.t()`` without decoding the whole matrix.
+
+        For int8 codes, the scale is folded into ``x`` so that each block of
+        codes only needs to be converted to float32.
+
+        Args:
+            x (torch.Tensor): float tensor of shape (M, D).
+
+        Returns:
+            torch.Tensor: float32 tensor of shape (M, N).
+        """
+        x = x.float()
+        if self.scale is not None:
+            x = x * self.scale
+        out = torch.empty(x.size(0), len(self), device=x.device)
+        for start, end in self.iter_blocks(block_size):
+            out[:, start:end] = torch.mm(
+                x,
+                self._decode(start, end, premultiplied=True).t()
+            )
+        return out
+
+    def state_dict(self):
+        return {'codes': self.codes, 'scale': self.scale}
+
+    @classmethod
+    def from_state_dict(cls, state):
+        return cls(state['codes'], scale=state['scale'])
+
+
+def quantize_features(features, dtype='int8'):
+    """Compresses a float feature matrix.
+
+    Args:
+        features (torch.Tensor): 2-D feature matrix, e.g. gallery features.
+            For cosine distance, quantizing L2-normalized features gives
+            slightly better accuracy.
+        dtype (str, optional): "float16" or "int8". Default is "int8".
+
+    Returns:
+        QuantizedFeatures: compressed features, 2x (float16) or 4x (int8)
+        smaller than float32.
+
+    Examples::
+       >>> from torchreid import metrics
+       >>> gf = metrics.quantize_features(gf, 'int8')
+       >>> distmat = metrics.compute_distance_matrix(qf, gf)
+    """
+    assert features.dim() == 2, 'Expected 2-D tensor, but got {}-D'.format(
+        features.dim()
+    )
+    features = features.detach()
+    if dtype == 'float16':
+        return QuantizedFeatures(features.half())
+    elif dtype == 'int8':
+        scale = features.abs().max(0)[0].float() / 127
+        scale[scale == 0] = 1
+        codes = torch.empty(features.shape, dtype=torch.int8, device=features.device)
+        for start in range(0, features.size(0), DEFAULT_BLOCK_SIZE):
+            end = min(start + DEFAULT_BLOCK_SIZE, features.size(0))
+            codes[start:end] = (features[start:end].float() / scale).round_() \
+                .clamp_(-127, 127).to(torch.int8)
+        return QuantizedFeatures(codes, scale=scale)
+    else:
+        raise ValueError(
+            'Unknown dtype: {}. Please choose either "float16" or "int8"'.
+            format(dtype)
+        )
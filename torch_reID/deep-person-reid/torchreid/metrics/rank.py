@@ -1,7 +1,8 @@
 from __future__ import division, print_function, absolute_import
 import numpy as np
 import warnings
-from collections import defaultdict
+
+from .distance import compute_distance_matrix
 
 try:
     from torchreid.metrics.rank_cylib.rank_cy import evaluate_cy
@@ -13,156 +14,264 @@ except ImportError:
         'unavailable, now use python evaluation.'
     )
 
+# Maximum number of query-gallery entries ranked at once by the python
+# evaluation. Each entry costs ~20 bytes of temporary buffers.
+MAX_BLOCK_ENTRIES = 2**23
 
-def eval_cuhk03(distmat, q_pids, g_pids, q_camids, g_camids, max_rank):
-    """Evaluation with cuhk03 metric
-    Key: one image for each gallery identity is randomly sampled for each query identity.
-    Random sampling is performed num_repeats times.
-    """
-    num_repeats = 10
-    num_q, num_g = distmat.shape
 
-    if num_g < max_rank:
-        max_rank = num_g
-        print(
-            'Note: number of gallery samples is quite small, got {}'.
-            format(num_g)
-        )
+def _get_block_size(num_g, block_size=None):
+    if block_size is None:
+        block_size = MAX_BLOCK_ENTRIES // max(num_g, 1)
+    return max(int(block_size), 1)
+
+
+def rank_block(distmat, q_pids, g_pids, q_camids, g_camids):
+    """Ranks a block of queries and locates their correct matches.
+
+    Gallery samples that have the same pid and camid with the query are
+    discarded, i.e. they do not count as matches and do not occupy a rank.
 
+    Args:
+        distmat (numpy.ndarray): distance matrix of shape (num_query, num_gallery).
+        q_pids (numpy.ndarray): 1-D array of query identities.
+        g_pids (numpy.ndarray): 1-D array of gallery identities.
+        q_camids (numpy.ndarray): 1-D array of query camera views.
+        g_camids (numpy.ndarray): 1-D array of gallery camera views.
+
+    Returns:
+        tuple: ``(indices, keep, rows, ranks)`` where ``indices`` is the
+        argsort of ``distmat``, ``keep`` is a boolean mask (aligned with
+        ``indices``) of non-discarded gallery samples, and ``rows``/``ranks``
+        give, in row-major order, the query index and the 1-based rank
+        (among kept samples) of every correct match.
+    """
     indices = np.argsort(distmat, axis=1)
-    matches = (g_pids[indices] == q_pids[:, np.newaxis]).astype(np.int32)
+    matches = g_pids[indices] == q_pids[:, np.newaxis]
+    keep = np.invert(
+        matches & (g_camids[indices] == q_camids[:, np.newaxis])
+    )
+    rows, cols = np.nonzero(matches & keep)
+    ranks = np.cumsum(keep, axis=1, dtype=np.int64)[rows, cols]
+    return indices, keep, rows, ranks
 
-    # compute cmc curve for each query
-    all_cmc = []
+
+def average_precision(rows, ranks, num_q):
+    """Computes average precision from the ranks of the correct matches.
+
+    Args:
+        rows (numpy.ndarray): query index of each correct match, sorted.
+        ranks (numpy.ndarray): 1-based rank of each correct match, ascending
+            within each query.
+        num_q (int): number of queries.
+
+    Returns:
+        tuple: ``(AP, first_rank, valid)``, each of length ``num_q``. ``AP``
+        and ``first_rank`` (1-based rank of the first correct match) are only
+        meaningful where ``valid`` is True, i.e. the query identity appears
+        in the gallery.
+    """
+    num_rel = np.bincount(rows, minlength=num_q)
+    valid = num_rel > 0
+    row_start = np.cumsum(num_rel) - num_rel
+    # number of correct matches up to and including each match
+    hits = np.arange(1, len(rows) + 1) - row_start[rows]
+    # reference: https://en.wikipedia.org/wiki/Evaluation_measures_(information_retrieval)#Average_precision
+    AP = np.bincount(rows, weights=hits / ranks, minlength=num_q)
+    AP[valid] /= num_rel[valid]
+    first_rank = np.zeros(num_q, dtype=np.int64)
+    first_rank[valid] = ranks[row_start[valid]]
+    return AP, first_rank, valid
+
+
+def _iter_distmat_blocks(distmat, block_size):
+    for start in range(0, distmat.shape[0], block_size):
+        end = min(start + block_size, distmat.shape[0])
+        yield start, end, distmat[start:end]
+
+
+def _iter_feature_blocks(qf, gf, metric, block_size):
+    for start in range(0, qf.size(0), block_size):
+        end = min(start + block_size, qf.size(0))
+        distmat = compute_distance_matrix(qf[start:end], gf, metric)
+        yield start, end, distmat.cpu().numpy()
+
+
+def _eval_cuhk03_blocks(
+    blocks,
+    q_pids,
+    g_pids,
+    q_camids,
+    g_camids,
+    max_rank,
+    num_repeats=10,
+    seed=None
+):
+    rng = np.random if seed is None else np.random.RandomState(seed)
+
+    # gallery samples grouped by identity, sampling one image per identity
+    # boils down to drawing one offset within each group
+    g_order = np.argsort(g_pids, kind='stable')
+    group_pids, group_start, group_size = np.unique(
+        g_pids[g_order], return_index=True, return_counts=True
+    )
+
+    # number of (valid query, repeat) pairs whose first correct match is at
+    # each rank, where ranks only count the sampled images
+    first_rank_hist = np.zeros(max_rank + 1, dtype=np.int64)
     all_AP = []
-    num_valid_q = 0. # number of valid query
-
-    for q_idx in range(num_q):
-        # get query pid and camid
-        q_pid = q_pids[q_idx]
-        q_camid = q_camids[q_idx]
-
-        # remove gallery samples that have the same pid and camid with query
-        order = indices[q_idx]
-        remove = (g_pids[order] == q_pid) & (g_camids[order] == q_camid)
-        keep = np.invert(remove)
-
-        # compute cmc curve
-        raw_cmc = matches[q_idx][
-            keep] # binary vector, positions with value 1 are correct matches
-        if not np.any(raw_cmc):
-            # this condition is true when query identity does not appear in gallery
-            continue
 
-        kept_g_pids = g_pids[order][keep]
-        g_pids_dict = defaultdict(list)
-        for idx, pid in enumerate(kept_g_pids):
-            g_pids_dict[pid].append(idx)
-
-        cmc = 0.
-        for repeat_idx in range(num_repeats):
-            mask = np.zeros(len(raw_cmc), dtype=np.bool)
-            for _, idxs in g_pids_dict.items():
-                # randomly sample one image for each gallery person
-                rnd_idx = np.random.choice(idxs)
-                mask[rnd_idx] = True
-            masked_raw_cmc = raw_cmc[mask]
-            _cmc = masked_raw_cmc.cumsum()
-            _cmc[_cmc > 1] = 1
-            cmc += _cmc[:max_rank].astype(np.float32)
-
-        cmc /= num_repeats
-        all_cmc.append(cmc)
-        # compute AP
-        num_rel = raw_cmc.sum()
-        tmp_cmc = raw_cmc.cumsum()
-        tmp_cmc = [x / (i+1.) for i, x in enumerate(tmp_cmc)]
-        tmp_cmc = np.asarray(tmp_cmc) * raw_cmc
-        AP = tmp_cmc.sum() / num_rel
-        all_AP.append(AP)
-        num_valid_q += 1.
+    for start, end, distmat in blocks:
+        indices, keep, rows, ranks = rank_block(
+            distmat, q_pids[start:end], g_pids, q_camids[start:end], g_camids
+        )
+        AP, _, valid = average_precision(rows, ranks, end - start)
+        all_AP.append(AP[valid])
+        if not valid.any():
+            continue
 
+        # rank (among kept samples) of each gallery sample, in gallery order.
+        # Only samples of the query identity are discarded, so samples of
+        # other identities are all kept
+        kept_rank = np.empty_like(indices)
+        np.put_along_axis(
+            kept_rank, indices, np.cumsum(keep, axis=1, dtype=np.int64), axis=1
+        )
+        b_idxs = np.flatnonzero(valid)
+        kept_rank = kept_rank[b_idxs]
+        num_rel = np.bincount(rows, minlength=end - start)[b_idxs]
+        row_start = np.cumsum(num_rel) - num_rel
+        is_other = group_pids != q_pids[start + b_idxs][:, np.newaxis]
+
+        for _ in range(num_repeats):
+            # randomly sample one image for each gallery person, and one
+            # correct match among the kept samples of the query identity
+            sampled = group_start + (
+                rng.random_sample(is_other.shape) * group_size
+            ).astype(np.int64)
+            sampled_rank = np.take_along_axis(
+                kept_rank, g_order[sampled], axis=1
+            )
+            match = row_start + (rng.random_sample(len(b_idxs)) *
+                                 num_rel).astype(np.int64)
+            match_rank = ranks[match]
+            first_rank = 1 + np.count_nonzero(
+                is_other & (sampled_rank < match_rank[:, np.newaxis]), axis=1
+            )
+            first_rank_hist += np.bincount(
+                np.minimum(first_rank, max_rank + 1) - 1,
+                minlength=max_rank + 1
+            )
+
+    num_valid_q = first_rank_hist.sum() // num_repeats
     assert num_valid_q > 0, 'Error: all query identities do not appear in gallery'
 
-    all_cmc = np.asarray(all_cmc).astype(np.float32)
-    all_cmc = all_cmc.sum(0) / num_valid_q
-    mAP = np.mean(all_AP)
+    all_cmc = np.cumsum(first_rank_hist[:max_rank]).astype(np.float32)
+    all_cmc = all_cmc / (num_valid_q * num_repeats)
+    mAP = np.mean(np.concatenate(all_AP))
 
     return all_cmc, mAP
 
 
-def eval_market1501(distmat, q_pids, g_pids, q_camids, g_camids, max_rank):
-    """Evaluation with market1501 metric
-    Key: for each query identity, its gallery images from the same camera view are discarded.
-    """
-    num_q, num_g = distmat.shape
+def _eval_market1501_blocks(
+    blocks, q_pids, g_pids, q_camids, g_camids, max_rank
+):
+    # number of valid queries whose first correct match is at each rank
+    first_rank_hist = np.zeros(max_rank + 1, dtype=np.int64)
+    all_AP = []
+
+    for start, end, distmat in blocks:
+        _, _, rows, ranks = rank_block(
+            distmat, q_pids[start:end], g_pids, q_camids[start:end], g_camids
+        )
+        AP, first_rank, valid = average_precision(rows, ranks, end - start)
+        first_rank_hist += np.bincount(
+            np.minimum(first_rank[valid], max_rank + 1) - 1,
+            minlength=max_rank + 1
+        )
+        all_AP.append(AP[valid])
+
+    num_valid_q = first_rank_hist.sum()
+    assert num_valid_q > 0, 'Error: all query identities do not appear in gallery'
+
+    all_cmc = np.cumsum(first_rank_hist[:max_rank]).astype(np.float32)
+    all_cmc = all_cmc / num_valid_q
+    mAP = np.mean(np.concatenate(all_AP))
+
+    return all_cmc, mAP
 
+
+def _check_max_rank(num_g, max_rank):
     if num_g < max_rank:
         max_rank = num_g
         print(
             'Note: number of gallery samples is quite small, got {}'.
             format(num_g)
         )
+    return max_rank
 
-    indices = np.argsort(distmat, axis=1)
-    matches = (g_pids[indices] == q_pids[:, np.newaxis]).astype(np.int32)
-
-    # compute cmc curve for each query
-    all_cmc = []
-    all_AP = []
-    num_valid_q = 0. # number of valid query
-
-    for q_idx in range(num_q):
-        # get query pid and camid
-        q_pid = q_pids[q_idx]
-        q_camid = q_camids[q_idx]
-
-        # remove gallery samples that have the same pid and camid with query
-        order = indices[q_idx]
-        remove = (g_pids[order] == q_pid) & (g_camids[order] == q_camid)
-        keep = np.invert(remove)
-
-        # compute cmc curve
-        raw_cmc = matches[q_idx][
-            keep] # binary vector, positions with value 1 are correct matches
-        if not np.any(raw_cmc):
-            # this condition is true when query identity does not appear in gallery
-            continue
-
-        cmc = raw_cmc.cumsum()
-        cmc[cmc > 1] = 1
 
-        all_cmc.append(cmc[:max_rank])
-        num_valid_q += 1.
+def eval_cuhk03(
+    distmat,
+    q_pids,
+    g_pids,
+    q_camids,
+    g_camids,
+    max_rank,
+    block_size=None,
+    seed=None
+):
+    """Evaluation with cuhk03 metric
+    Key: one image for each gallery identity is randomly sampled for each query identity.
+    Random sampling is performed num_repeats times.
 
-        # compute average precision
-        # reference: https://en.wikipedia.org/wiki/Evaluation_measures_(information_retrieval)#Average_precision
-        num_rel = raw_cmc.sum()
-        tmp_cmc = raw_cmc.cumsum()
-        tmp_cmc = [x / (i+1.) for i, x in enumerate(tmp_cmc)]
-        tmp_cmc = np.asarray(tmp_cmc) * raw_cmc
-        AP = tmp_cmc.sum() / num_rel
-        all_AP.append(AP)
+    Sampling is vectorized over queries and identities, and ``seed`` makes
+    the results reproducible. If ``seed`` is None, numpy's global random
+    state is used.
+    """
+    num_g = distmat.shape[1]
+    max_rank = _check_max_rank(num_g, max_rank)
+    blocks = _iter_distmat_blocks(distmat, _get_block_size(num_g, block_size))
+    return _eval_cuhk03_blocks(
+        blocks, q_pids, g_pids, q_camids, g_camids, max_rank, seed=seed
+    )
 
-    assert num_valid_q > 0, 'Error: all query identities do not appear in gallery'
 
-    all_cmc = np.asarray(all_cmc).astype(np.float32)
-    all_cmc = all_cmc.sum(0) / num_valid_q
-    mAP = np.mean(all_AP)
+def eval_market1501(
+    distmat, q_pids, g_pids, q_camids, g_camids, max_rank, block_size=None
+):
+    """Evaluation with market1501 metric
+    Key: for each query identity, its gallery images from the same camera view are discarded.
 
-    return all_cmc, mAP
+    Queries are ranked in blocks of ``block_size`` rows so that the temporary
+    buffers stay bounded regardless of the number of queries.
+    """
+    num_g = distmat.shape[1]
+    max_rank = _check_max_rank(num_g, max_rank)
+    blocks = _iter_distmat_blocks(distmat, _get_block_size(num_g, block_size))
+    return _eval_market1501_blocks(
+        blocks, q_pids, g_pids, q_camids, g_camids, max_rank
+    )
 
 
 def evaluate_py(
-    distmat, q_pids, g_pids, q_camids, g_camids, max_rank, use_metric_cuhk03
+    distmat,
+    q_pids,
+    g_pids,
+    q_camids,
+    g_camids,
+    max_rank,
+    use_metric_cuhk03,
+    block_size=None,
+    seed=None
 ):
     if use_metric_cuhk03:
         return eval_cuhk03(
-            distmat, q_pids, g_pids, q_camids, g_camids, max_rank
+            distmat, q_pids, g_pids, q_camids, g_camids, max_rank, block_size,
+            seed
         )
     else:
         return eval_market1501(
-            distmat, q_pids, g_pids, q_camids, g_camids, max_rank
+            distmat, q_pids, g_pids, q_camids, g_camids, max_rank, block_size
         )
 
 
@@ -174,7 +283,9 @@ def evaluate_rank(
     g_camids,
     max_rank=50,
     use_metric_cuhk03=False,
-    use_cython=True
+    use_cython=True,
+    block_size=None,
+    seed=None
 ):
     """Evaluates CMC rank.
 
@@ -193,9 +304,17 @@ def evaluate_rank(
             Default is False. This should be enabled when using cuhk03 classic split.
         use_cython (bool, optional): use cython code for evaluation. Default is True.
             This is highly recommended as the cython code can speed up the cmc computation
-            by more than 10x. This requires Cython to be installed.
+            by more than 10x. This requires Cython to be installed. If Cython is
+            unavailable, the vectorized python evaluation is used. The cuhk03 metric
+            always uses the vectorized python evaluation, which is faster than the
+            cython one.
+        block_size (int, optional): number of queries ranked at once by the python
+            evaluation. Default is None, meaning it is derived from the gallery size
+            to bound memory usage.
+        seed (int, optional): random seed of the cuhk03 metric. Default is None,
+            meaning numpy's global random state is used.
     """
-    if use_cython and IS_CYTHON_AVAI:
+    if use_cython and IS_CYTHON_AVAI and not use_metric_cuhk03:
         return evaluate_cy(
             distmat, q_pids, g_pids, q_camids, g_camids, max_rank,
             use_metric_cuhk03
@@ -203,5 +322,60 @@ def evaluate_rank(
     else:
         return evaluate_py(
             distmat, q_pids, g_pids, q_camids, g_camids, max_rank,
-            use_metric_cuhk03
+            use_metric_cuhk03, block_size, seed
+        )
+
+
+def evaluate_rank_chunked(
+    qf,
+    gf,
+    q_pids,
+    g_pids,
+    q_camids,
+    g_camids,
+    dist_metric='euclidean',
+    max_rank=50,
+    use_metric_cuhk03=False,
+    block_size=None,
+    seed=None
+):
+    """Evaluates CMC rank without materializing the full distance matrix.
+
+    Distances are computed for blocks of ``block_size`` queries at a time and
+    each block is reduced to the rank of its first correct match (for CMC)
+    and its average precision before the next block is computed. Results are
+    the same as those of ``evaluate_rank`` on the full distance matrix.
+
+    Args:
+        qf (torch.Tensor): 2-D query feature matrix.
+        gf (torch.Tensor): 2-D gallery feature matrix.
+        q_pids (numpy.ndarray): 1-D array containing person identities
+            of each query instance.
+        g_pids (numpy.ndarray): 1-D array containing person identities
+            of each gallery instance.
+        q_camids (numpy.ndarray): 1-D array containing camera views under
+            which each query instance is captured.
+        g_camids (numpy.ndarray): 1-D array containing camera views under
+            which each gallery instance is captured.
+        dist_metric (str, optional): "euclidean" or "cosine". Default is "euclidean".
+        max_rank (int, optional): maximum CMC rank to be computed. Default is 50.
+        use_metric_cuhk03 (bool, optional): use single-gallery-shot setting for cuhk03.
+            Default is False.
+        block_size (int, optional): number of queries processed at once. Peak
+            memory is about ``20 * block_size * num_gallery`` bytes. Default is
+            None, meaning it is derived from the gallery size.
+        seed (int, optional): random seed of the cuhk03 metric. Default is None.
+    """
+    num_g = gf.size(0)
+    max_rank = _check_max_rank(num_g, max_rank)
+    blocks = _iter_feature_blocks(
+        qf, gf, dist_metric, _get_block_size(num_g, block_size)
+    )
+    if use_metric_cuhk03:
+        return _eval_cuhk03_blocks(
+            blocks, q_pids, g_pids, q_camids, g_camids, max_rank, seed=seed
+        )
+    else:
+        return _eval_market1501_blocks(
+            blocks, q_pids, g_pids, q_camids, g_camids, max_rank
         )
@@ -0,0 +1,54 @@
+from __future__ import absolute_import
+import importlib
+from collections.abc import Mapping
+
+
+class LazyModelFactory(Mapping):
+    """Read-only mapping from model names to model constructors which
+    imports the module defining a constructor the first time it is looked
+    up.
+
+    Args:
+        package (str): package containing the model modules.
+        entries (dict): model name -> "module.constructor", e.g.
+            ``{'osnet_x1_0': 'osnet.osnet_x1_0'}``.
+    """
+
+    def __init__(self, package, entries):
+        self.package = package
+        self._entries = dict(
+            (name, tuple(path.rsplit('.', 1)))
+            for name, path in entries.items()
+        )
+
+    def __getitem__(self, name):
+        module, attr = self._entries[name]
+        return getattr(
+            importlib.import_module('.' + module, self.package), attr
+        )
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    @property
+    def modules(self):
+        """Names of the modules defining the models."""
+        return sorted(set(module for module, _ in self._entries.values()))
+
+    @property
+    def constructors(self):
+        """Names of the model constructors."""
+        return sorted(set(attr for _, attr in self._entries.values()))
+
+    def module_of_attr(self, attr):
+        """Returns the module defining a constructor, or None."""
+        for module, attr_ in self._entries.values():
+            if attr_ == attr:
+                return module
+        return None
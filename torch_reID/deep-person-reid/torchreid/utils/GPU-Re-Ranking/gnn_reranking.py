@@ -19,12 +19,23 @@
 import numpy as np
 import torch
 
-import gnn_propagate
-import build_adjacency_matrix
 from utils import *
 
+try:
+    import gnn_propagate
+    import build_adjacency_matrix
+    IS_EXTENSION_AVAI = True
+except ImportError:
+    IS_EXTENSION_AVAI = False
+
 
 def gnn_reranking(X_q, X_g, k1, k2):
+    if not (IS_EXTENSION_AVAI and X_q.is_cuda):
+        # sparse CPU implementation of the same propagation
+        from torchreid.utils import gnn_re_ranking
+        distmat = gnn_re_ranking(X_q.cpu(), X_g.cpu(), k1, k2)
+        return np.argsort(distmat, axis=1)
+
     query_num, gallery_num = X_q.shape[0], X_g.shape[0]
 
     X_u = torch.cat((X_q, X_g), axis=0)
@@ -59,8 +59,9 @@ def main():
 
     gallery_feature = torch.FloatTensor(data['gallery_f'])
     query_feature = torch.FloatTensor(data['query_f'])
-    query_feature = query_feature.cuda()
-    gallery_feature = gallery_feature.cuda()
+    if torch.cuda.is_available():
+        query_feature = query_feature.cuda()
+        gallery_feature = gallery_feature.cuda()
 
     indices = gnn_reranking(query_feature, gallery_feature, args.k1, args.k2)
     evaluate_ranking_list(
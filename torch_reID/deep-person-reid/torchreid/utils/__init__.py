@@ -2,9 +2,17 @@ from __future__ import absolute_import
 
 from .tools import *
 from .rerank import re_ranking
+from .gnn_rerank import gnn_re_ranking
 from .loggers import *
 from .avgmeter import *
 from .reidtools import *
 from .torchtools import *
-from .model_complexity import compute_model_complexity
+from .quantization import *
+from .export import *
+from .model_complexity import (
+    compute_model_complexity, profile_model, print_profile
+)
 from .feature_extractor import FeatureExtractor
+from .batching import MicroBatchingExtractor
+from .feature_store import *
+from .feature_shards import *
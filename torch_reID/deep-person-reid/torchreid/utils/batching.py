@@ -0,0 +1,266 @@
+from __future__ import division, print_function, absolute_import
+import time
+import queue
+import asyncio
+import threading
+import numpy as np
+from collections import deque
+from concurrent.futures import Future
+
+import torch
+
+__all__ = ['MicroBatchingExtractor']
+
+_STOP = object()
+
+
+class _Request(object):
+
+    def __init__(self, images):
+        self.images = images
+        self.future = Future()
+        self.start_time = time.time()
+
+
+class MicroBatchingExtractor(object):
+    """Micro-batching front-end of a ``FeatureExtractor``.
+
+    Requests submitted from any number of threads (or coroutines) are queued
+    and grouped into batches of at most ``max_batch_size`` images. A batch is
+    run as soon as it is full or ``max_wait_ms`` after its first request was
+    taken from the queue, whichever comes first. Each request gets the rows
+    of the batch output corresponding to its own images.
+
+    Inputs are decoded and preprocessed by ``extractor.load_images`` on the
+    caller's thread, so decoding runs in parallel across callers while the
+    model only sees full batches.
+
+    Args:
+        extractor (FeatureExtractor): feature extractor. Any object with
+            ``load_images(input)`` and ``extract(images)`` methods works.
+        max_batch_size (int, optional): maximum number of images per batch.
+            A single request larger than this forms a batch on its own.
+            Default is 32.
+        max_wait_ms (float, optional): maximum time to wait for more requests
+            before running an incomplete batch. Default is 5.
+        num_workers (int, optional): number of batches run concurrently,
+            each by its own thread. Default is 1.
+        max_queue_size (int, optional): maximum number of pending requests,
+            ``submit`` blocks when the queue is full. Default is 0 (unbounded).
+        stats_window (int, optional): number of most recent requests used to
+            compute latency percentiles. Default is 10000.
+
+    Examples::
+
+        from torchreid.utils import FeatureExtractor, MicroBatchingExtractor
+
+        extractor = FeatureExtractor(
+            model_name='osnet_x1_0',
+            model_path='a/b/c/model.pth.tar',
+            device='cuda'
+        )
+        batcher = MicroBatchingExtractor(extractor, max_batch_size=64)
+
+        # from any thread
+        features = batcher(['a/b/c/image001.jpg', 'a/b/c/image002.jpg'])
+        # or without blocking
+        future = batcher.submit(crops)
+        # or from a coroutine
+        features = await batcher.extract_async(crops)
+
+        print(batcher.stats())
+        batcher.close()
+    """
+
+    def __init__(
+        self,
+        extractor,
+        max_batch_size=32,
+        max_wait_ms=5,
+        num_workers=1,
+        max_queue_size=0,
+        stats_window=10000
+    ):
+        self.extractor = extractor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.
+        self.num_workers = num_workers
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._closed = False
+        # no request may be queued after the stop sentinels
+        self._submit_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._latencies = deque(maxlen=stats_window)
+        self.reset_stats()
+
+        self._workers = []
+        for i in range(num_workers):
+            worker = threading.Thread(
+                target=self._worker_loop,
+                name='MicroBatchingExtractor-{}'.format(i),
+                daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, input):
+        """Queues a request.
+
+        Args:
+            input: any input accepted by ``FeatureExtractor``.
+
+        Returns:
+            concurrent.futures.Future: resolves to a tensor of shape (B, D).
+        """
+        if self._closed:
+            raise RuntimeError('MicroBatchingExtractor is closed')
+        request = _Request(self.extractor.load_images(input))
+        with self._submit_lock:
+            if self._closed:
+                raise RuntimeError('MicroBatchingExtractor is closed')
+            self._queue.put(request)
+        return request.future
+
+    def __call__(self, input):
+        return self.submit(input).result()
+
+    async def extract_async(self, input):
+        """Coroutine version of ``__call__``.
+
+        Preprocessing runs in the default executor of the running loop so
+        that the loop is not blocked by image decoding.
+        """
+        loop = asyncio.get_running_loop()
+        future = await loop.run_in_executor(None, self.submit, input)
+        return await asyncio.wrap_future(future)
+
+    def _next_batch(self, pending):
+        # pending holds a request which did not fit in the previous batch
+        requests = [pending] if pending is not None else [self._queue.get()]
+        if requests[0] is _STOP:
+            return requests, None
+
+        num_images = requests[0].images.size(0)
+        deadline = time.time() + self.max_wait
+        while num_images < self.max_batch_size:
+            timeout = deadline - time.time()
+            try:
+                if timeout > 0:
+                    request = self._queue.get(timeout=timeout)
+                else:
+                    request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is _STOP or \
+                    num_images + request.images.size(0) > self.max_batch_size:
+                return requests, request
+            requests.append(request)
+            num_images += request.images.size(0)
+
+        return requests, None
+
+    def _worker_loop(self):
+        pending = None
+        while True:
+            requests, pending = self._next_batch(pending)
+            if requests[0] is _STOP:
+                break
+            # drop requests cancelled by their caller (e.g. a timeout around
+            # extract_async), the others can no longer be cancelled
+            requests = [
+                request for request in requests
+                if request.future.set_running_or_notify_cancel()
+            ]
+            if requests:
+                self._run_batch(requests)
+            if pending is _STOP:
+                break
+
+    def _run_batch(self, requests):
+        sizes = [request.images.size(0) for request in requests]
+        try:
+            images = torch.cat([request.images for request in requests], 0)
+            features = self.extractor.extract(images)
+        except Exception as e:
+            if len(requests) > 1:
+                # isolate the faulty request, e.g. one with a different
+                # image size, so that it does not fail the others
+                for request in requests:
+                    self._run_batch([request])
+            else:
+                requests[0].future.set_exception(e)
+            return
+
+        end = time.time()
+        for request, f in zip(requests, features.split(sizes, 0)):
+            request.future.set_result(f)
+
+        with self._stats_lock:
+            if self._start_time is None:
+                self._start_time = min(r.start_time for r in requests)
+            self._end_time = end
+            self._num_requests += len(requests)
+            self._num_batches += 1
+            self._num_images += sum(sizes)
+            self._latencies.extend(end - r.start_time for r in requests)
+
+    def reset_stats(self):
+        """Resets the statistics returned by ``stats``."""
+        with self._stats_lock:
+            self._start_time = None
+            self._end_time = None
+            self._num_requests = 0
+            self._num_batches = 0
+            self._num_images = 0
+            self._latencies.clear()
+
+    def stats(self):
+        """Returns latency and throughput statistics.
+
+        Returns:
+            dict: number of requests, batches and images served, average
+            batch size, throughput in images per second (from the first
+            request to the last batch) and mean/p50/p95/p99 request latency
+            in milliseconds (over the last ``stats_window`` requests).
+        """
+        with self._stats_lock:
+            stats = {
+                'num_requests': self._num_requests,
+                'num_batches': self._num_batches,
+                'num_images': self._num_images,
+                'avg_batch_size': self._num_images / max(self._num_batches, 1),
+                'images_per_sec': 0.,
+                'latency_ms_mean': 0.,
+                'latency_ms_p50': 0.,
+                'latency_ms_p95': 0.,
+                'latency_ms_p99': 0.
+            }
+            if self._num_batches > 0:
+                elapsed = self._end_time - self._start_time
+                stats['images_per_sec'] = self._num_images / max(elapsed, 1e-6)
+                latencies = np.asarray(self._latencies) * 1000
+                stats['latency_ms_mean'] = float(latencies.mean())
+                for q in (50, 95, 99):
+                    stats['latency_ms_p{}'.format(q)] = float(
+                        np.percentile(latencies, q)
+                    )
+        return stats
+
+    def close(self):
+        """Processes the queued requests and stops the worker threads."""
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+            for _ in self._workers:
+                self._queue.put(_STOP)
+        for worker in self._workers:
+            worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,126 @@
+from __future__ import division, print_function, absolute_import
+import json
+import zipfile
+import torch
+import torch.nn as nn
+
+from .torchtools import optimize_for_inference
+
+__all__ = ['export_model', 'load_exported_model', 'is_exported_model']
+
+# name of the metadata file embedded in exported archives
+META_FILE = 'torchreid_meta.json'
+
+
+def export_model(
+    model,
+    fpath,
+    image_size=(256, 128),
+    pixel_mean=[0.485, 0.456, 0.406],
+    pixel_std=[0.229, 0.224, 0.225],
+    pixel_norm=True,
+    model_name='',
+    optimize=True,
+    method='trace'
+):
+    r"""Exports a model to a self-contained TorchScript archive.
+
+    The model is optimized with ``optimize_for_inference`` (BatchNorm
+    folding etc.), converted to TorchScript, frozen and saved together with
+    the preprocessing parameters. The archive can be loaded without building
+    the Python model, see ``load_exported_model`` and ``FeatureExtractor``.
+
+    Args:
+        model (nn.Module): model with trained weights, e.g. built with
+            ``build_model`` and ``load_pretrained_weights``, or a quantized
+            model from ``quantize_model``.
+        fpath (str): output path.
+        image_size (tuple, optional): input height and width.
+        pixel_mean (list, optional): pixel mean for normalization.
+        pixel_std (list, optional): pixel std for normalization.
+        pixel_norm (bool, optional): whether to normalize pixels.
+        model_name (str, optional): stored in the metadata for reference.
+        optimize (bool, optional): apply ``optimize_for_inference`` first.
+            Default is True.
+        method (str, optional): "trace" or "script". Tracing supports every
+            model whose eval forward has no data-dependent control flow.
+            Default is "trace".
+
+    Returns:
+        dict: metadata stored in the archive.
+
+    Examples::
+        >>> from torchreid.utils import export_model
+        >>> export_model(model, 'osnet_x1_0.pt', model_name='osnet_x1_0')
+        >>> extractor = FeatureExtractor(model_path='osnet_x1_0.pt')
+    """
+    if method not in ['trace', 'script']:
+        raise ValueError(
+            'Unknown export method: {}. '
+            'Please choose either "trace" or "script"'.format(method)
+        )
+    if isinstance(model, nn.DataParallel):
+        model = model.module
+    model.eval()
+    input_size = (1, 3, image_size[0], image_size[1])
+    if optimize:
+        model = optimize_for_inference(model, input_size=input_size)
+
+    param = next(model.parameters(), None)
+    device = param.device if param is not None else 'cpu'
+    x = torch.randn(*input_size, device=device)
+    with torch.no_grad():
+        if method == 'trace':
+            scripted = torch.jit.trace(model, x)
+        else:
+            scripted = torch.jit.script(model)
+        scripted = torch.jit.freeze(scripted.eval())
+        feature_dim = scripted(x).size(1)
+
+    meta = {
+        'model_name': model_name,
+        'image_size': list(image_size),
+        'pixel_mean': list(pixel_mean),
+        'pixel_std': list(pixel_std),
+        'pixel_norm': pixel_norm,
+        'feature_dim': feature_dim
+    }
+    torch.jit.save(
+        scripted, fpath, _extra_files={META_FILE: json.dumps(meta)}
+    )
+    return meta
+
+
+def load_exported_model(fpath, map_location='cpu'):
+    r"""Loads a model saved by ``export_model``.
+
+    Args:
+        fpath (str): path to the archive.
+        map_location (str or torch.device, optional): device to load to.
+
+    Returns:
+        tuple: (model, meta) where model is a ``torch.jit.ScriptModule`` in
+        eval mode and meta is the metadata dictionary (empty for TorchScript
+        archives not created by ``export_model``).
+    """
+    extra_files = {META_FILE: ''}
+    model = torch.jit.load(
+        fpath, map_location=map_location, _extra_files=extra_files
+    )
+    meta = extra_files[META_FILE]
+    meta = json.loads(meta) if meta else {}
+    return model.eval(), meta
+
+
+def is_exported_model(fpath):
+    r"""Checks whether a file is a TorchScript archive.
+
+    Regular checkpoints saved with ``torch.save`` are zip archives too, but
+    only TorchScript archives contain compiled code.
+    """
+    if not zipfile.is_zipfile(fpath):
+        return False
+    with zipfile.ZipFile(fpath) as archive:
+        return any(
+            name.endswith('/constants.pkl') for name in archive.namelist()
+        )
@@ -1,15 +1,54 @@
 from __future__ import absolute_import
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 import torch
-import torchvision.transforms as T
 from PIL import Image
 
 from torchreid.utils import (
-    check_isfile, load_pretrained_weights, compute_model_complexity
+    check_isfile, load_pretrained_weights, compute_model_complexity,
+    optimize_for_inference, load_quantized_model, load_exported_model,
+    is_exported_model
 )
 from torchreid.models import build_model
 
 
+class _Preprocess(object):
+    """Resizes a PIL image, converts it to a tensor and normalizes it.
+
+    Equivalent to ``Compose([Resize(image_size), ToTensor(), Normalize()])``
+    from torchvision, which is not imported to keep start-up fast.
+    """
+
+    def __init__(self, image_size, pixel_mean, pixel_std, pixel_norm):
+        self.image_size = image_size
+        self.mean = torch.tensor(pixel_mean).view(-1, 1, 1)
+        self.std = torch.tensor(pixel_std).view(-1, 1, 1)
+        self.pixel_norm = pixel_norm
+
+    def _output_size(self, width, height):
+        if not isinstance(self.image_size, int):
+            return self.image_size[1], self.image_size[0]
+        # the smaller edge is matched to image_size
+        short, long = sorted((width, height))
+        new_short, new_long = self.image_size, int(
+            self.image_size * long / short
+        )
+        if width <= height:
+            return new_short, new_long
+        return new_long, new_short
+
+    def __call__(self, image):
+        image = image.resize(
+            self._output_size(*image.size), resample=Image.BILINEAR
+        )
+        image = torch.from_numpy(np.array(image, np.uint8, copy=True))
+        image = image.view(image.size(0), image.size(1), -1)
+        image = image.permute(2, 0, 1).contiguous().float().div(255)
+        if self.pixel_norm:
+            image.sub_(self.mean).div_(self.std)
+        return image
+
+
 class FeatureExtractor(object):
     """A simple API for feature extraction.
 
@@ -33,6 +72,10 @@ class FeatureExtractor(object):
         pixel_norm (bool): whether to normalize pixels.
         device (str): 'cpu' or 'cuda' (could be specific gpu devices).
         verbose (bool): show model details.
+        optimize (bool): fold BatchNorm layers and remove no-op layers with
+            ``torchreid.utils.optimize_for_inference``.
+        quantized (bool): ``model_path`` contains int8 weights saved from
+            ``torchreid.utils.quantize_model``. Requires device='cpu'.
 
     Examples::
 
@@ -65,9 +108,51 @@ class FeatureExtractor(object):
         pixel_std=[0.229, 0.224, 0.225],
         pixel_norm=True,
         device='cuda',
-        verbose=True
+        verbose=True,
+        optimize=False,
+        quantized=False
+    ):
+        if quantized and not device.startswith('cpu'):
+            raise ValueError('Quantized models can only run on CPU')
+
+        if model_path and check_isfile(model_path) and \
+                is_exported_model(model_path):
+            # fast start: no model construction, preprocessing parameters
+            # come from the archive
+            model, meta = load_exported_model(model_path, map_location=device)
+            image_size = meta.get('image_size', image_size)
+            pixel_mean = meta.get('pixel_mean', pixel_mean)
+            pixel_std = meta.get('pixel_std', pixel_std)
+            pixel_norm = meta.get('pixel_norm', pixel_norm)
+            if verbose:
+                print(
+                    'Model: {} (exported to "{}")'.format(
+                        meta.get('model_name', ''), model_path
+                    )
+                )
+        else:
+            model = self._build_model(
+                model_name, model_path, image_size, device, verbose, optimize,
+                quantized
+            )
+
+        # Class attributes
+        self.model = model
+        self.preprocess = _Preprocess(
+            image_size, pixel_mean, pixel_std, pixel_norm
+        )
+        self.device = torch.device(device)
+        self.image_size = image_size
+        self.pixel_mean = pixel_mean
+        self.pixel_std = pixel_std
+        self.pixel_norm = pixel_norm
+        self._to_pil = None
+
+    @staticmethod
+    def _build_model(
+        model_name, model_path, image_size, device, verbose, optimize,
+        quantized
     ):
-        # Build model
         model = build_model(
             model_name,
             num_classes=1,
@@ -84,29 +169,33 @@ class FeatureExtractor(object):
             print('- params: {:,}'.format(num_params))
             print('- flops: {:,}'.format(flops))
 
-        if model_path and check_isfile(model_path):
+        if quantized:
+            model = load_quantized_model(
+                model, model_path, input_size=(1, 3, image_size[0], image_size[1])
+            )
+        elif model_path and check_isfile(model_path):
             load_pretrained_weights(model, model_path)
 
-        # Build transform functions
-        transforms = []
-        transforms += [T.Resize(image_size)]
-        transforms += [T.ToTensor()]
-        if pixel_norm:
-            transforms += [T.Normalize(mean=pixel_mean, std=pixel_std)]
-        preprocess = T.Compose(transforms)
-
-        to_pil = T.ToPILImage()
+        model.to(torch.device(device))
+        if optimize and not quantized:
+            model = optimize_for_inference(
+                model, input_size=(1, 3, image_size[0], image_size[1])
+            )
+        return model
 
-        device = torch.device(device)
-        model.to(device)
+    @property
+    def to_pil(self):
+        if self._to_pil is None:
+            import torchvision.transforms as T
+            self._to_pil = T.ToPILImage()
+        return self._to_pil
 
-        # Class attributes
-        self.model = model
-        self.preprocess = preprocess
-        self.to_pil = to_pil
-        self.device = device
+    def load_images(self, input):
+        """Converts any supported input to a preprocessed batch.
 
-    def __call__(self, input):
+        Returns:
+            torch.Tensor: images of shape (B, C, H, W).
+        """
         if isinstance(input, list):
             images = []
 
@@ -126,27 +215,133 @@ class FeatureExtractor(object):
                 images.append(image)
 
             images = torch.stack(images, dim=0)
-            images = images.to(self.device)
 
         elif isinstance(input, str):
             image = Image.open(input).convert('RGB')
             image = self.preprocess(image)
-            images = image.unsqueeze(0).to(self.device)
+            images = image.unsqueeze(0)
 
         elif isinstance(input, np.ndarray):
             image = self.to_pil(input)
             image = self.preprocess(image)
-            images = image.unsqueeze(0).to(self.device)
+            images = image.unsqueeze(0)
 
         elif isinstance(input, torch.Tensor):
             if input.dim() == 3:
                 input = input.unsqueeze(0)
-            images = input.to(self.device)
+            images = input
 
         else:
             raise NotImplementedError
 
+        return images
+
+    def extract(self, images):
+        """Runs the model on a batch returned by ``load_images``."""
+        images = images.to(self.device)
         with torch.no_grad():
             features = self.model(images)
-
         return features
+
+    def __call__(self, input):
+        return self.extract(self.load_images(input))
+
+    def extract_paths(
+        self, paths, batch_size=32, num_workers=4, use_cv2=False
+    ):
+        """Extracts features of image files, batch by batch.
+
+        Images are decoded and preprocessed by a pool of ``num_workers``
+        threads, and the next batch is decoded while the model runs on the
+        current one.
+
+        Args:
+            paths (list): image paths.
+            batch_size (int, optional): number of images per batch. Default is 32.
+            num_workers (int, optional): number of decoding threads. If 0,
+                images are decoded on the calling thread without overlap.
+                Default is 4.
+            use_cv2 (bool, optional): decode and resize with OpenCV into a
+                preallocated uint8 buffer, then convert and normalize the
+                whole batch at once. This is faster than the default PIL
+                pipeline but resizing differs slightly, so features are not
+                bit-identical. Requires ``image_size`` to be (height, width).
+                Default is False.
+
+        Yields:
+            torch.Tensor: features of each batch, of shape (B, D), in the
+            order of ``paths``.
+
+        Examples::
+
+            features = torch.cat(list(extractor.extract_paths(image_list)))
+        """
+        if use_cv2:
+            if isinstance(self.image_size, int) or len(self.image_size) != 2:
+                raise ValueError(
+                    'use_cv2 requires image_size to be (height, width), '
+                    'but got {}'.format(self.image_size)
+                )
+            load_batch = self._load_batch_cv2
+        else:
+            load_batch = self._load_batch_pil
+
+        batches = [
+            paths[i:i + batch_size] for i in range(0, len(paths), batch_size)
+        ]
+        if not batches:
+            return
+
+        if num_workers <= 0:
+            for batch in batches:
+                yield self.extract(load_batch(batch, map)())
+            return
+
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            # decoding of each image is submitted right away, and the
+            # decoded batch is collated when the model is ready for it
+            pending = load_batch(batches[0], pool.map)
+            for i in range(len(batches)):
+                collate = pending
+                if i + 1 < len(batches):
+                    pending = load_batch(batches[i + 1], pool.map)
+                yield self.extract(collate())
+
+    def _load_batch_pil(self, paths, map_fn):
+        def _load(path):
+            return self.preprocess(Image.open(path).convert('RGB'))
+
+        images = map_fn(_load, paths)
+        return lambda: torch.stack(list(images))
+
+    def _load_batch_cv2(self, paths, map_fn):
+        import cv2
+
+        height, width = self.image_size
+        buffer = np.empty((len(paths), height, width, 3), dtype=np.uint8)
+
+        def _load(job):
+            idx, path = job
+            image = cv2.imread(path, cv2.IMREAD_COLOR)
+            if image is None:
+                raise IOError('Cannot read image: {}'.format(path))
+            cv2.resize(
+                image, (width, height),
+                dst=buffer[idx],
+                interpolation=cv2.INTER_LINEAR
+            )
+
+        done = map_fn(_load, enumerate(paths))
+
+        def _collate():
+            list(done) # waits for all images and raises decoding errors
+            # BGR uint8 (B, H, W, C) -> normalized RGB float (B, C, H, W)
+            images = torch.from_numpy(buffer[..., ::-1].copy())
+            images = images.permute(0, 3, 1, 2).float().div_(255)
+            if self.pixel_norm:
+                mean = torch.tensor(self.pixel_mean).view(1, 3, 1, 1)
+                std = torch.tensor(self.pixel_std).view(1, 3, 1, 1)
+                images.sub_(mean).div_(std)
+            return images
+
+        return _collate
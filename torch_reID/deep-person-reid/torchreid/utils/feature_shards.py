@@ -0,0 +1,256 @@
+from __future__ import division, print_function, absolute_import
+import os
+import json
+import hashlib
+import numpy as np
+import os.path as osp
+
+from .tools import read_json, write_json, mkdir_if_missing
+
+__all__ = [
+    'list_images', 'read_manifest', 'ShardedFeatureWriter',
+    'iter_feature_shards'
+]
+
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.ppm', '.webp')
+
+
+def list_images(root, extensions=IMG_EXTENSIONS):
+    """Recursively lists images under a directory.
+
+    Args:
+        root (str): directory path.
+        extensions (tuple, optional): accepted file extensions (lower case).
+
+    Returns:
+        list: sorted image paths.
+    """
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        for fname in filenames:
+            if not fname.startswith('.') and \
+                    osp.splitext(fname)[1].lower() in extensions:
+                paths.append(osp.join(dirpath, fname))
+    paths.sort()
+    return paths
+
+
+def read_manifest(fpath):
+    """Reads a manifest file with one image path per line."""
+    with open(fpath, 'r') as f:
+        return [line.rstrip('\n') for line in f if line.strip()]
+
+
+def _manifest_digest(paths):
+    sha1 = hashlib.sha1()
+    for path in paths:
+        sha1.update(path.encode())
+        sha1.update(b'\n')
+    return sha1.hexdigest()
+
+
+class ShardedFeatureWriter(object):
+    """Writes features of a list of images to fixed-size ``.npy`` shards.
+
+    The i-th row of the concatenated shards holds the features of the i-th
+    line of ``manifest.txt``, which serves as the id manifest::
+
+        save_dir/manifest.txt       # one image path per line
+        save_dir/meta.json          # shard layout and progress
+        save_dir/features_00000.npy # rows [0, shard_size)
+        save_dir/features_00001.npy # rows [shard_size, 2*shard_size)
+        ...
+
+    Shards are memory-mapped and flushed after each write, and the progress
+    in meta.json is updated afterwards, so an interrupted run can be resumed
+    from the last completed write.
+
+    Args:
+        save_dir (str): output directory.
+        paths (list): image paths, in extraction order.
+        shard_size (int, optional): number of rows per shard. Default is 100000.
+        dtype (str, optional): feature dtype, e.g. "float32" or "float16".
+            Default is "float32".
+        meta (dict, optional): extra information saved to meta.json, e.g.
+            the model name. Must be JSON serializable.
+        resume (bool, optional): continue a previous run found in
+            ``save_dir`` with the same paths, shard layout, meta and feature
+            dimension. If False, existing results are overwritten. Default
+            is True.
+
+    Examples::
+
+        from torchreid.utils import list_images, ShardedFeatureWriter
+
+        paths = list_images('crops/')
+        with ShardedFeatureWriter('features/', paths) as writer:
+            todo = paths[writer.num_done:]
+            for features in extractor.extract_paths(todo):
+                writer.write(features)
+    """
+
+    def __init__(
+        self,
+        save_dir,
+        paths,
+        shard_size=100000,
+        dtype='float32',
+        meta=None,
+        resume=True
+    ):
+        self.save_dir = save_dir
+        self.paths = list(paths)
+        self.shard_size = int(shard_size)
+        self.dtype = np.dtype(dtype).name
+        mkdir_if_missing(save_dir)
+
+        digest = _manifest_digest(self.paths)
+        # json round trip so that e.g. tuples compare equal to stored lists
+        meta = json.loads(json.dumps(meta or {}))
+        meta_file = osp.join(save_dir, 'meta.json')
+        if resume and osp.isfile(meta_file):
+            self.meta = read_json(meta_file)
+            expected = dict(
+                meta,
+                manifest_sha1=digest,
+                shard_size=self.shard_size,
+                dtype=self.dtype
+            )
+            mismatch = [
+                key for key in sorted(expected)
+                if self.meta.get(key) != expected[key]
+            ]
+            if mismatch:
+                raise ValueError(
+                    '"{}" holds the results of a different run (mismatch in '
+                    '{}), use resume=False to overwrite them'.format(
+                        save_dir, ', '.join(mismatch)
+                    )
+                )
+        else:
+            with open(osp.join(save_dir, 'manifest.txt'), 'w') as f:
+                for path in self.paths:
+                    f.write(path + '\n')
+            self.meta = dict(meta)
+            self.meta.update(
+                {
+                    'num_images': len(self.paths),
+                    'shard_size': self.shard_size,
+                    'dtype': self.dtype,
+                    'dim': None,
+                    'num_done': 0,
+                    'manifest_sha1': digest
+                }
+            )
+            self._save_meta()
+
+        self._shard_idx = None
+        self._shard = None
+
+    @property
+    def num_done(self):
+        """Number of images whose features have been written."""
+        return self.meta['num_done']
+
+    @property
+    def num_shards(self):
+        return -(-len(self.paths) // self.shard_size)
+
+    def shard_path(self, shard_idx):
+        return osp.join(
+            self.save_dir, 'features_{:05d}.npy'.format(shard_idx)
+        )
+
+    def _save_meta(self):
+        meta_file = osp.join(self.save_dir, 'meta.json')
+        write_json(self.meta, meta_file + '.tmp')
+        os.replace(meta_file + '.tmp', meta_file)
+
+    def _open_shard(self, shard_idx):
+        if self._shard is not None:
+            self._shard.flush()
+        fpath = self.shard_path(shard_idx)
+        start = shard_idx * self.shard_size
+        num_rows = min(self.shard_size, len(self.paths) - start)
+        # shards holding completed rows are reopened, others are (re)created
+        mode = 'r+' if start < self.num_done else 'w+'
+        self._shard = np.lib.format.open_memmap(
+            fpath,
+            mode=mode,
+            dtype=self.dtype,
+            shape=None if mode == 'r+' else (num_rows, self.meta['dim'])
+        )
+        self._shard_idx = shard_idx
+
+    def write(self, features):
+        """Appends the features of the next images.
+
+        Args:
+            features (torch.Tensor or numpy.ndarray): array of shape (B, D).
+        """
+        if hasattr(features, 'detach'):
+            features = features.detach().cpu().numpy()
+        features = np.asarray(features)
+        if self.meta['dim'] is None:
+            self.meta['dim'] = int(features.shape[1])
+        elif self.meta['dim'] != features.shape[1]:
+            raise ValueError(
+                'Expected features of dimension {}, got {}, use resume=False '
+                'to overwrite the previous results'.format(
+                    self.meta['dim'], features.shape[1]
+                )
+            )
+        if self.num_done + len(features) > len(self.paths):
+            raise ValueError('Got more features than images')
+
+        written = 0
+        while written < len(features):
+            row = self.num_done + written
+            shard_idx = row // self.shard_size
+            if shard_idx != self._shard_idx:
+                self._open_shard(shard_idx)
+            offset = row - shard_idx * self.shard_size
+            n = min(len(features) - written, len(self._shard) - offset)
+            self._shard[offset:offset + n] = features[written:written + n]
+            written += n
+
+        if written > 0:
+            self._shard.flush()
+            self.meta['num_done'] += written
+            self._save_meta()
+
+    def close(self):
+        if self._shard is not None:
+            self._shard.flush()
+            self._shard = None
+            self._shard_idx = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def iter_feature_shards(save_dir):
+    """Iterates over the shards written by ``ShardedFeatureWriter``.
+
+    Only completed rows are returned.
+
+    Yields:
+        tuple: (paths, features) of each shard, where features is a
+        read-only memory-mapped array.
+    """
+    meta = read_json(osp.join(save_dir, 'meta.json'))
+    paths = read_manifest(osp.join(save_dir, 'manifest.txt'))
+    shard_size = meta['shard_size']
+    for start in range(0, meta['num_done'], shard_size):
+        features = np.load(
+            osp.join(
+                save_dir, 'features_{:05d}.npy'.format(start // shard_size)
+            ),
+            mmap_mode='r'
+        )
+        end = min(start + shard_size, meta['num_done'])
+        yield paths[start:end], features[:end - start]
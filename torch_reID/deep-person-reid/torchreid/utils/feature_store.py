@@ -0,0 +1,183 @@
+from __future__ import division, print_function, absolute_import
+import os
+import shutil
+import hashlib
+import numpy as np
+import os.path as osp
+import torch
+
+from .tools import read_json, write_json, mkdir_if_missing
+
+__all__ = ['FeatureStore', 'compute_model_fingerprint']
+
+
+def compute_model_fingerprint(models):
+    """Computes a fingerprint of model weights.
+
+    The fingerprint covers the names and values of all parameters and
+    buffers, so it changes whenever the checkpoint changes.
+
+    Args:
+        models (nn.Module or list): a model or a list of models.
+
+    Returns:
+        str: sha1 hex digest.
+
+    Examples::
+        >>> from torchreid.utils import compute_model_fingerprint
+        >>> fingerprint = compute_model_fingerprint(model)
+    """
+    if not isinstance(models, (list, tuple)):
+        models = [models]
+    sha1 = hashlib.sha1()
+    for model in models:
+        for name, tensor in model.state_dict().items():
+            tensor = tensor.detach().cpu().contiguous().reshape(-1)
+            sha1.update(name.encode())
+            sha1.update(str(tensor.dtype).encode())
+            sha1.update(tensor.view(torch.uint8).numpy().tobytes())
+    return sha1.hexdigest()
+
+
+class FeatureStore(object):
+    """Persistent store of extracted features backed by memory-mapped files.
+
+    Each entry holds the features, pids and camids of one split of a dataset
+    and lives in its own directory under ``root``::
+
+        root/<key>/features.npy  # float array of shape (N, D)
+        root/<key>/pids.npy
+        root/<key>/camids.npy
+        root/<key>/meta.json
+
+    Features are returned as tensors sharing memory with a copy-on-write
+    memory map, so loading an entry costs almost nothing until the features
+    are actually read.
+
+    Args:
+        root (str): directory where entries are stored.
+
+    Examples::
+        >>> from torchreid.utils import FeatureStore, compute_model_fingerprint
+        >>> store = FeatureStore('log/feature_store')
+        >>> key = store.make_key(
+        >>>     compute_model_fingerprint(model), 'market1501', 'gallery',
+        >>>     repr(datamanager.transform_te)
+        >>> )
+        >>> entry = store.load(key)
+        >>> if entry is None:
+        >>>     entry = store.save(key, gf, g_pids, g_camids)
+        >>> gf, g_pids, g_camids = entry
+    """
+
+    def __init__(self, root):
+        self.root = osp.abspath(osp.expanduser(root))
+        mkdir_if_missing(self.root)
+
+    @staticmethod
+    def make_key(fingerprint, dataset_name, split, transform_config, data=None):
+        """Builds the key of an entry.
+
+        Args:
+            fingerprint (str): checkpoint fingerprint, see
+                ``compute_model_fingerprint``.
+            dataset_name (str): dataset name.
+            split (str): split name, e.g. "query" or "gallery".
+            transform_config (str): description of the test transforms.
+            data (list, optional): items of the split, e.g. tuples of
+                (img_path, pid, camid, dsetid). Distinguishes different
+                ``split_id`` of the same dataset. Default is None.
+
+        Returns:
+            str: key.
+        """
+        sha1 = hashlib.sha1()
+        for field in (fingerprint, dataset_name, split, transform_config):
+            sha1.update(str(field).encode())
+            sha1.update(b'\0')
+        if data is not None:
+            sha1.update(repr(list(data)).encode())
+        return sha1.hexdigest()
+
+    def _entry_dir(self, key):
+        return osp.join(self.root, key)
+
+    def __contains__(self, key):
+        return osp.isfile(osp.join(self._entry_dir(key), 'meta.json'))
+
+    def load(self, key):
+        """Loads an entry.
+
+        Returns:
+            tuple or None: (features, pids, camids) where features is a
+            torch.Tensor and pids/camids are numpy arrays, or None if the
+            entry does not exist.
+        """
+        if key not in self:
+            return None
+        entry_dir = self._entry_dir(key)
+        features = np.load(
+            osp.join(entry_dir, 'features.npy'), mmap_mode='c'
+        )
+        pids = np.load(osp.join(entry_dir, 'pids.npy'))
+        camids = np.load(osp.join(entry_dir, 'camids.npy'))
+        return torch.from_numpy(features), pids, camids
+
+    def save(self, key, features, pids, camids, meta=None):
+        """Writes an entry and returns it as loaded from disk.
+
+        Files are first written to a temporary directory which is then
+        renamed, so a crashed or concurrent writer never leaves a partial
+        entry behind.
+
+        Args:
+            key (str): entry key.
+            features (torch.Tensor): 2-D feature matrix.
+            pids (numpy.ndarray): 1-D array of person identities.
+            camids (numpy.ndarray): 1-D array of camera views.
+            meta (dict, optional): extra information saved to meta.json.
+        """
+        entry_dir = self._entry_dir(key)
+        tmp_dir = '{}.tmp{}'.format(entry_dir, os.getpid())
+        mkdir_if_missing(tmp_dir)
+
+        features = features.detach().cpu().numpy()
+        np.save(osp.join(tmp_dir, 'features.npy'), features)
+        np.save(osp.join(tmp_dir, 'pids.npy'), np.asarray(pids))
+        np.save(osp.join(tmp_dir, 'camids.npy'), np.asarray(camids))
+
+        meta = dict(meta or {})
+        meta['shape'] = list(features.shape)
+        meta['dtype'] = str(features.dtype)
+        write_json(meta, osp.join(tmp_dir, 'meta.json'))
+
+        if osp.isdir(entry_dir) and key not in self:
+            # leftover of an interrupted removal
+            shutil.rmtree(entry_dir, ignore_errors=True)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # another process has written the same entry
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        return self.load(key)
+
+    def meta(self, key):
+        """Returns the meta information of an entry."""
+        return read_json(osp.join(self._entry_dir(key), 'meta.json'))
+
+    def find(self, **meta):
+        """Returns the keys of the entries whose meta information matches
+        the given fields, e.g. ``store.find(dataset='market1501')``."""
+        keys = []
+        for key in sorted(os.listdir(self.root)):
+            if key in self and all(
+                self.meta(key).get(field) == value
+                for field, value in meta.items()
+            ):
+                keys.append(key)
+        return keys
+
+    def remove(self, key):
+        """Removes an entry."""
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
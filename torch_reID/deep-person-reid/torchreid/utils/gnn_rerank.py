@@ -0,0 +1,148 @@
+"""
+CPU implementation of the GNN re-ranking in GPU-Re-Ranking/gnn_reranking.py.
+
+Understanding Image Retrieval Re-Ranking: A Graph Neural Network Perspective.
+Zhang et al. arXiv:2012.07620.
+
+The CUDA extensions build_adjacency_matrix and gnn_propagate are replaced
+by sparse PyTorch operators, so the adjacency matrix never becomes a dense
+(N, N) tensor and the intra-op thread pool of PyTorch is used.
+"""
+from __future__ import division, print_function, absolute_import
+import torch
+from torch.nn import functional as F
+
+__all__ = ['gnn_re_ranking', 'build_adjacency_matrix', 'gnn_propagate']
+
+
+def _topk_similarity(X, k, block_size=4096):
+    """Returns the top-k cosine similarities and indices of each row of X
+    against all rows of X, computed block by block."""
+    S, initial_rank = [], []
+    for start in range(0, X.size(0), block_size):
+        score = torch.mm(X[start:start + block_size], X.t())
+        s, i = score.topk(k=k, dim=-1, largest=True, sorted=True)
+        S.append(s)
+        initial_rank.append(i)
+    return torch.cat(S), torch.cat(initial_rank)
+
+
+def _row_sparse(initial_rank, values, num):
+    """Builds a sparse (num, num) matrix with row i holding values[i] at
+    columns initial_rank[i]."""
+    k = initial_rank.size(1)
+    rows = torch.arange(num, device=initial_rank.device).repeat_interleave(k)
+    indices = torch.stack([rows, initial_rank.reshape(-1)])
+    return torch.sparse_coo_tensor(
+        indices, values.reshape(-1), (num, num)
+    ).coalesce()
+
+
+def build_adjacency_matrix(initial_rank):
+    """Sparse equivalent of the build_adjacency_matrix extension.
+
+    Args:
+        initial_rank (torch.Tensor): (N, k) indices of the k nearest
+            neighbours of each node.
+
+    Returns:
+        torch.Tensor: sparse (N, N) matrix A with A[i, initial_rank[i]] = 1.
+    """
+    num = initial_rank.size(0)
+    values = torch.ones(initial_rank.shape, device=initial_rank.device)
+    return _row_sparse(initial_rank, values, num)
+
+
+def gnn_propagate(A, initial_rank, S):
+    """Sparse equivalent of the gnn_propagate extension.
+
+    Args:
+        A (torch.Tensor): sparse (N, N) adjacency matrix.
+        initial_rank (torch.Tensor): (N, k2) indices of the neighbours to
+            aggregate for each node.
+        S (torch.Tensor): (N, k2) aggregation weights.
+
+    Returns:
+        torch.Tensor: sparse (N, N) matrix whose row i is
+        ``sum_j S[i, j] * A[initial_rank[i, j]]``.
+    """
+    W = _row_sparse(initial_rank, S, A.size(0))
+    return torch.sparse.mm(W, A).coalesce()
+
+
+def _normalize_rows_(A):
+    """L2-normalizes the rows of a coalesced sparse matrix in place."""
+    rows = A.indices()[0]
+    values = A.values()
+    norm = torch.zeros(A.size(0), device=values.device)
+    norm.index_add_(0, rows, values * values)
+    values.div_(norm.sqrt()[rows])
+    return A
+
+
+@torch.no_grad()
+def gnn_re_ranking(qf, gf, k1=26, k2=7, block_size=4096):
+    """Re-ranks query-gallery distances with GNN-based propagation.
+
+    This runs on CPU (or any device supporting sparse tensors) without the
+    CUDA extensions. Features are L2-normalized internally.
+
+    Args:
+        qf (torch.Tensor): 2-D query feature matrix.
+        gf (torch.Tensor): 2-D gallery feature matrix.
+        k1 (int, optional): size of the neighbour lists forming the
+            adjacency matrix. Default is 26 (Market-1501).
+        k2 (int, optional): number of neighbours aggregated by propagation.
+            Default is 7 (Market-1501).
+        block_size (int, optional): number of rows whose similarities are
+            computed at once. Default is 4096.
+
+    Returns:
+        numpy.ndarray: distance matrix (1 - cosine similarity of the
+        propagated adjacency vectors) of shape (num_query, num_gallery).
+
+    Examples::
+        >>> from torchreid.utils import gnn_re_ranking
+        >>> distmat = gnn_re_ranking(qf, gf, k1=26, k2=7)
+    """
+    query_num = qf.size(0)
+    X_u = F.normalize(torch.cat((qf, gf), 0).float(), p=2, dim=1)
+
+    # initial ranking list
+    S, initial_rank = _topk_similarity(X_u, min(k1, X_u.size(0)), block_size)
+    del X_u
+
+    # stage 1
+    A = build_adjacency_matrix(initial_rank)
+    S = S * S
+
+    # stage 2
+    if k2 != 1:
+        for i in range(2):
+            A = (A + A.t()).coalesce()
+            A = gnn_propagate(
+                A, initial_rank[:, :k2].contiguous(), S[:, :k2].contiguous()
+            )
+            A = _normalize_rows_(A)
+
+    # the propagated rows are too dense for sparse products to pay off,
+    # so similarities are computed with dense blocks of rows
+    num = A.size(0)
+    rows, cols = A.indices()
+    values = A.values()
+    row_ptr = F.pad(torch.bincount(rows, minlength=num).cumsum(0), (1, 0))
+
+    def _dense_rows(start, end):
+        lo, hi = row_ptr[start], row_ptr[end]
+        out = torch.zeros(end - start, num)
+        out[rows[lo:hi] - start, cols[lo:hi]] = values[lo:hi]
+        return out
+
+    A_q = _dense_rows(0, query_num)
+    cosine_similarity = torch.zeros(query_num, num - query_num)
+    for start in range(query_num, num, block_size):
+        end = min(start + block_size, num)
+        cosine_similarity[:, start - query_num:end - query_num] = torch.mm(
+            A_q, _dense_rows(start, end).t()
+        )
+    return (1 - cosine_similarity).numpy()
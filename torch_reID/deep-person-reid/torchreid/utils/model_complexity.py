@@ -1,11 +1,12 @@
 from __future__ import division, print_function, absolute_import
 import math
+import time
 import numpy as np
 from itertools import repeat
-from collections import namedtuple, defaultdict
+from collections import OrderedDict, namedtuple, defaultdict
 import torch
 
-__all__ = ['compute_model_complexity']
+__all__ = ['compute_model_complexity', 'profile_model', 'print_profile']
 """
 Utility
 """
@@ -361,3 +362,275 @@ def compute_model_complexity(
         print('  {}'.format('-' * num_udscore))
 
     return total_params, total_flops
+
+
+"""
+Runtime profiling
+"""
+
+
+def _nbytes(y):
+    if isinstance(y, torch.Tensor):
+        return y.numel() * y.element_size()
+    if isinstance(y, (tuple, list)):
+        return sum(_nbytes(v) for v in y)
+    if isinstance(y, dict):
+        return sum(_nbytes(v) for v in y.values())
+    return 0
+
+
+def profile_model(
+    model,
+    input_size,
+    num_iters=10,
+    warmup=2,
+    only_conv_linear=True,
+    verbose=False
+):
+    """Profiles the runtime of each module.
+
+    Forward hooks record, for every module (containers such as OSNet blocks
+    included), the number of calls, the wall-clock time including children
+    ("total") and excluding children ("self"), the bytes of the output
+    activations, the parameters and the FLOPs (counted as in
+    ``compute_model_complexity``, and summed over children for containers).
+    Statistics are also aggregated per module type, using self times so that
+    nested modules are not counted twice.
+
+    .. note::
+        Hooks add a small overhead to each call, so very cheap layers appear
+        slightly slower than they are. Operations applied outside of modules
+        in ``forward()`` (e.g. additions, ``torch.cat``) are counted in the
+        self time of the calling module.
+
+    Args:
+        model (nn.Module): network model.
+        input_size (tuple): input size, e.g. (1, 3, 256, 128).
+        num_iters (int, optional): number of profiled forward passes, times
+            are averaged over them. Default is 10.
+        warmup (int, optional): number of forward passes before profiling.
+            Default is 2.
+        only_conv_linear (bool, optional): only considers convolution and
+            linear layers when counting flops. Default is True.
+        verbose (bool, optional): prints the profile with ``print_profile``.
+            Default is False.
+
+    Returns:
+        dict: JSON-serializable profile with keys "input_size", "num_iters",
+        "total_ms" (time of one forward pass), "modules" (list of per-module
+        statistics in registration order) and "types" (list of per-type
+        statistics sorted by self time). Times are in milliseconds per
+        forward pass, calls and bytes are per forward pass.
+
+    Examples::
+        >>> from torchreid import models, utils
+        >>> model = models.build_model(name='osnet_x1_0', num_classes=1000)
+        >>> profile = utils.profile_model(model, (1, 3, 256, 128))
+        >>> utils.print_profile(profile, sort_by='self_ms', topk=20)
+        >>> json.dump(profile, open('profile.json', 'w'))
+    """
+    flops_counter = _get_flops_counter(only_conv_linear)
+    param = next(model.parameters(), None)
+    is_cuda = param is not None and param.is_cuda
+
+    def _now():
+        if is_cuda:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    stats = OrderedDict()
+    stack = [] # [start time, children time, children flops] per open call
+    recording = [False]
+    handles = []
+
+    def _pre_hook(m, x):
+        if recording[0]:
+            stack.append([_now(), 0., 0])
+
+    def _make_hook(name, is_leaf):
+
+        def _hook(m, x, y):
+            if not recording[0]:
+                return
+            elapsed = _now()
+            start, children_time, children_flops = stack.pop()
+            elapsed -= start
+            class_name = m.__class__.__name__
+            flops = children_flops
+            if is_leaf and class_name in flops_counter:
+                flops += flops_counter[class_name](m, x, y)
+            record = stats[name]
+            record['calls'] += 1
+            record['total_ms'] += elapsed * 1000
+            record['self_ms'] += (elapsed-children_time) * 1000
+            record['output_bytes'] += _nbytes(y)
+            record['flops'] += flops
+            if stack:
+                stack[-1][1] += elapsed
+                stack[-1][2] += flops
+
+        return _hook
+
+    for name, m in model.named_modules():
+        is_leaf = len(list(m.children())) == 0
+        stats[name] = dict(
+            name=name or m.__class__.__name__,
+            type=m.__class__.__name__,
+            depth=0 if not name else name.count('.') + 1,
+            calls=0,
+            total_ms=0.,
+            self_ms=0.,
+            output_bytes=0,
+            params=sum(p.numel() for p in m.parameters()),
+            own_params=sum(p.numel() for p in m.parameters(recurse=False)),
+            flops=0
+        )
+        handles.append(m.register_forward_pre_hook(_pre_hook))
+        handles.append(m.register_forward_hook(_make_hook(name, is_leaf)))
+
+    default_train_mode = model.training
+    model.eval()
+    input = torch.rand(input_size)
+    if is_cuda:
+        input = input.cuda()
+    try:
+        with torch.no_grad():
+            for _ in range(warmup):
+                model(input)
+            recording[0] = True
+            for _ in range(num_iters):
+                model(input)
+    finally:
+        for handle in handles:
+            handle.remove()
+        model.train(default_train_mode)
+
+    modules = []
+    for record in stats.values():
+        if record['calls'] == 0:
+            continue # unused at test time, e.g. classifier
+        for key in ['calls', 'total_ms', 'self_ms', 'output_bytes', 'flops']:
+            record[key] /= num_iters
+        for key in ['calls', 'output_bytes', 'flops']:
+            record[key] = int(round(record[key]))
+        modules.append(record)
+
+    types = OrderedDict()
+    for record in modules:
+        t = types.setdefault(
+            record['type'],
+            dict(
+                type=record['type'],
+                count=0,
+                calls=0,
+                self_ms=0.,
+                output_bytes=0,
+                params=0,
+                flops=0
+            )
+        )
+        t['count'] += 1
+        t['calls'] += record['calls']
+        t['self_ms'] += record['self_ms']
+        t['output_bytes'] += record['output_bytes']
+        t['params'] += record['own_params']
+        if record['params'] == record['own_params']:
+            t['flops'] += record['flops'] # leaf, avoids double counting
+
+    profile = {
+        'input_size': list(input_size),
+        'num_iters': num_iters,
+        'total_ms': modules[0]['total_ms'] if modules else 0.,
+        'modules': modules,
+        'types': sorted(
+            types.values(), key=lambda t: t['self_ms'], reverse=True
+        )
+    }
+    if verbose:
+        print_profile(profile)
+    return profile
+
+
+def print_profile(profile, sort_by='self_ms', topk=20, max_depth=None):
+    """Prints a profile from ``profile_model`` as tables.
+
+    Args:
+        profile (dict): output of ``profile_model``.
+        sort_by (str, optional): module statistic to sort by, e.g.
+            "self_ms", "total_ms" or "output_bytes". Default is "self_ms".
+        topk (int, optional): number of modules shown. Default is 20.
+        max_depth (int, optional): only shows modules up to this depth
+            (0 is the model, 1 its children, ...). Default is None.
+    """
+    total_ms = max(profile['total_ms'], 1e-12)
+    modules = [
+        m for m in profile['modules']
+        if max_depth is None or m['depth'] <= max_depth
+    ]
+    modules = sorted(modules, key=lambda m: m[sort_by], reverse=True)[:topk]
+    name_width = max([len(m['name']) for m in modules] + [6])
+
+    line = '  {}'.format('-' * (name_width+86))
+    print(line)
+    print(
+        '  Profile with input size {}, {:.2f} ms per forward pass'.format(
+            tuple(profile['input_size']), profile['total_ms']
+        )
+    )
+    print(line)
+    print(
+        '  {:<{w}}  {:<18} {:>5} {:>10} {:>10} {:>6} {:>10} {:>14}'.format(
+            'module',
+            'type',
+            'calls',
+            'total ms',
+            'self ms',
+            'self%',
+            'out MB',
+            'flops',
+            w=name_width
+        )
+    )
+    for m in modules:
+        print(
+            '  {:<{w}}  {:<18} {:>5} {:>10.3f} {:>10.3f} {:>5.1f}% '
+            '{:>10.3f} {:>14,}'.format(
+                m['name'],
+                m['type'][:18],
+                m['calls'],
+                m['total_ms'],
+                m['self_ms'],
+                100 * m['self_ms'] / total_ms,
+                m['output_bytes'] / 1024**2,
+                m['flops'],
+                w=name_width
+            )
+        )
+    print(line)
+    print(
+        '  {:<{w}}  {:>5} {:>5} {:>10} {:>6} {:>10} {:>14}'.format(
+            'type',
+            'count',
+            'calls',
+            'self ms',
+            'self%',
+            'out MB',
+            'flops',
+            w=name_width + 19
+        )
+    )
+    for t in profile['types']:
+        print(
+            '  {:<{w}}  {:>5} {:>5} {:>10.3f} {:>5.1f}% {:>10.3f} '
+            '{:>14,}'.format(
+                t['type'],
+                t['count'],
+                t['calls'],
+                t['self_ms'],
+                100 * t['self_ms'] / total_ms,
+                t['output_bytes'] / 1024**2,
+                t['flops'],
+                w=name_width + 19
+            )
+        )
+    print(line)
@@ -0,0 +1,146 @@
+from __future__ import division, print_function, absolute_import
+import copy
+import torch
+import torch.nn as nn
+
+from .torchtools import load_checkpoint, trace_for_inference
+
+__all__ = ['quantize_model', 'build_quantized_model', 'load_quantized_model']
+
+
+def _prepare(model, backend, input_size):
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx
+
+    if backend not in torch.backends.quantized.supported_engines:
+        raise ValueError(
+            'Quantization backend "{}" is not supported by this PyTorch build, '
+            'choose from {}'.format(
+                backend, torch.backends.quantized.supported_engines
+            )
+        )
+    torch.backends.quantized.engine = backend
+    if isinstance(model, nn.DataParallel):
+        model = model.module
+    model = copy.deepcopy(model).cpu().eval()
+    example_inputs = (torch.randn(*input_size), )
+    return prepare_fx(
+        trace_for_inference(model), get_default_qconfig_mapping(backend),
+        example_inputs
+    )
+
+
+def _convert(model):
+    from torch.ao.quantization.quantize_fx import convert_fx
+    return convert_fx(model).eval()
+
+
+def quantize_model(
+    model,
+    data_loader,
+    num_images=512,
+    backend='x86',
+    input_size=(1, 3, 256, 128),
+    verbose=True
+):
+    r"""Quantizes a model to int8 with post-training static quantization.
+
+    Observers are inserted with ``torch.ao`` FX graph mode quantization
+    (Conv-BN-ReLU sequences are fused beforehand), activation ranges are
+    calibrated on images from ``data_loader``, and the model is converted to
+    int8 kernels. Weights are quantized per channel and activations per
+    tensor. The quantized model runs on CPU.
+
+    Tested with ``osnet_x1_0``, ``osnet_ain_x1_0`` and ``mobilenetv2_x1_0``.
+
+    Args:
+        model (nn.Module): float model.
+        data_loader (DataLoader): calibration data yielding dictionaries with
+            key "img" (like ``ImageDataManager.test_loader[name]['query']``)
+            or image tensors.
+        num_images (int, optional): number of calibration images. A few
+            hundred is usually enough. Default is 512.
+        backend (str, optional): "x86" or "fbgemm" for x86 CPUs, "qnnpack"
+            for ARM CPUs. Default is "x86".
+        input_size (tuple, optional): input size used for tracing.
+        verbose (bool, optional): print progress. Default is True.
+
+    Returns:
+        torch.fx.GraphModule: quantized model in eval mode.
+
+    Examples::
+        >>> from torchreid.utils import quantize_model
+        >>> test_loader = datamanager.test_loader['market1501']['query']
+        >>> qmodel = quantize_model(model, test_loader, num_images=512)
+        >>> features = qmodel(images)
+        >>> torch.save({'state_dict': qmodel.state_dict()}, 'osnet_int8.pth')
+    """
+    prepared = _prepare(model, backend, input_size)
+
+    num_seen = 0
+    with torch.no_grad():
+        for data in data_loader:
+            imgs = data['img'] if isinstance(data, dict) else data
+            imgs = imgs[:num_images - num_seen].cpu()
+            prepared(imgs)
+            num_seen += imgs.size(0)
+            if num_seen >= num_images:
+                break
+    if num_seen == 0:
+        raise ValueError('data_loader is empty')
+    if verbose:
+        print(
+            'Calibrated {} ({}) on {} images'.format(
+                model.__class__.__name__, backend, num_seen
+            )
+        )
+
+    return _convert(prepared)
+
+
+def build_quantized_model(model, backend='x86', input_size=(1, 3, 256, 128)):
+    r"""Builds an uncalibrated quantized model with the structure produced
+    by ``quantize_model``, to load quantized weights into.
+
+    Args:
+        model (nn.Module): float model of the same architecture.
+        backend (str, optional): backend used for quantization.
+        input_size (tuple, optional): input size used for tracing.
+
+    Returns:
+        torch.fx.GraphModule: quantized model in eval mode.
+    """
+    prepared = _prepare(model, backend, input_size)
+    with torch.no_grad():
+        # initialize the observers, the values are overwritten when loading
+        prepared(torch.randn(*input_size))
+    return _convert(prepared)
+
+
+def load_quantized_model(
+    model, fpath, backend='x86', input_size=(1, 3, 256, 128)
+):
+    r"""Loads a model saved from ``quantize_model``.
+
+    Args:
+        model (nn.Module): float model of the same architecture.
+        fpath (str): path to the quantized weights, a state dict or a
+            checkpoint with key "state_dict".
+        backend (str, optional): backend used for quantization.
+        input_size (tuple, optional): input size used for tracing.
+
+    Returns:
+        torch.fx.GraphModule: quantized model in eval mode.
+
+    Examples::
+        >>> from torchreid.models import build_model
+        >>> from torchreid.utils import load_quantized_model
+        >>> model = build_model('osnet_x1_0', 1, pretrained=False)
+        >>> qmodel = load_quantized_model(model, 'osnet_int8.pth')
+    """
+    qmodel = build_quantized_model(model, backend, input_size)
+    checkpoint = load_checkpoint(fpath)
+    if 'state_dict' in checkpoint:
+        checkpoint = checkpoint['state_dict']
+    qmodel.load_state_dict(checkpoint)
+    return qmodel
@@ -2,7 +2,6 @@ from __future__ import print_function, absolute_import
 import numpy as np
 import shutil
 import os.path as osp
-import cv2
 
 from .tools import mkdir_if_missing
 
@@ -36,6 +35,8 @@ def visualize_ranked_results(
         topk (int, optional): denoting top-k images in the rank list to be visualized.
             Default is 10.
     """
+    import cv2
+
     num_q, num_g = distmat.shape
     mkdir_if_missing(save_dir)
 
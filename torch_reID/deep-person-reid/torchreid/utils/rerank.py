@@ -9,6 +9,10 @@ Modified by Houjing Huang, 2017-12-22.
 - This version accepts distance matrix instead of raw features.
 - The difference of `/` division between python 2 and 3 is handled.
 - numpy.float16 is replaced by numpy.float32 for numerical precision.
+Re-implemented with sparse matrices:
+- Only the k-nearest-neighbour lists are kept instead of the full ranking.
+- V is stored as a CSR matrix and query expansion is a sparse product.
+- The Jaccard term is only accumulated for pairs sharing a neighbour.
 
 CVPR2017 paper:Zhong Z, Zheng L, Cao D, et al. Re-ranking Person Re-identification with k-reciprocal Encoding[J]. 2017.
 url:http://openaccess.thecvf.com/content_cvpr_2017/papers/Zhong_Re-Ranking_Person_Re-Identification_CVPR_2017_paper.pdf
@@ -24,90 +28,198 @@ Returns:
 """
 from __future__ import division, print_function, absolute_import
 import numpy as np
+from scipy import sparse
 
 __all__ = ['re_ranking']
 
+# Maximum number of (row, column) entries processed at once. Each entry costs
+# ~40 bytes of temporary buffers.
+MAX_BLOCK_ENTRIES = 2**23
 
-def re_ranking(q_g_dist, q_q_dist, g_g_dist, k1=20, k2=6, lambda_value=0.3):
 
-    # The following naming, e.g. gallery_num, is different from outer scope.
-    # Don't care about it.
+class _DistanceMatrix(object):
+    """Read-only view of the (num_query + num_gallery) square distance
+    matrix assembled from its three blocks, without concatenating them."""
 
-    original_dist = np.concatenate(
-        [
-            np.concatenate([q_q_dist, q_g_dist], axis=1),
-            np.concatenate([q_g_dist.T, g_g_dist], axis=1)
-        ],
-        axis=0
+    def __init__(self, q_g_dist, q_q_dist, g_g_dist):
+        self.q_g_dist = np.asarray(q_g_dist)
+        self.q_q_dist = np.asarray(q_q_dist)
+        self.g_g_dist = np.asarray(g_g_dist)
+        self.query_num = self.q_g_dist.shape[0]
+        self.all_num = self.query_num + self.q_g_dist.shape[1]
+
+    def columns(self, start, end):
+        """Returns columns [start, end) transposed, i.e. of shape (end-start, all_num)."""
+        q = self.query_num
+        parts = []
+        if start < q:
+            qs, qe = start, min(end, q)
+            parts.append(
+                np.concatenate(
+                    [self.q_q_dist[:, qs:qe].T, self.q_g_dist[qs:qe]], axis=1
+                )
+            )
+        if end > q:
+            gs, ge = max(start, q) - q, end - q
+            parts.append(
+                np.concatenate(
+                    [self.q_g_dist[:, gs:ge].T, self.g_g_dist[:, gs:ge].T],
+                    axis=1
+                )
+            )
+        return np.concatenate(parts, axis=0)
+
+    def entries(self, rows, cols):
+        """Returns entries at (rows, cols)."""
+        q = self.query_num
+        out = np.empty(len(rows), dtype=self.q_g_dist.dtype)
+        rq, cq = rows < q, cols < q
+        mask = rq & cq
+        out[mask] = self.q_q_dist[rows[mask], cols[mask]]
+        mask = rq & ~cq
+        out[mask] = self.q_g_dist[rows[mask], cols[mask] - q]
+        mask = ~rq & cq
+        out[mask] = self.q_g_dist[cols[mask], rows[mask] - q]
+        mask = ~rq & ~cq
+        out[mask] = self.g_g_dist[rows[mask] - q, cols[mask] - q]
+        return out
+
+
+def _k_reciprocal(initial_rank, k):
+    """Returns a boolean CSR matrix whose row i marks the k-reciprocal
+    neighbours of i, i.e. j in the top-(k+1) of i and i in the top-(k+1) of j."""
+    all_num = initial_rank.shape[0]
+    forward = initial_rank[:, :k + 1]
+    # fewer than k+1 columns when all_num <= k
+    rows = np.repeat(np.arange(all_num), forward.shape[1])
+    cols = forward.reshape(-1)
+    K = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=bool), (rows, cols)),
+        shape=(all_num, all_num)
+    )
+    return K.multiply(K.T).tocsr()
+
+
+def re_ranking(
+    q_g_dist,
+    q_q_dist,
+    g_g_dist,
+    k1=20,
+    k2=6,
+    lambda_value=0.3,
+    block_size=None
+):
+    """Re-ranks the query-gallery distance matrix with k-reciprocal encoding.
+
+    Memory is O(N * k1) plus the sparse V, where N = num_query + num_gallery,
+    and O(block_size * N) for temporary buffers, instead of O(N^2).
+
+    Args:
+        q_g_dist (numpy.ndarray): query-gallery distance matrix.
+        q_q_dist (numpy.ndarray): query-query distance matrix.
+        g_g_dist (numpy.ndarray): gallery-gallery distance matrix.
+        k1 (int, optional): size of the nearest-neighbour lists. Default is 20.
+        k2 (int, optional): size of the query expansion. Default is 6.
+        lambda_value (float, optional): weight of the original distance.
+            Default is 0.3.
+        block_size (int, optional): number of rows processed at once.
+            Default is None (``MAX_BLOCK_ENTRIES // N``).
+
+    Returns:
+        numpy.ndarray: re-ranked distance matrix of shape (num_query, num_gallery).
+    """
+    D = _DistanceMatrix(q_g_dist, q_q_dist, g_g_dist)
+    query_num, all_num = D.query_num, D.all_num
+    num_neighbors = min(max(k1 + 1, k2), all_num)
+    if block_size is None:
+        block_size = MAX_BLOCK_ENTRIES // all_num
+    block_size = max(int(block_size), 1)
+
+    # original_dist[i, j] = dist[j, i]^2 / max_k dist[k, i]^2, only the
+    # normalizers and the nearest-neighbour lists are kept
+    max_dist = np.zeros(all_num, dtype=np.float32)
+    initial_rank = np.zeros((all_num, num_neighbors), dtype=np.int64)
+    for start in range(0, all_num, block_size):
+        end = min(start + block_size, all_num)
+        dist = np.power(D.columns(start, end), 2).astype(np.float32)
+        max_dist[start:end] = dist.max(axis=1)
+        if num_neighbors < all_num:
+            part = np.argpartition(dist, num_neighbors - 1, axis=1)
+            part = part[:, :num_neighbors]
+        else:
+            part = np.tile(np.arange(all_num), (end - start, 1))
+        order = np.argsort(
+            np.take_along_axis(dist, part, axis=1), axis=1, kind='stable'
+        )
+        initial_rank[start:end] = np.take_along_axis(part, order, axis=1)
+
+    def original_dist(rows, cols):
+        dist = np.power(D.entries(cols, rows), 2).astype(np.float32)
+        return dist / max_dist[rows]
+
+    # k-reciprocal neighbours and their expansion with the k-reciprocal
+    # neighbours (k1/2) of candidates overlapping by more than 2/3
+    R = _k_reciprocal(initial_rank, k1)
+    R_half = _k_reciprocal(initial_rank, int(np.around(k1 / 2.)))
+    overlap = (R.astype(np.int32) @ R_half.T.astype(np.int32)).tocsr()
+    overlap = overlap.multiply(R).tocsr()
+    half_size = np.diff(R_half.indptr)
+    rows = np.repeat(np.arange(all_num), np.diff(overlap.indptr))
+    accept = overlap.data > 2. / 3 * half_size[overlap.indices]
+    A = sparse.csr_matrix(
+        (np.ones(accept.sum(), dtype=np.int32),
+         (rows[accept], overlap.indices[accept])),
+        shape=(all_num, all_num)
     )
-    original_dist = np.power(original_dist, 2).astype(np.float32)
-    original_dist = np.transpose(
-        1. * original_dist / np.max(original_dist, axis=0)
+    E = (R.astype(np.int32) + A @ R_half.astype(np.int32)).tocsr()
+
+    # V[i, j] = exp(-original_dist[i, j]) normalized over the expansion of i
+    rows = np.repeat(np.arange(all_num), np.diff(E.indptr))
+    weight = np.exp(-original_dist(rows, E.indices))
+    weight /= np.bincount(rows, weights=weight, minlength=all_num)[rows]
+    V = sparse.csr_matrix(
+        (weight.astype(np.float32), E.indices, E.indptr),
+        shape=(all_num, all_num)
     )
-    V = np.zeros_like(original_dist).astype(np.float32)
-    initial_rank = np.argsort(original_dist).astype(np.int32)
-
-    query_num = q_g_dist.shape[0]
-    gallery_num = q_g_dist.shape[0] + q_g_dist.shape[1]
-    all_num = gallery_num
-
-    for i in range(all_num):
-        # k-reciprocal neighbors
-        forward_k_neigh_index = initial_rank[i, :k1 + 1]
-        backward_k_neigh_index = initial_rank[forward_k_neigh_index, :k1 + 1]
-        fi = np.where(backward_k_neigh_index == i)[0]
-        k_reciprocal_index = forward_k_neigh_index[fi]
-        k_reciprocal_expansion_index = k_reciprocal_index
-        for j in range(len(k_reciprocal_index)):
-            candidate = k_reciprocal_index[j]
-            candidate_forward_k_neigh_index = initial_rank[
-                candidate, :int(np.around(k1 / 2.)) + 1]
-            candidate_backward_k_neigh_index = initial_rank[
-                candidate_forward_k_neigh_index, :int(np.around(k1 / 2.)) + 1]
-            fi_candidate = np.where(
-                candidate_backward_k_neigh_index == candidate
-            )[0]
-            candidate_k_reciprocal_index = candidate_forward_k_neigh_index[
-                fi_candidate]
-            if len(
-                np.
-                intersect1d(candidate_k_reciprocal_index, k_reciprocal_index)
-            ) > 2. / 3 * len(candidate_k_reciprocal_index):
-                k_reciprocal_expansion_index = np.append(
-                    k_reciprocal_expansion_index, candidate_k_reciprocal_index
-                )
 
-        k_reciprocal_expansion_index = np.unique(k_reciprocal_expansion_index)
-        weight = np.exp(-original_dist[i, k_reciprocal_expansion_index])
-        V[i, k_reciprocal_expansion_index] = 1. * weight / np.sum(weight)
-    original_dist = original_dist[:query_num, ]
     if k2 != 1:
-        V_qe = np.zeros_like(V, dtype=np.float32)
-        for i in range(all_num):
-            V_qe[i, :] = np.mean(V[initial_rank[i, :k2], :], axis=0)
-        V = V_qe
-        del V_qe
+        # V_qe[i] = mean of V over the k2 nearest neighbours of i
+        S = sparse.csr_matrix(
+            (
+                np.full(all_num * k2, 1. / k2, dtype=np.float32),
+                initial_rank[:, :k2].reshape(-1),
+                np.arange(0, all_num*k2 + 1, k2)
+            ),
+            shape=(all_num, all_num)
+        )
+        V = (S @ V).tocsr()
     del initial_rank
-    invIndex = []
-    for i in range(gallery_num):
-        invIndex.append(np.where(V[:, i] != 0)[0])
-
-    jaccard_dist = np.zeros_like(original_dist, dtype=np.float32)
-
-    for i in range(query_num):
-        temp_min = np.zeros(shape=[1, gallery_num], dtype=np.float32)
-        indNonZero = np.where(V[i, :] != 0)[0]
-        indImages = []
-        indImages = [invIndex[ind] for ind in indNonZero]
-        for j in range(len(indNonZero)):
-            temp_min[0, indImages[j]] = temp_min[0, indImages[j]] + np.minimum(
-                V[i, indNonZero[j]], V[indImages[j], indNonZero[j]]
-            )
-        jaccard_dist[i] = 1 - temp_min / (2.-temp_min)
 
-    final_dist = jaccard_dist * (1-lambda_value) + original_dist*lambda_value
-    del original_dist
-    del V
-    del jaccard_dist
-    final_dist = final_dist[:query_num, query_num:]
+    # jaccard_dist[i, j] = 1 - m / (2 - m) with m = sum_k min(V[i, k], V[j, k])
+    # m is accumulated from the inverted index (columns of V) restricted to
+    # gallery rows, only for pairs sharing at least one non-zero column
+    gallery_num = all_num - query_num
+    V_g = V[query_num:].tocsc()
+    final_dist = np.zeros((query_num, gallery_num), dtype=np.float32)
+    for start in range(0, query_num, block_size):
+        end = min(start + block_size, query_num)
+        V_q = V[start:end].tocoo()
+        col_start = V_g.indptr[V_q.col]
+        col_len = V_g.indptr[V_q.col + 1] - col_start
+        entry = np.repeat(np.arange(V_q.nnz), col_len)
+        pos = np.repeat(col_start - np.cumsum(col_len) + col_len, col_len) \
+            + np.arange(len(entry))
+        temp_min = np.bincount(
+            V_q.row[entry] * gallery_num + V_g.indices[pos],
+            weights=np.minimum(V_q.data[entry], V_g.data[pos]),
+            minlength=(end-start) * gallery_num
+        ).reshape(end - start, gallery_num).astype(np.float32)
+        jaccard_dist = 1 - temp_min / (2.-temp_min)
+
+        rows = np.repeat(np.arange(start, end), gallery_num)
+        cols = np.tile(np.arange(query_num, all_num), end - start)
+        dist = original_dist(rows, cols).reshape(end - start, gallery_num)
+        final_dist[start:end] = jaccard_dist * (1-lambda_value) \
+            + dist*lambda_value
+
     return final_dist
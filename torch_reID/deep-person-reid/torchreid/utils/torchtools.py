@@ -1,19 +1,23 @@
 from __future__ import division, print_function, absolute_import
+import copy
 import pickle
 import shutil
+import inspect
 import os.path as osp
 import warnings
 from functools import partial
 from collections import OrderedDict
 import torch
 import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval, fuse_linear_bn_eval
 
 from .tools import mkdir_if_missing
 
 __all__ = [
     'save_checkpoint', 'load_checkpoint', 'resume_from_checkpoint',
     'open_all_layers', 'open_specified_layers', 'count_num_param',
-    'load_pretrained_weights'
+    'load_pretrained_weights', 'optimize_for_inference',
+    'trace_for_inference'
 ]
 
 
@@ -310,3 +314,163 @@ def load_pretrained_weights(model, weight_path):
                 'due to unmatched keys or layer size: {}'.
                 format(discarded_layers)
             )
+
+
+def _fold_batchnorm(gm):
+    modules = dict(gm.named_modules())
+    num_calls = {}
+    for node in gm.graph.nodes:
+        if node.op == 'call_module':
+            num_calls[node.target] = num_calls.get(node.target, 0) + 1
+
+    def _single_call_module(node, types):
+        return isinstance(node, torch.fx.Node) and node.op == 'call_module' \
+            and isinstance(modules[node.target], types) \
+            and num_calls[node.target] == 1
+
+    for node in list(gm.graph.nodes):
+        if node.op == 'call_module':
+            module = modules[node.target]
+        elif node.op == 'call_function' and \
+                node.target is nn.functional.dropout:
+            # F.dropout(x, p, training=False) is an identity
+            if not node.kwargs.get('training', True) or \
+                    (len(node.args) > 2 and node.args[2] is False):
+                node.replace_all_uses_with(node.args[0])
+                gm.graph.erase_node(node)
+            continue
+        else:
+            continue
+
+        if isinstance(module, (nn.Dropout, nn.Dropout2d, nn.Identity)):
+            node.replace_all_uses_with(node.args[0])
+            gm.graph.erase_node(node)
+
+        elif isinstance(module, nn.modules.batchnorm._BatchNorm) and \
+                module.track_running_stats and num_calls[node.target] == 1:
+            prev = node.args[0]
+            if not _single_call_module(prev, (nn.Conv1d, nn.Conv2d, nn.Linear)) \
+                    or len(prev.users) > 1:
+                continue
+            layer = modules[prev.target]
+            if isinstance(layer, nn.Linear):
+                if not isinstance(module, nn.BatchNorm1d):
+                    continue
+                fused = fuse_linear_bn_eval(layer, module)
+            else:
+                fused = fuse_conv_bn_eval(layer, module)
+            parent, _, name = prev.target.rpartition('.')
+            setattr(gm.get_submodule(parent), name, fused)
+            modules[prev.target] = fused
+            node.replace_all_uses_with(prev)
+            gm.graph.erase_node(node)
+
+        elif isinstance(module, nn.ReLU) and not module.inplace:
+            # the output of a folded layer is not used anywhere else
+            prev = node.args[0]
+            if num_calls[node.target] == 1 and len(prev.users) == 1 and \
+                    _single_call_module(prev, (nn.Conv1d, nn.Conv2d, nn.Linear)):
+                module.inplace = True
+
+    gm.graph.lint()
+    gm.delete_all_unused_submodules()
+    gm.recompile()
+    return gm
+
+
+def trace_for_inference(module):
+    r"""Traces a module with ``torch.fx`` for inference.
+
+    Arguments of ``forward`` which have a default value, e.g.
+    ``return_featuremaps``, are fixed to it so that they do not reach
+    control flow as traced variables.
+
+    Args:
+        module (nn.Module): module in eval mode.
+
+    Returns:
+        torch.fx.GraphModule: traced module.
+    """
+    try:
+        params = inspect.signature(module.forward).parameters
+    except (TypeError, ValueError):
+        params = {}
+    concrete_args = {
+        name: p.default
+        for name, p in params.items()
+        if p.default is not inspect.Parameter.empty
+    }
+    return torch.fx.symbolic_trace(module, concrete_args=concrete_args)
+
+
+def _optimize_module(module):
+    if len(list(module.children())) == 0:
+        return module
+    try:
+        gm = trace_for_inference(module)
+    except Exception:
+        # data-dependent control flow, untraceable code, etc.: optimize
+        # the submodules separately
+        for name, child in module.named_children():
+            setattr(module, name, _optimize_module(child))
+        return module
+    return _fold_batchnorm(gm)
+
+
+def optimize_for_inference(
+    model, input_size=(1, 3, 256, 128), verify=True, atol=1e-4, rtol=1e-3
+):
+    r"""Optimizes a model for inference.
+
+    The model is traced with ``torch.fx`` in eval mode, then
+
+    - BatchNorm layers are folded into the preceding conv/linear layers,
+    - Dropout and Identity layers are removed,
+    - ReLU layers following a folded layer are made in-place, so a
+      Conv-BN-ReLU sequence becomes a single conv followed by an in-place
+      ReLU.
+
+    Modules which cannot be traced as a whole (e.g. because of
+    data-dependent control flow) are optimized submodule by submodule.
+
+    Args:
+        model (nn.Module): network model, left unchanged.
+        input_size (tuple, optional): size of the random input used for
+            verification. Default is (1, 3, 256, 128).
+        verify (bool, optional): whether to check that the optimized model
+            produces the same output as the original one. Default is True.
+        atol (float, optional): absolute tolerance for verification.
+        rtol (float, optional): tolerance relative to the largest output
+            magnitude for verification.
+
+    Returns:
+        nn.Module: optimized model, in eval mode. It only supports inference,
+        i.e. ``model(x)`` returning features.
+
+    Examples::
+        >>> from torchreid.utils import optimize_for_inference
+        >>> model = optimize_for_inference(model, input_size=(1, 3, 256, 128))
+        >>> features = model(images)
+    """
+    if isinstance(model, nn.DataParallel):
+        model = model.module
+    model.eval()
+    optimized = _optimize_module(copy.deepcopy(model))
+    optimized.eval()
+
+    if verify:
+        param = next(model.parameters(), None)
+        device = param.device if param is not None else 'cpu'
+        x = torch.randn(*input_size, device=device)
+        with torch.no_grad():
+            expected = model(x)
+            output = optimized(x)
+        error = (expected - output).abs().max().item()
+        tolerance = atol + rtol * expected.abs().max().item()
+        if error > tolerance:
+            raise RuntimeError(
+                'Optimized model differs from the original one '
+                '(max abs error {:.3g} > {:.3g})'.format(error, tolerance)
+            )
+
+    return optimized